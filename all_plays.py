@@ -0,0 +1,219 @@
+# import pandas and numpy
+import numpy as np
+import pandas as pd
+
+from description_parser import add_description_columns
+from encoding import registry
+from game_clock import add_clock
+from game_store import GameStore
+from next_score import add_next_score
+from pbp_loader import load_pbp, to_pipeline_frames
+from stage_profiler import unprofiled
+
+# Columns (and order) of the play by play csv used by the pipeline
+pbpCols = ['gameID',
+           'gameDate',
+           'quarter',
+           'minute',
+           'second',
+           'offTeam',
+           'defTeam',
+           'down',
+           'toGo',
+           'yardLine',
+           'seriesFirstDown',
+           'nextScore',
+           'description',
+           'teamWin',
+           'seasonYear',
+           'yards',
+           'formation',
+           'playType',
+           'isRush',
+           'isPass',
+           'isIncomplete',
+           'passType',
+           'isSack',
+           'isChallenge',
+           'isChallengeReversed',
+           'challenger',
+           'isMeasurement',
+           'isInterception',
+           'isFumble',
+           'isPenalty',
+           'isTwoPointConversion',
+           'isTwoPointConversionSuccessful',
+           'rushDirection',
+           'yardLineFixed',
+           'yardLineDirection',
+           'isPenaltyAccepted',
+           'penaltyTeam',
+           'isNoPlay',
+           'penaltyType',
+           'penaltyYards']
+
+# Player name columns parsed from play descriptions, unless pbp supplies them
+nameCols = ['rushingPlayerName', 'passingPlayerName', 'targetPlayerName']
+
+# Timeouts remaining for the offense and defense, kept when pbp supplies them (NaN otherwise)
+timeoutCols = ['offTimeoutsRem', 'defTimeoutsRem']
+
+# Game columns every play carries: week (to partition and group plays by) and homeTeam (for homeTeamPoss); the other
+# sched columns (winner, isTie, points, yards, ...) are looked up by gameID through a game_store.GameStore
+playGameCols = ['week', 'homeTeam']
+
+# Running home and away scores after each play, kept when pbp supplies them (summed from the scoring plays otherwise,
+# which credits every score to the offense and counts touchdowns nullified by penalties)
+scoreCols = ['homeScoreCum', 'awayScoreCum']
+
+# Sort allPlays in play order (stable, so plays with the same clock keep their source order)
+def sort_all_plays(allPlays):
+    return allPlays.sort_values(by=['gameID', 'gameDate', 'quarter', 'minute', 'second', 'down'],
+                                ascending=[True, True, True, False, False, True], kind='stable')
+
+
+# Calculate score differential columns from homeScoreCum, awayScoreCum and homeTeamPoss
+def add_score_diffs(allPlays):
+    allPlays['homeScoreDiff'] = allPlays.homeScoreCum - allPlays.awayScoreCum
+    allPlays['awayScoreDiff'] = allPlays.homeScoreDiff * -1
+    # The offense's margin is the home margin when the home team has the ball and the away margin otherwise (0 on plays
+    # without an offense)
+    allPlays['offScoreDiff'] = allPlays.homeScoreDiff * (2 * allPlays.homeTeamPoss - 1) * allPlays.offTeam.notnull()
+    allPlays['absScoreDiff'] = allPlays.offScoreDiff.abs().astype(int)
+    return allPlays
+
+
+# Return whether each play of allPlays is used to estimate expected points (epPlaySet): first and third quarter snaps
+# that are not kick offs, two minute warnings or no plays, with an offensive team and absScoreDiff <= 10
+def ep_play_mask(allPlays):
+    return (~allPlays.quarter.isin([2, 4, 5]) &
+            (allPlays.playType != 'KICK OFF') &
+            (allPlays.isTwoMinWarning != 1) &
+            (allPlays.absScoreDiff <= 10) &
+            (allPlays.isNoPlay != 1) &
+            allPlays.offTeam.notnull())
+
+
+# Return the plays of allPlays used to estimate expected points (epPlaySet, see ep_play_mask)
+def ep_play_set(allPlays):
+    epPlaySet = allPlays[ep_play_mask(allPlays)].copy()
+    epPlaySet['offTeamIsNull'] = 0
+    return epPlaySet
+
+
+# Read the play by play (pbp) and schedule (sched) data frames the pipeline starts from
+# With schedPath, pbpPath is a play by play csv indexed by playID and schedPath a schedule csv indexed by gameID;
+# without it, pbpPath is an nflscrapR csv and both frames are derived from it
+# profiler: optional stage_profiler.StageProfiler the stages are run under
+def read_source(pbpPath, schedPath=None, profiler=None):
+    stage = profiler.run if profiler is not None else unprofiled
+    if schedPath is None:
+        return stage('pipeline frames', to_pipeline_frames, stage('load csv', load_pbp, pbpPath))
+    pbp = stage('load csv', pd.read_csv, pbpPath, index_col='playID')
+    sched = stage('load schedule', pd.read_csv, schedPath, index_col='gameID')
+    return pbp, sched
+
+
+# Parse the play descriptions once for rushingPlayerName / passingPlayerName / targetPlayerName and the binary columns
+# for timeouts, two minute warnings, ends of quarters, touchdowns, extra points, field goals and safeties, keeping the
+# player names, timeouts and running scores pbp supplies (see pbp_loader.to_pipeline_frames)
+def add_play_columns(pbp):
+
+    # Keep the player names pbp supplies, then change order of columns in pbp
+    sourceNames = pbp.reindex(columns=nameCols)
+    sourceTimeouts = pbp.reindex(columns=timeoutCols)
+    sourceScores = pbp.reindex(columns=scoreCols)
+    pbp = pbp[pbpCols]
+
+    # Drop 'challenger' (empty column)
+    allPlays = pbp.drop('challenger', axis=1)
+
+    allPlays = add_description_columns(allPlays)
+    for col in nameCols:
+        names = sourceNames[col].astype(object).fillna(allPlays[col].astype(object))
+        allPlays[col] = names.where(names.notna())
+    allPlays[timeoutCols] = sourceTimeouts.astype('float64')
+    allPlays[scoreCols] = sourceScores.astype('float64')
+
+    # Create binary column for whether a pass attempt was completed (isComplete)
+    allPlays.insert(allPlays.columns.get_loc('targetPlayerName') + 1, 'isComplete',
+                    allPlays.isPass - allPlays.isIncomplete)
+    return allPlays
+
+
+# Add the field position, scoring, possession, running score and team code columns to sorted allPlays
+def add_score_columns(allPlays):
+
+    # Add binary columns for goal to go, red zone and whether halfSecRem <= 120 (2 min)
+    allPlays['isGoalToGo'] = (allPlays.yardLine >= 90).astype(int)
+    allPlays['isRedZone'] = (allPlays.yardLine > 80).astype(int)
+    allPlays['isUTM'] = (allPlays.halfSecRem <= 120).astype(int)
+
+    # Calculate scoring impact of each play in new column (scorePlay) in allPlays
+    allPlays['scorePlay'] = allPlays.isTouchdown * 6 + \
+        allPlays.isExtraPointSuccessful * 1 + \
+        allPlays.isTwoPointConversionSuccessful * 2 + \
+        allPlays.isSafety * 2 + \
+        allPlays.isFieldGoalSuccessful * 3
+
+    # Establish binary columns in allPlays for whether homeTeam or awayTeam on offense
+    allPlays['homeTeamPoss'] = (allPlays.offTeam == allPlays.homeTeam).astype(int)
+    allPlays['awayTeamPoss'] = 1 - allPlays.homeTeamPoss
+
+    # Attribute scorePlay to one of two new columns: one for home team score and the other for away team score
+    allPlays['homeScorePlay'] = allPlays.homeTeamPoss * allPlays.scorePlay
+    allPlays['awayScorePlay'] = allPlays.awayTeamPoss * allPlays.scorePlay
+
+    # Take the running scores pbp supplies (carried forward by gameID over plays without one), otherwise calculate
+    # cumulative sum of home and away team scoring plays by gameID
+    for col, playCol in [('homeScoreCum', 'homeScorePlay'), ('awayScoreCum', 'awayScorePlay')]:
+        scores = allPlays.pop(col)
+        if scores.notnull().any():
+            allPlays[col] = scores.groupby(allPlays.gameID).ffill().fillna(0).astype('int64')
+        else:
+            allPlays[col] = allPlays.groupby(['gameID'])[playCol].cumsum()
+
+    # Calculate score differential for home team, away team, offensive team and defensive team by play
+    allPlays = add_score_diffs(allPlays)
+
+    # Replace 0 with NaN in scorePlay and establish binary column for whether a play is a scoring play
+    allPlays['scorePlay'] = allPlays.scorePlay.replace({0: np.nan})
+    allPlays['isScore'] = allPlays.isTouchdown * 1 + \
+        allPlays.isExtraPointSuccessful * 1 + \
+        allPlays.isTwoPointConversionSuccessful * 1 + \
+        allPlays.isSafety * 1 + \
+        allPlays.isFieldGoalSuccessful * 1
+
+    # Establish new column in allPlays indicating the scoring team (scoreTeam) for each scoring play (isScore)
+    allPlays['scoreTeam'] = allPlays.offTeam.where(allPlays.isScore > 0)
+
+    # Encode scoreTeam, offTeam and defTeam as int32 codes of the shared registry: test 8.py's teamCodeMap codes (ARI 1
+    # to WAS 32), -1 where there is no team
+    allPlays['scoreTeamCode'] = registry.encode('team', allPlays.scoreTeam)
+    allPlays['offTeamCode'] = registry.encode('team', allPlays.offTeam)
+    allPlays['defTeamCode'] = registry.encode('team', allPlays.defTeam)
+    return allPlays
+
+
+# Attach playGameCols of each play's game by position (keeping the playID index), dropping plays of games sched does
+# not have
+def add_game_columns(allPlays, sched):
+    return GameStore(sched).attach(allPlays, playGameCols)
+
+
+# Build the enriched play by play data frame (allPlays) from pbp and sched, one named stage at a time
+# profiler: optional stage_profiler.StageProfiler the stages are run under
+def build_all_plays(pbp, sched, profiler=None):
+    stage = profiler.run if profiler is not None else unprofiled
+    allPlays = stage('descriptions', add_play_columns, pbp)
+
+    # Calculate and insert columns into allPlays for qtrSecRem, gmSecRem and halfSecRem (overtime counts its own clock)
+    allPlays = stage('clock', add_clock, allPlays)
+    allPlays = stage('games', add_game_columns, allPlays, sched)
+
+    # Sort allPlays for print and analysis
+    allPlays = stage('sort', sort_all_plays, allPlays)
+    allPlays = stage('scores', add_score_columns, allPlays)
+
+    # Back fill nextScore and nextScoreTeamCode by gameID and half and sign nextScore by offTeam
+    return stage('next score', add_next_score, allPlays)
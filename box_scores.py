@@ -0,0 +1,114 @@
+# import sys, time, numpy and pandas
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from nflgame_fetch import statAttrs
+from pbp_loader import game_weeks, load_pbp
+
+# Player stat columns of nfl v11.py (everything but the player's name, position, team and id)
+boxScoreStats = [c for c in statAttrs if c not in ['playerName', 'position', 'team', 'playerID']]
+
+# nflscrapR columns read by player_games
+boxScoreCols = ['game_id', 'game_date', 'posteam', 'defteam', 'play_type', 'yards_gained', 'yards_after_catch',
+                'rush_attempt', 'pass_attempt', 'complete_pass', 'sack', 'interception', 'rush_touchdown',
+                'pass_touchdown', 'rusher_player_id', 'rusher_player_name', 'passer_player_id', 'passer_player_name',
+                'receiver_player_id', 'receiver_player_name', 'interception_player_id', 'interception_player_name',
+                'forced_fumble_player_1_player_id', 'forced_fumble_player_1_player_name', 'forced_fumble_player_1_team',
+                'forced_fumble_player_2_player_id', 'forced_fumble_player_2_player_name', 'forced_fumble_player_2_team',
+                'solo_tackle_1_player_id', 'solo_tackle_1_player_name', 'solo_tackle_1_team',
+                'solo_tackle_2_player_id', 'solo_tackle_2_player_name', 'solo_tackle_2_team',
+                'assist_tackle_1_player_id', 'assist_tackle_1_player_name', 'assist_tackle_1_team',
+                'assist_tackle_2_player_id', 'assist_tackle_2_player_name', 'assist_tackle_2_team',
+                'assist_tackle_3_player_id', 'assist_tackle_3_player_name', 'assist_tackle_3_team',
+                'assist_tackle_4_player_id', 'assist_tackle_4_player_name', 'assist_tackle_4_team']
+
+
+# Return one role's stats as a long frame with a row per play the role's player is credited on
+# player: nflscrapR column prefix of the player (e.g. 'rusher' for rusher_player_id / rusher_player_name); team: team
+# column of the player; stats: {stat column: values}
+def _role(pbp, rows, player, team, stats):
+    rows = rows & pbp['%s_player_id' % player].notna().values
+    return pd.DataFrame(dict({'gameID': pbp.game_id.values[rows],
+                              'playerID': pbp['%s_player_id' % player].astype(object).values[rows],
+                              'playerName': pbp['%s_player_name' % player].astype(object).values[rows],
+                              'team': pbp[team].astype(object).values[rows]},
+                             **{stat: np.asarray(values, dtype=np.float64)[rows] for stat, values in stats.items()}))
+
+
+# Build the player stats of every game from nflscrapR play by play data (pbp, as read by load_pbp), one vectorized
+# pass per role, with the columns nfl v11.py builds from nflgame plus opptys (rushing attempts + targets) and
+# teamTotalOpptys (opptys of the player's team in the game)
+# Passing attempts and yards exclude sacks; a sack counts 1 for a solo tackler and 0.5 for each assisting tackler
+# (nflscrapR does not name sackers); position is not in pbp and is left empty
+def player_games(pbp, seasonOpeners=None):
+    n = len(pbp)
+    everyPlay = np.ones(n, dtype=bool)
+    yards = pbp.yards_gained.fillna(0).values
+    sack = pbp.sack.fillna(0).values == 1
+    rush = (pbp.rush_attempt.fillna(0).values == 1)
+    complete = pbp.complete_pass.fillna(0).values
+    target = (pbp.pass_attempt.fillna(0).values == 1) & ~sack
+    touchdown = {'rush': pbp.rush_touchdown.fillna(0).values, 'pass': pbp.pass_touchdown.fillna(0).values}
+
+    roles = [_role(pbp, rush, 'rusher', 'posteam',
+                   {'rushingAtt': np.ones(n), 'rushingYd': yards, 'rushingTD': touchdown['rush']}),
+             _role(pbp, target, 'passer', 'posteam',
+                   {'passingAtt': np.ones(n), 'passingComp': complete, 'passingYd': yards * complete,
+                    'passingTD': touchdown['pass'], 'passingInt': pbp.interception.fillna(0).values}),
+             _role(pbp, target, 'receiver', 'posteam',
+                   {'receivingTar': np.ones(n), 'receivingRec': complete, 'receivingYd': yards * complete,
+                    'receivingYAC': pbp.yards_after_catch.fillna(0).values * complete,
+                    'receivingTD': touchdown['pass']}),
+             _role(pbp, everyPlay, 'interception', 'defteam', {'defenseInt': np.ones(n)})]
+    for k in [1, 2]:
+        roles.append(_role(pbp, everyPlay, 'forced_fumble_player_%d' % k, 'forced_fumble_player_%d_team' % k,
+                           {'defenseFFum': np.ones(n)}))
+        roles.append(_role(pbp, everyPlay, 'solo_tackle_%d' % k, 'solo_tackle_%d_team' % k,
+                           {'defenseTkl': np.ones(n), 'defenseSk': sack * 1.0}))
+    for k in [1, 2, 3, 4]:
+        roles.append(_role(pbp, everyPlay, 'assist_tackle_%d' % k, 'assist_tackle_%d_team' % k,
+                           {'defenseTkl': np.ones(n), 'defenseSk': sack * 0.5}))
+
+    # Sum the roles by player and game
+    games = pd.concat(roles, ignore_index=True).fillna({stat: 0 for stat in boxScoreStats})
+    for stat in boxScoreStats:
+        if stat not in games:
+            games[stat] = 0.0
+    games = games.groupby(['gameID', 'team', 'playerID'], sort=True) \
+        .agg(dict({'playerName': 'first'}, **{stat: 'sum' for stat in boxScoreStats})).reset_index()
+    games = games.astype({stat: 'int64' for stat in boxScoreStats if stat != 'defenseSk'})
+
+    # Season, week and nfl v11.py's gameID (season, week and team)
+    gameDay = pd.to_datetime(pbp.game_date.astype(str), format='%m/%d/%y').groupby(pbp.game_id.values).min()
+    week = game_weeks(gameDay, seasonOpeners)
+    season = games.gameID // 1000000 - ((games.gameID // 10000) % 100 < 3)
+    games['season'] = season.values
+    games['week'] = week.reindex(games.gameID).values
+    games['position'] = ''
+    games['opptys'] = games.rushingAtt + games.receivingTar
+    games['teamTotalOpptys'] = games.groupby(['gameID', 'team']).opptys.transform('sum')
+    games['gameID'] = games.season.astype(str) + games.week.astype(str) + games.team.astype(str)
+    return games[list(statAttrs) + ['season', 'week', 'gameID', 'opptys', 'teamTotalOpptys']]
+
+
+# Build the player table from the bundled csv, check its totals against the plays and time the load and build
+# Usage: python box_scores.py [path to nflscrapR pbp csv]
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'pbp-2019_v2.csv'
+    start = time.perf_counter()
+    pbp = load_pbp(path, columns=boxScoreCols)
+    loadTime = time.perf_counter() - start
+    start = time.perf_counter()
+    games = player_games(pbp)
+    buildTime = time.perf_counter() - start
+
+    # Rushing yards and receptions by team must match the play totals
+    rushes = pbp[pbp.rush_attempt == 1]
+    np.testing.assert_array_equal(games.groupby('team').rushingYd.sum().sort_index().values,
+                                  rushes.groupby('posteam', observed=True).yards_gained.sum().sort_index().values)
+    assert games.receivingRec.sum() == pbp.complete_pass.sum() == games.passingComp.sum()
+    print(games.sort_values('opptys', ascending=False).head(5).to_string(index=False))
+    print('%d player games: load %.2fs, build %.3fs' % (len(games), loadTime, buildTime))
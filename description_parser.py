@@ -0,0 +1,106 @@
+# import re, sys, time, numpy and pandas
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Binary columns set from the play description, in flag matrix column order
+descFlags = ['isTimeout',
+             'isTwoMinWarning',
+             'isQtrEnd',
+             'isTouchdown',
+             'isExtraPointAtt',
+             'isExtraPointSuccessful',
+             'isFieldGoalSuccessful',
+             'isSafety']
+
+# Create dictionary that maps each description phrase to the flags it sets
+flagPhrases = {'TIMEOUT': ['isTimeout'],
+               'TWO-MINUTE WARNING': ['isTwoMinWarning'],
+               'END QUARTER': ['isQtrEnd'],
+               'END OF QUARTER': ['isQtrEnd'],
+               'TOUCHDOWN': ['isTouchdown'],
+               'EXTRA POINT IS GOOD': ['isExtraPointAtt', 'isExtraPointSuccessful'],
+               'EXTRA POINT': ['isExtraPointAtt'],
+               'FIELD GOAL IS GOOD': ['isFieldGoalSuccessful'],
+               ', SAFETY': ['isSafety']}
+
+# Player name patterns: the first jersey-name token (e.g. 12-T.BRADY) and the target after a pass (e.g. TO 84-J.DOE)
+jerseyRe = re.compile(r'\d-(.+?)\s')
+targetRe = re.compile(r'\w\w\s\d+-(.+?)(?:\s|\W$)')
+
+
+# Parse play descriptions with vectorized string scans
+# Every phrase of flagPhrases is one Series.str.contains scan (a plain substring search, so phrases that overlap or
+# contain one another are all found) whose matches set the phrase's flags
+# Returns an int8 flag matrix (one row per description, one column per descFlags entry) and a data frame of the
+# rusher, passer and target names; names are only extracted where playType is RUSH or PASS (or everywhere when
+# playType is None)
+def parse_descriptions(descriptions, playType=None):
+    descriptions = pd.Series(descriptions, dtype='str').reset_index(drop=True)
+    n = len(descriptions)
+    isRush = np.ones(n, dtype=bool) if playType is None else np.asarray(playType == 'RUSH')
+    isPass = np.ones(n, dtype=bool) if playType is None else np.asarray(playType == 'PASS')
+
+    flags = np.zeros((n, len(descFlags)), dtype=np.int8)
+    for phrase, phraseFlags in flagPhrases.items():
+        found = descriptions.str.contains(phrase, regex=False, na=False).values
+        for flag in phraseFlags:
+            flags[found, descFlags.index(flag)] = 1
+
+    # Extract the names from the rush and pass descriptions only
+    playerName = descriptions[isRush | isPass].str.extract(jerseyRe, expand=False).reindex(descriptions.index)
+    targetName = descriptions[isPass].str.extract(targetRe, expand=False).str.rstrip('.').reindex(descriptions.index)
+
+    names = pd.DataFrame({'rushingPlayerName': playerName.where(isRush).str.rstrip('.'),
+                          'passingPlayerName': playerName.where(isPass),
+                          'targetPlayerName': targetName})
+    return flags, names
+
+
+# Add the description flags and player names to allPlays
+def add_description_columns(allPlays):
+    flags, names = parse_descriptions(allPlays.description.tolist(), allPlays.playType.values)
+    for col in ['rushingPlayerName', 'passingPlayerName', 'targetPlayerName']:
+        allPlays[col] = names[col].values
+    for j, col in enumerate(descFlags):
+        allPlays[col] = flags[:, j]
+    return allPlays
+
+
+# Original str.contains / str.extract scans from test 8.py, kept for the benchmark below
+def legacy_description_columns(allPlays):
+    allPlays['rushingPlayerName'] = allPlays.description.str.extract(r'\d-(.+?)\s')[0].str.rstrip('.')
+    allPlays['passingPlayerName'] = allPlays.description.str.extract(r'\d-(.+?)\s')[0]
+    targetPlayerName1 = allPlays.description.str.extract(r'\w\w\s\d+-(.+?)\s')[0].str.rstrip('.')
+    targetPlayerName2 = allPlays.description.str.extract(r'\w\w\s\d+-(.+?)\W$')[0]
+    allPlays['targetPlayerName'] = targetPlayerName1.fillna(targetPlayerName2)
+    for phrase in ['TIMEOUT', 'TWO-MINUTE WARNING', 'END QUARTER', 'END OF QUARTER', 'TOUCHDOWN', 'EXTRA POINT',
+                   'EXTRA POINT IS GOOD', 'FIELD GOAL IS GOOD', ', SAFETY']:
+        allPlays[phrase] = allPlays.description.str.contains(phrase).astype(int)
+    return allPlays
+
+
+# Compare throughput (plays per second) of the legacy scans and parse_descriptions, and check every flag against the
+# legacy str.contains columns of its phrases
+# Usage: python description_parser.py [path to nflscrapR pbp csv]
+if __name__ == '__main__':
+    from pbp_loader import load_pbp
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'pbp-2019_v2.csv'
+    plays = pd.DataFrame({'description': load_pbp(path, columns=['desc']).desc.str.upper()})
+    plays['playType'] = np.where(plays.description.str.contains(' PASS '), 'PASS', 'RUSH')
+
+    start = time.perf_counter()
+    legacy = legacy_description_columns(plays.copy())
+    legacyTime = time.perf_counter() - start
+    start = time.perf_counter()
+    parsed = add_description_columns(plays.copy())
+    newTime = time.perf_counter() - start
+    for col in descFlags:
+        phrases = [p for p, flags in flagPhrases.items() if col in flags]
+        assert (parsed[col].values == legacy[phrases].max(axis=1).values).all(), col
+    print('%d plays: legacy scans %.0f plays/s, parse_descriptions %.0f plays/s'
+          % (len(plays), len(plays) / legacyTime, len(plays) / newTime))
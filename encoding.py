@@ -0,0 +1,188 @@
+# import os, sys, time, numpy and pandas
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Current abbreviation of every franchise, in the order of test 8.py's teamCodeMap (the team encoding starts at 1, so
+# ARI to WAS keep teamCodeMap's codes 1 to 32 and relocated teams the codes of their old abbreviations)
+franchises = ['ARI', 'ATL', 'BAL', 'BUF', 'CAR', 'CHI', 'CIN', 'CLE', 'DAL', 'DEN', 'DET', 'GB', 'HOU', 'IND', 'JAX',
+              'KC', 'LAR', 'LAC', 'MIA', 'MIN', 'NE', 'NO', 'NYG', 'NYJ', 'LV', 'PHI', 'PIT', 'SEA', 'SF', 'TB', 'TEN',
+              'WAS']
+
+# Create dictionary mapping relocated and alternative team abbreviations to the franchise's current one
+teamAliases = {'OAK': 'LV', 'LA': 'LAR', 'STL': 'LAR', 'SD': 'LAC', 'JAC': 'JAX', 'WSH': 'WAS'}
+
+
+# Dictionary encoding of one kind of value (teams, player ids, player names): every value gets the next int32 code
+# (from start) the first time it is seen and keeps it, and an alias shares the code of the value it stands for
+class Encoding:
+
+    def __init__(self, values=(), aliases=None, start=0):
+        self.values = []
+        self.codes = {}
+        self.aliases = dict(aliases or {})
+        self.start = start
+        self.add(values)
+
+    # Give the values not seen yet the next codes, in order
+    def add(self, values):
+        for v in values:
+            if v not in self.codes:
+                self.codes[v] = self.start + len(self.values)
+                self.values.append(v)
+
+    # Return the int32 codes of values (list, array, Series or Categorical), adding new values; missing values are -1
+    # The values are factorized first, so the dictionary is consulted once per distinct value instead of once per row
+    def encode(self, values):
+        rows, uniques = pd.factorize(values if hasattr(values, 'dtype') else np.asarray(values, dtype=object))
+        uniques = [self.aliases.get(u, u) for u in uniques]
+        self.add(uniques)
+        table = np.array([self.codes[u] for u in uniques] + [-1], dtype=np.int32)
+        return table[rows]
+
+    # Return the values of codes (None for -1)
+    def decode(self, codes):
+        return np.array([None] * self.start + self.values + [None], dtype=object)[np.asarray(codes)]
+
+
+# Registry of the encodings shared across the pipeline by kind ('team' is seeded with franchises and teamAliases from
+# code 1, other kinds start empty from code 0), which can be saved and merged back so codes stay stable between runs
+class EncodingRegistry:
+
+    def __init__(self, encodings=None):
+        self.encodings = encodings if encodings is not None else {'team': Encoding(franchises, teamAliases, start=1)}
+
+    # Return the encoding of kind, creating it if new
+    def encoding(self, kind):
+        if kind not in self.encodings:
+            self.encodings[kind] = Encoding()
+        return self.encodings[kind]
+
+    # Return the int32 codes of values of kind (see Encoding.encode)
+    def encode(self, kind, values):
+        return self.encoding(kind).encode(values)
+
+    # Return the values of codes of kind (see Encoding.decode)
+    def decode(self, kind, codes):
+        return self.encoding(kind).decode(codes)
+
+    # Add the values and aliases of another registry, raising ValueError if a code it gave differs from this one's
+    def update(self, other):
+        for kind, theirs in other.encodings.items():
+            mine = self.encoding(kind)
+            if not mine.values:
+                mine.start = theirs.start
+            mine.aliases.update(theirs.aliases)
+            mine.add(theirs.values)
+            if mine.start != theirs.start or mine.values[:len(theirs.values)] != theirs.values:
+                raise ValueError('%s codes differ from those of the registry merged in' % kind)
+        return self
+
+    # Write the first code, values and aliases of every kind to an .npz file (through a temporary file)
+    # Values and aliases are kept as object arrays, so int or numpy int values reload as the same keys
+    def save(self, path):
+        arrays = {}
+        for kind, encoding in self.encodings.items():
+            arrays[kind + '.start'] = np.array(encoding.start)
+            arrays[kind + '.values'] = _object_array(encoding.values)
+            arrays[kind + '.aliases'] = _object_array(encoding.aliases)
+            arrays[kind + '.aliasOf'] = _object_array(encoding.aliases.values())
+        with open(path + '.tmp', 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(path + '.tmp', path)
+
+    # Read a registry written by save
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=True) as data:
+            kinds = [name[:-len('.values')] for name in data.files if name.endswith('.values')]
+            return cls({kind: Encoding(data[kind + '.values'].tolist(),
+                                       dict(zip(data[kind + '.aliases'].tolist(), data[kind + '.aliasOf'].tolist())),
+                                       int(data[kind + '.start']) if kind + '.start' in data.files else 0)
+                        for kind in kinds})
+
+
+# Return a 1-d object array of values (np.array would make a string array of strings and coerce mixed types)
+def _object_array(values):
+    values = list(values)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+# The registry shared by the pipeline (see pbp_cache.load_all_plays, which persists it next to the cached allPlays)
+registry = EncodingRegistry()
+
+
+# Merge the registry saved at path (if any) into the shared registry
+def load_registry(path):
+    if os.path.exists(path):
+        registry.update(EncodingRegistry.load(path))
+    return registry
+
+
+# Encode the player names of copies of the bundled season and compare memory and groupby / merge times on the names
+# and on their codes; round trip the registry through an .npz file
+# Usage: python encoding.py [copies of the bundled season]
+if __name__ == '__main__':
+    import tempfile
+
+    from pbp_loader import load_pbp
+
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    pbp = load_pbp('pbp-2019_v2.csv', columns=['posteam', 'rusher_player_name', 'yards_gained'])
+    pbp = pbp[pbp.rusher_player_name.notnull()]
+    plays = pd.DataFrame({'team': pbp.posteam.astype(object).values,
+                          'playerName': pbp.rusher_player_name.astype(object).values,
+                          'yards': pbp.yards_gained.astype('float64').values})
+    plays = pd.concat([plays.assign(playerName=plays.playerName + '#%d' % c) for c in range(copies)],
+                      ignore_index=True)
+
+    start = time.perf_counter()
+    codes = registry.encode('playerName', plays.playerName)
+    encodeTime = time.perf_counter() - start
+    assert (registry.decode('playerName', codes) == plays.playerName.values).all()
+    coded = pd.DataFrame({'team': registry.encode('team', plays.team), 'player': codes, 'yards': plays.yards})
+
+    start = time.perf_counter()
+    byName = plays.groupby(['team', 'playerName']).yards.sum()
+    nameTime = time.perf_counter() - start
+    start = time.perf_counter()
+    byCode = coded.groupby(['team', 'player']).yards.sum()
+    codeTime = time.perf_counter() - start
+    assert np.isclose(byName.sum(), byCode.sum()) and len(byName) == len(byCode)
+
+    start = time.perf_counter()
+    plays.merge(byName.rename('total').reset_index(), on=['team', 'playerName'])
+    nameMergeTime = time.perf_counter() - start
+    start = time.perf_counter()
+    coded.merge(byCode.rename('total').reset_index(), on=['team', 'player'])
+    codeMergeTime = time.perf_counter() - start
+
+    print('%d plays, %d players: encode %.1f ms; memory %.1f MB as names, %.1f MB as codes'
+          % (len(plays), len(byCode), encodeTime * 1000, plays[['team', 'playerName']].memory_usage(deep=True).sum()
+             / 2 ** 20, coded[['team', 'player']].memory_usage().sum() / 2 ** 20))
+    print('groupby: names %.1f ms, codes %.1f ms; merge: names %.1f ms, codes %.1f ms'
+          % (nameTime * 1000, codeTime * 1000, nameMergeTime * 1000, codeMergeTime * 1000))
+
+    # Teams keep test 8.py's teamCodeMap codes (relocated teams sharing their franchise's code), and a saved registry
+    # merges back with the same codes, int player ids included
+    teamCodeMap = {'ARI': 1, 'ATL': 2, 'BAL': 3, 'BUF': 4, 'CAR': 5, 'CHI': 6, 'CIN': 7, 'CLE': 8, 'DAL': 9, 'DEN': 10,
+                   'DET': 11, 'GB': 12, 'HOU': 13, 'IND': 14, 'JAX': 15, 'KC': 16, 'LA': 17, 'LAC': 18, 'MIA': 19,
+                   'MIN': 20, 'NE': 21, 'NO': 22, 'NYG': 23, 'NYJ': 24, 'OAK': 25, 'PHI': 26, 'PIT': 27, 'SEA': 28,
+                   'SF': 29, 'TB': 30, 'TEN': 31, 'WAS': 32}
+    assert (registry.encode('team', list(teamCodeMap)) == list(teamCodeMap.values())).all()
+    assert (registry.encode('team', ['LV', 'LAR', None]) == [25, 17, -1]).all()
+    assert (registry.decode('team', [1, 32, -1]) == ['ARI', 'WAS', None]).all()
+    playerIds = registry.encode('playerId', [35700, np.int64(35701), '00-0035702'])
+    with tempfile.TemporaryDirectory() as tmp:
+        registry.save(os.path.join(tmp, 'encodings.npz'))
+        loaded = EncodingRegistry.load(os.path.join(tmp, 'encodings.npz'))
+        assert (loaded.encode('playerName', plays.playerName) == codes).all()
+        assert (loaded.encode('playerId', [35700, 35701, '00-0035702']) == playerIds).all()
+        assert (loaded.encode('team', ['ARI', 'OAK']) == [1, 25]).all()
+        assert len(loaded.encoding('playerId').values) == 3
+        EncodingRegistry().update(loaded)
@@ -0,0 +1,148 @@
+# import os, sys, time and numpy
+import os
+import sys
+import time
+
+import numpy as np
+
+from all_plays import ep_play_set
+
+# yardLine grid the curves are evaluated on
+yardLines = np.arange(101)
+
+
+# Count and sum nextScore of plays by group and yardLine bin, where the groups are downs 1 to 4, each split by
+# toGoBuckets (ascending upper edges of toGo, e.g. [3, 7, 10] gives 1-3, 4-7, 8-10 and 11 or more) if given
+# Returns (counts, sums), each with one row per group ((down - 1) * number of toGo buckets + toGo bucket) and one
+# column per yardLines entry
+def bin_plays(plays, toGoBuckets=None):
+    plays = plays[plays.down.between(1, 4) & plays.yardLine.notnull()]
+    edges = np.asarray(toGoBuckets if toGoBuckets is not None else [], dtype=np.float64)
+    group = (plays.down.values.astype(np.intp) - 1) * (len(edges) + 1) + np.searchsorted(edges, plays.toGo.values)
+    flat = group * len(yardLines) + np.clip(np.rint(plays.yardLine.values), 0, 100).astype(np.intp)
+    shape = (4 * (len(edges) + 1), len(yardLines))
+    counts = np.bincount(flat, minlength=np.prod(shape)).reshape(shape).astype(np.float64)
+    sums = np.bincount(flat, weights=plays.nextScore.values, minlength=np.prod(shape)).reshape(shape)
+    return counts, sums
+
+
+# Smooth the binned means sums / counts of every group (row) along yardLine in one batched call
+# method: 'binned' (bin means, empty bins interpolated), 'kernel' (Gaussian kernel weighted means) or 'local_linear'
+# (Gaussian kernel weighted straight line fits, like lowess without the robustness iterations)
+# bandwidth: standard deviation of the Gaussian kernel in yards
+# The kernel methods weight each bin by its number of plays and cost O(groups x bins^2), whatever the number of plays
+def smooth_bins(counts, sums, method='local_linear', bandwidth=10):
+    if method == 'binned':
+        curves = np.empty(counts.shape)
+        for g in range(len(counts)):
+            seen = counts[g] > 0
+            curves[g] = np.interp(yardLines, yardLines[seen], sums[g, seen] / counts[g, seen]) if seen.any() \
+                else np.nan
+        return curves
+    if method not in ('kernel', 'local_linear'):
+        raise ValueError("method must be 'binned', 'kernel' or 'local_linear', not %r" % method)
+
+    # weights[i, j]: weight of bin i in the fit at bin j
+    weights = np.exp(-0.5 * ((yardLines[:, None] - yardLines[None, :]) / bandwidth) ** 2)
+    s0 = counts @ weights
+    t0 = sums @ weights
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if method == 'kernel':
+            return t0 / s0
+
+        # Closed form weighted least squares line at each bin, from the weighted moments of yardLine (centered on
+        # the bin) and nextScore
+        dx = yardLines[:, None] - yardLines[None, :]
+        s1 = counts @ (weights * dx)
+        s2 = counts @ (weights * dx ** 2)
+        t1 = sums @ (weights * dx)
+        return (s2 * t0 - s1 * t1) / (s0 * s2 - s1 ** 2)
+
+
+# Smoothed expected points by yardLine for downs 1 to 4 (optionally split into toGo buckets), evaluated on the
+# yardLines grid and linearly interpolated in between, so a fitted set of curves scores plays without a refit
+class EPCurves:
+
+    def __init__(self, curves, toGoBuckets=None):
+        self.curves = curves
+        self.toGoBuckets = np.asarray(toGoBuckets if toGoBuckets is not None else [], dtype=np.float64)
+
+    # Fit curves to the epPlaySet plays of allPlays
+    @classmethod
+    def fit(cls, allPlays, toGoBuckets=None, method='local_linear', bandwidth=10):
+        counts, sums = bin_plays(ep_play_set(allPlays), toGoBuckets)
+        return cls(smooth_bins(counts, sums, method, bandwidth), toGoBuckets)
+
+    # Fit curves to nextScore counts and sums by down and yardLine, such as weekly_ingest.WeeklyState.epTotals
+    @classmethod
+    def from_totals(cls, epTotals, method='local_linear', bandwidth=10):
+        totals = epTotals.reset_index()
+        totals = totals[totals.down.between(1, 4) & totals.yardLine.notnull()]
+        flat = (totals.down.values.astype(np.intp) - 1) * len(yardLines) + \
+            np.clip(np.rint(totals.yardLine.values), 0, 100).astype(np.intp)
+        counts = np.bincount(flat, weights=totals['count'].values, minlength=4 * len(yardLines))
+        sums = np.bincount(flat, weights=totals['sum'].values, minlength=4 * len(yardLines))
+        return cls(smooth_bins(counts.reshape(4, -1), sums.reshape(4, -1), method, bandwidth))
+
+    # Expected points of each play (arrays or scalars of down, yardLine and, for curves with toGoBuckets, toGo);
+    # NaN where down is not 1 to 4
+    def __call__(self, down, yardLine, toGo=None):
+        if toGo is None and len(self.toGoBuckets):
+            raise ValueError('toGo is required by curves with toGoBuckets')
+        down = np.asarray(down, dtype=np.float64)
+        valid = (down >= 1) & (down <= 4)
+        group = np.where(valid, down, 1).astype(np.intp) - 1
+        if len(self.toGoBuckets):
+            group = group * (len(self.toGoBuckets) + 1) + np.searchsorted(self.toGoBuckets, toGo)
+        x = np.clip(np.asarray(yardLine, dtype=np.float64), 0, 100)
+        left = np.minimum(np.floor(np.nan_to_num(x)), 99).astype(np.intp)
+        ep = self.curves[group, left] + (x - left) * (self.curves[group, left + 1] - self.curves[group, left])
+        return np.where(valid, ep, np.nan)
+
+    # Write the curves to an .npz file
+    def save(self, path):
+        np.savez_compressed(path, curves=self.curves, toGoBuckets=self.toGoBuckets)
+
+    # Read curves written by save
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['curves'], data['toGoBuckets'])
+
+
+# Time fits of all four downs from the bundled csv and the EP totals of a weekly state, check the binned curves
+# against the grouped epPlaySet means and round trip the curves through an .npz file
+# Usage: python ep_curves.py [path to nflscrapR pbp csv]
+if __name__ == '__main__':
+    from pbp_cache import cacheDir, load_all_plays
+    from weekly_ingest import ep_totals
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'pbp-2019_v2.csv'
+    allPlays = load_all_plays(path)
+
+    means = ep_play_set(allPlays).groupby(['down', 'yardLine']).nextScore.mean().loc[1:4]
+    binned = EPCurves.fit(allPlays, method='binned')
+    down, yardLine = [means.index.get_level_values(k).values for k in ['down', 'yardLine']]
+    np.testing.assert_allclose(binned(down, yardLine), means.values)
+
+    for method in ['binned', 'kernel', 'local_linear']:
+        start = time.perf_counter()
+        curves = EPCurves.fit(allPlays, method=method)
+        fitTime = time.perf_counter() - start
+        print('%-12s fit from plays %.1f ms; 1st down EP at own 25 / midfield / opp 10: %s'
+              % (method, fitTime * 1000, np.round(curves(1, [25, 50, 90]), 2)))
+
+    totals = ep_totals(allPlays)
+    start = time.perf_counter()
+    curves = EPCurves.from_totals(totals)
+    refitTime = time.perf_counter() - start
+    np.testing.assert_allclose(curves.curves, EPCurves.fit(allPlays).curves)
+    start = time.perf_counter()
+    buckets = EPCurves.fit(allPlays, toGoBuckets=[3, 7, 10])
+    bucketTime = time.perf_counter() - start
+
+    os.makedirs(cacheDir, exist_ok=True)
+    curves.save(os.path.join(cacheDir, 'ep_curves.npz'))
+    np.testing.assert_array_equal(EPCurves.load(os.path.join(cacheDir, 'ep_curves.npz')).curves, curves.curves)
+    print('refit from weekly EP totals %.1f ms; 16 down x toGo curves %.1f ms'
+          % (refitTime * 1000, bucketTime * 1000))
@@ -0,0 +1,147 @@
+# import os, sys, time and numpy
+import os
+import sys
+import time
+
+import numpy as np
+
+from all_plays import ep_play_set
+
+
+# Return the mean nextScore of each cell of a dense table (NaN where a cell has no plays) and the play counts
+# keys: list of integer index arrays, one per table dimension; shape: table shape
+def _cell_means(keys, nextScore, shape):
+    flat = np.ravel_multi_index(keys, shape)
+    counts = np.bincount(flat, minlength=np.prod(shape)).reshape(shape)
+    sums = np.bincount(flat, weights=nextScore, minlength=np.prod(shape)).reshape(shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts, counts, sums
+
+
+# Expected points (mean nextScore of epPlaySet) precomputed for every down, toGo and yardLine, and optionally
+# halfSecRem bucket, so scoring a play is an array lookup
+# Cells with few plays are shrunk towards the down / yardLine mean, itself shrunk towards a straight line in yardLine
+# fitted to each down, by priorWeight plays' worth of the prior. toGo is capped at maxToGo (the last bucket is maxToGo or
+# more), and timeBuckets are ascending halfSecRem edges (e.g. [120, 900] gives <= 120, <= 900 and more)
+class EPModel:
+
+    def __init__(self, table, maxToGo, timeBuckets=None):
+        self.table = table
+        self.maxToGo = maxToGo
+        self.timeBuckets = np.asarray(timeBuckets if timeBuckets is not None else [], dtype=np.float64)
+
+    # Fit the table from allPlays (the plays are restricted to epPlaySet here)
+    @classmethod
+    def fit(cls, allPlays, maxToGo=20, timeBuckets=None, priorWeight=50):
+        plays = ep_play_set(allPlays)
+        plays = plays[plays.down.between(1, 4) & plays.yardLine.notnull()]
+        model = cls(None, maxToGo, timeBuckets)
+        nextScore = plays.nextScore.values.astype(np.float64)
+        down, toGo, yardLine, time = model._keys(plays.down.values, plays.toGo.values, plays.yardLine.values,
+                                                 plays.halfSecRem.values if len(model.timeBuckets) else None)
+        nTimes = len(model.timeBuckets) + 1
+
+        # Prior by down and yardLine: the yardLine means shrunk towards a straight line fitted to each down's plays
+        _, priorCounts, priorSums = _cell_means([down, yardLine], nextScore, (5, 101))
+        line = np.zeros((5, 101))
+        for d in range(1, 5):
+            if (down == d).sum() > 1:
+                line[d] = np.polyval(np.polyfit(yardLine[down == d], nextScore[down == d], 1), np.arange(101))
+
+        # Shrink the cell means towards the prior
+        _, counts, sums = _cell_means([time, down, toGo, yardLine], nextScore, (nTimes, 5, maxToGo + 1, 101))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            prior = (priorSums + priorWeight * line) / (priorCounts + priorWeight)
+            table = (sums + priorWeight * prior[None, :, None, :]) / (counts + priorWeight)
+        table[:, 0] = np.nan
+        table[:, :, 0] = np.nan
+        model.table = table.astype(np.float32)
+        return model
+
+    # Convert down, toGo, yardLine and halfSecRem values into table indices; down, toGo or yardLine NaN or out of
+    # range map to down 0, whose cells are NaN
+    def _keys(self, down, toGo, yardLine, halfSecRem=None):
+        down = np.asarray(down, dtype=np.float64)
+        toGo = np.asarray(toGo, dtype=np.float64)
+        yardLine = np.asarray(yardLine, dtype=np.float64)
+        valid = (down >= 1) & (down <= 4) & np.isfinite(toGo) & np.isfinite(yardLine)
+        downKey = np.where(valid, down, 0).astype(np.intp)
+        toGoKey = np.where(valid, np.clip(toGo, 1, self.maxToGo), 1).astype(np.intp)
+        yardLineKey = np.where(valid, np.clip(np.rint(yardLine), 0, 100), 0).astype(np.intp)
+        timeKey = np.zeros(downKey.shape, dtype=np.intp)
+        if halfSecRem is not None:
+            halfSecRem = np.asarray(halfSecRem, dtype=np.float64)
+            for edge in self.timeBuckets:
+                timeKey += halfSecRem > edge
+        return downKey, toGoKey, yardLineKey, timeKey
+
+    # Expected points of each play (arrays or scalars of down, toGo, yardLine and, for a model with timeBuckets,
+    # halfSecRem); NaN where down is not 1 to 4, toGo or yardLine NaN
+    # The cell is found with one flat index into the table, built in floating point and cast once; toGo is floored and
+    # yardLine rounded to whole yards first, as _keys does when fitting, so a fractional value stays in its own axis
+    def ep(self, down, togo, yardline, halfSecRem=None):
+        nTimes, nDowns, nToGos, nYardLines = self.table.shape
+        if halfSecRem is None and nTimes > 1:
+            raise ValueError('halfSecRem is required by a model with timeBuckets')
+        down = np.asarray(down, dtype=np.float64)
+        flat = np.floor(np.clip(np.asarray(togo, dtype=np.float64), 1, self.maxToGo))
+        flat += down * nToGos
+        flat *= nYardLines
+        flat += np.clip(np.rint(np.asarray(yardline, dtype=np.float64)), 0, 100)
+        flat = np.where((down >= 1) & (down <= 4) & np.isfinite(flat), flat, 0)
+        if halfSecRem is not None:
+            halfSecRem = np.asarray(halfSecRem, dtype=np.float64)
+            for edge in self.timeBuckets:
+                flat = flat + (halfSecRem > edge) * float(nDowns * nToGos * nYardLines)
+        return self.table.ravel().take(flat.astype(np.intp))
+
+    # Write the table and its bucketing to an .npz file
+    def save(self, path):
+        np.savez_compressed(path, table=self.table, maxToGo=self.maxToGo, timeBuckets=self.timeBuckets)
+
+    # Read a model written by save
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['table'], int(data['maxToGo']), data['timeBuckets'])
+
+
+# Fit a model from the bundled csv, check it against the grouped means of epPlaySet, round trip it through an .npz
+# file and time vectorized queries
+# Usage: python ep_model.py [path to nflscrapR pbp csv] [number of queries]
+if __name__ == '__main__':
+    from pbp_cache import cacheDir, load_all_plays
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'pbp-2019_v2.csv'
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 5000000
+    allPlays = load_all_plays(path)
+
+    # Without shrinkage every cell with plays is the mean nextScore of its plays
+    epPlaySet = ep_play_set(allPlays)
+    epPlaySet = epPlaySet[epPlaySet.down.between(1, 4)]
+    cells = epPlaySet.assign(toGo=epPlaySet.toGo.clip(1, 20)).groupby(['down', 'toGo', 'yardLine']).nextScore.mean()
+    raw = EPModel.fit(allPlays, priorWeight=0)
+    down, toGo, yardLine = [cells.index.get_level_values(k).values for k in ['down', 'toGo', 'yardLine']]
+    np.testing.assert_allclose(raw.ep(down, toGo, yardLine), cells.values, rtol=1e-6, atol=1e-6)
+
+    # Fractional toGo and yardLine read the cell of the whole yards they fall in, as the table was fitted
+    shrunk = EPModel.fit(allPlays)
+    fractional = shrunk.ep([1, 1, 1, 1], [4, 4.3, 4.7, 4.999], [95, 95, 95.2, 94.6])
+    assert not np.isnan(fractional).any()
+    np.testing.assert_array_equal(fractional, shrunk.ep([1] * 4, [4] * 4, [95] * 4))
+
+    start = time.perf_counter()
+    model = EPModel.fit(allPlays, timeBuckets=[120, 900])
+    fitTime = time.perf_counter() - start
+    os.makedirs(cacheDir, exist_ok=True)
+    model.save(os.path.join(cacheDir, 'ep_model.npz'))
+    model = EPModel.load(os.path.join(cacheDir, 'ep_model.npz'))
+
+    rng = np.random.default_rng(0)
+    queries = (rng.integers(1, 5, n), rng.integers(1, 30, n), rng.integers(1, 100, n), rng.integers(0, 1800, n))
+    start = time.perf_counter()
+    ep = model.ep(*queries)
+    queryTime = time.perf_counter() - start
+    assert not np.isnan(ep).any()
+    print('fit %.3fs; %d queries in %.0f ms (%.0f M/s); 1st and 10 at own 25 = %.2f'
+          % (fitTime, n, queryTime * 1000, n / queryTime / 1e6, model.ep(1, 10, 25, 1000)))
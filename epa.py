@@ -0,0 +1,97 @@
+# import sys, time, numpy and pandas
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from next_score import halfMapQtr
+
+# Points the offense ends a scoring play with: touchdowns count the extra point, as nflscrapR does
+tdPoints = 7
+fieldGoalPoints = 3
+safetyPoints = -2
+
+# Play types that follow a touchdown and are run by the scoring team
+patTypes = ['EXTRA POINT', 'TWO-POINT CONVERSION']
+
+
+# Add expected points before (ep) and after (epAfter) every scrimmage play of allPlays and the expected points added
+# (epa = epAfter - ep), scored by model (an ep_model.EPModel), in one vectorized pass over allPlays in play order
+# Plays without a down 1 to 4 (kick offs, extra points, timeouts) have NaN ep and epa. epAfter is the points of a
+# scoring play (touchdowns count for the team that tries the extra point, so returns score for the defense), 0 when
+# the play ends the half (overtime is its own half), and otherwise the ep of the next scrimmage play of the game,
+# negated when the possession changes. Scores on no plays or nullified by a penalty do not count
+def add_epa(allPlays, model):
+    halfSecRem = allPlays.halfSecRem.values if model.table.shape[0] > 1 else None
+    ep = model.ep(allPlays.down.values, allPlays.toGo.values, allPlays.yardLine.values, halfSecRem)
+    gameID = allPlays.gameID.values
+    half = allPlays.quarter.map(halfMapQtr).values
+    offTeam = allPlays.offTeamCode.values
+    playType = allPlays.playType.values
+
+    # Next scrimmage play of the same game and half, from the offense's point of view
+    plays = np.flatnonzero(~np.isnan(ep) & pd.notnull(playType))
+    nextPlays = np.append(plays[1:], 0)
+    hasNext = np.append((gameID[plays[1:]] == gameID[plays[:-1]]) & (half[plays[1:]] == half[plays[:-1]]), False)
+    sign = np.where(offTeam[nextPlays] == offTeam[plays], 1, -1)
+    epAfter = np.full(len(allPlays), np.nan)
+    epAfter[plays] = np.where(hasNext, sign * ep[nextPlays], 0)
+
+    # Scoring plays that stand: the description phrase also matches 'TOUCHDOWN NULLIFIED BY PENALTY'
+    stands = (allPlays.isNoPlay.values[plays] != 1) & \
+        ~allPlays.description.str.contains('NULLIFIED', regex=False, na=False).values[plays]
+    plays = plays[stands]
+
+    # Touchdowns score for the offense of the next extra point or two point try of the game, if there is one
+    pats = np.flatnonzero(np.isin(playType, patTypes))
+    tds = plays[allPlays.isTouchdown.values[plays] == 1]
+    pat = pats[np.minimum(np.searchsorted(pats, tds), len(pats) - 1)] if len(pats) else tds
+    offenseScored = np.where(gameID[pat] == gameID[tds], offTeam[pat] == offTeam[tds],
+                             allPlays.isInterception.values[tds] != 1)
+    epAfter[tds] = np.where(offenseScored, tdPoints, -tdPoints)
+    epAfter[plays[allPlays.isFieldGoalSuccessful.values[plays] == 1]] = fieldGoalPoints
+    epAfter[plays[allPlays.isSafety.values[plays] == 1]] = safetyPoints
+
+    allPlays['ep'] = ep
+    allPlays['epAfter'] = epAfter
+    allPlays['epa'] = epAfter - ep
+    return allPlays
+
+
+# Score the bundled csv with an EPModel fitted to it, compare ep and epa with nflscrapR's ep and epa columns, and
+# time add_epa on the plays replicated `copies` times
+# Usage: python epa.py [path to nflscrapR pbp csv] [copies]
+if __name__ == '__main__':
+    from ep_model import EPModel
+    from pbp_cache import load_all_plays
+    from pbp_loader import load_pbp
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'pbp-2019_v2.csv'
+    copies = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    allPlays = load_all_plays(path)
+    model = EPModel.fit(allPlays)
+    allPlays = add_epa(allPlays, model)
+
+    # nflscrapR's values, indexed by playID as allPlays is
+    nflscrapR = load_pbp(path, columns=['game_id', 'play_id', 'ep', 'epa'])
+    nflscrapR.index = nflscrapR.game_id * 10000 + nflscrapR.play_id
+    both = allPlays[['ep', 'epa']].join(nflscrapR[['ep', 'epa']], rsuffix='NflscrapR').dropna()
+    print('%d plays scored; vs nflscrapR: ep r = %.3f, epa r = %.3f, epa sign agrees on %.1f%%, mean |epa diff| %.2f'
+          % (len(both), both.ep.corr(both.epNflscrapR), both.epa.corr(both.epaNflscrapR),
+             100 * (np.sign(both.epa) == np.sign(both.epaNflscrapR)).mean(), (both.epa - both.epaNflscrapR).abs().mean()))
+
+    # Touchdowns nullified by a penalty are not scored: their epAfter is the next play's ep, not the touchdown's points
+    nullified = (allPlays.isTouchdown == 1) & allPlays.description.str.contains('NULLIFIED', regex=False, na=False)
+    nullified = both.index.intersection(allPlays.index[nullified])
+    assert len(nullified) and (allPlays.epAfter[nullified].abs() != tdPoints).all()
+    assert (both.epa[nullified] - both.epaNflscrapR[nullified]).abs().max() < 1
+
+    # Replicate the season under new gameIDs and time the stage
+    big = pd.concat([allPlays.assign(gameID=allPlays.gameID + c * 10 ** 10) for c in range(copies)],
+                    ignore_index=True)
+    start = time.perf_counter()
+    add_epa(big, model)
+    epaTime = time.perf_counter() - start
+    pd.testing.assert_series_equal(big.epa.iloc[:len(allPlays)], allPlays.epa.reset_index(drop=True))
+    print('add_epa: %d plays in %.2fs (%.0f plays/s)' % (len(big), epaTime, len(big) / epaTime))
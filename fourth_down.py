@@ -0,0 +1,255 @@
+# import os, sys, time, numpy and pandas
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import ep_model
+import wp_model
+from ep_model import EPModel
+from game_store import GameStore
+from pbp_cache import cacheDir, cache_key, load_all_plays
+from pbp_loader import load_pbp
+from wp_model import WPModel, fit_logistic
+
+# Fourth down actions, in the order of the value arrays
+fourthDownActions = ['go', 'punt', 'fg']
+
+# nflscrapR columns read for the kicking and conversion outcomes
+outcomeCols = ['play_type', 'down', 'ydstogo', 'yards_gained', 'yardline_100', 'field_goal_result', 'kick_distance',
+               'return_yards', 'touchback']
+
+# Where the receiving team starts after a kick off (a touchback), and seconds off the clock for any fourth down play
+kickoffYardLine, playSeconds = 25, 5
+
+# allPlays playType of each fourth down action
+actionTypes = {'RUSH': 'go', 'PASS': 'go', 'SACK': 'go', 'PUNT': 'punt', 'FIELD GOAL': 'fg'}
+
+# Modules whose source defines the grid (on top of pbp_cache.derivationModules); any change to them changes its key
+gridModules = [ep_model, wp_model, sys.modules[__name__]]
+
+
+# Return a two parameter logistic fit (intercept, slope) of y on x (see wp_model.fit_logistic)
+def _logistic(x, y):
+    return fit_logistic(np.column_stack([np.ones(len(x)), x]), y, ridge=1e-6)
+
+
+# Estimate the fourth down outcome distributions from nflscrapR play by play data (read with outcomeCols)
+# Conversions come from 3rd and 4th down runs and passes: the chance of gaining toGo (a logistic in log toGo), the mean
+# yards past the marker when converting and the mean gain when not. Field goals: the chance of making one (a logistic
+# in kick_distance, from field_goal_result). Punts: the kick_distance and return_yards of every punt (NaN kick_distance,
+# a blocked punt, counts as no distance)
+def fourth_down_outcomes(pbp):
+    tries = pbp[pbp.down.isin([3, 4]).fillna(False) & pbp.play_type.isin(['run', 'pass'])]
+    toGo = tries.ydstogo.astype('float64').values
+    gained = tries.yards_gained.astype('float64').fillna(0).values
+    converted = gained >= toGo
+    kicks = pbp[pbp.field_goal_result.notnull() & pbp.kick_distance.notnull()]
+    punts = pbp[pbp.play_type == 'punt']
+    return {'convertCoef': _logistic(np.log(np.maximum(toGo, 1)), converted * 1.0),
+            'convertExcess': (gained - toGo)[converted].mean(),
+            'failGain': gained[~converted].mean(),
+            'fieldGoalCoef': _logistic(kicks.kick_distance.astype('float64').values,
+                                       (kicks.field_goal_result == 'made').values * 1.0),
+            'puntDistance': punts.kick_distance.astype('float64').fillna(0).values,
+            'puntReturn': punts.return_yards.astype('float64').fillna(0).values}
+
+
+# Mean yardLine of the receiving team after a punt from each of yardLines, over the punts of outcomes (a punt
+# reaching the end zone is a touchback at the 20)
+def punt_landing(outcomes, yardLines):
+    spot = yardLines[:, None] + outcomes['puntDistance'][None, :]
+    landing = np.where(spot >= 100, 20, np.clip(100 - spot + outcomes['puntReturn'][None, :], 1, 99))
+    return landing.mean(axis=1)
+
+
+# Go / punt / field goal values of every (toGo, yardLine) state in EP, and of every (gmSecRem, scoreDiff, toGo,
+# yardLine) state in the offense's WP, precomputed from an EPModel, a WPModel and fourth_down_outcomes so a query is
+# a table lookup
+# Each action's value is the chance weighted value of its outcomes, each outcome scored at its mean resulting state
+# (rounded to whole yards, as the EP table is indexed); grid axes are toGo 1 to maxToGo (longer counts as maxToGo),
+# yardLine 1 to 99, scoreDiff -maxDiff to maxDiff (capped) and gmSecRem 0 to 3600 in timeStep steps (rounded to the
+# nearest)
+class FourthDownGrid:
+
+    def __init__(self, ep, wp, maxToGo, maxDiff, timeStep):
+        self.ep = ep
+        self.wp = wp
+        self.maxToGo = int(maxToGo)
+        self.maxDiff = int(maxDiff)
+        self.timeStep = int(timeStep)
+
+    # Compute the grid
+    @classmethod
+    def build(cls, epModel, wpModel, outcomes, maxToGo=20, maxDiff=24, timeStep=120):
+        toGo, yardLine = [a.ravel().astype(np.float64) for a in np.meshgrid(np.arange(1, maxToGo + 1),
+                                                                            np.arange(1, 100), indexing='ij')]
+        pConvert = 1 / (1 + np.exp(-(outcomes['convertCoef'][0] + outcomes['convertCoef'][1] * np.log(toGo))))
+        successLine = np.rint(yardLine + toGo + outcomes['convertExcess'])
+        touchdown = successLine >= 100
+        successLine = np.minimum(successLine, 99)
+        failLine = 100 - np.clip(np.rint(yardLine + outcomes['failGain']), 1, 99)
+        pMake = 1 / (1 + np.exp(-(outcomes['fieldGoalCoef'][0] + outcomes['fieldGoalCoef'][1] * (117 - yardLine))))
+        missLine = np.maximum(107 - yardLine, 20)
+        puntLine = np.rint(punt_landing(outcomes, yardLine))
+
+        # EP of each action (the other team's EP counts against the offense)
+        def ep(toGo, yardLine):
+            return epModel.ep(1, toGo, yardLine)
+
+        afterKickoff = ep(10, kickoffYardLine)
+        epGrid = np.stack([pConvert * np.where(touchdown, 7 - afterKickoff,
+                                               ep(np.minimum(10, 100 - successLine), successLine)) -
+                           (1 - pConvert) * ep(10, failLine),
+                           -ep(10, puntLine),
+                           pMake * (3 - afterKickoff) - (1 - pMake) * ep(10, missLine)])
+
+        # WP of each action, one gmSecRem at a time over every scoreDiff x toGo x yardLine
+        diffs = np.arange(-maxDiff, maxDiff + 1, dtype=np.float64)
+        times = np.arange(0, 3600 + timeStep, timeStep, dtype=np.float64)
+        wpGrid = np.empty((3, len(times), len(diffs), len(toGo)), dtype=np.float32)
+        n = len(diffs) * len(toGo)
+        d = np.repeat(diffs, len(toGo))
+        p, td, pm = [np.tile(a, len(diffs)) for a in [pConvert, touchdown, pMake]]
+        successLine, failLine, puntLine, missLine = [np.tile(a, len(diffs))
+                                                     for a in [successLine, failLine, puntLine, missLine]]
+        firstDown, kickoff = np.full(n, 10.0), np.full(n, float(kickoffYardLine))
+
+        def wp(scoreDiff, clock, toGo, yardLine):
+            return wpModel.wp(pd.DataFrame({'offScoreDiff': scoreDiff, 'gmSecRem': clock, 'down': np.ones(n),
+                                            'toGo': toGo, 'yardLine': yardLine, 'homeTeamPoss': np.full(n, 0.5)}))
+
+        for i, t in enumerate(times):
+            clock = np.full(n, max(t - playSeconds, 0))
+            success = np.where(td, 1 - wp(-(d + 7), clock, firstDown, kickoff),
+                               wp(d, clock, np.minimum(10, 100 - successLine), successLine))
+            fail = 1 - wp(-d, clock, firstDown, failLine)
+            punt = 1 - wp(-d, clock, firstDown, puntLine)
+            make = 1 - wp(-(d + 3), clock, firstDown, kickoff)
+            miss = 1 - wp(-d, clock, firstDown, missLine)
+            wpGrid[:, i] = np.stack([p * success + (1 - p) * fail, punt, pm * make + (1 - pm) * miss]) \
+                .reshape(3, len(diffs), len(toGo))
+        shape = (maxToGo, 99)
+        return cls(epGrid.reshape((3,) + shape).astype(np.float32),
+                   wpGrid.reshape((3, len(times), len(diffs)) + shape), maxToGo, maxDiff, timeStep)
+
+    # Grid indices of states (arrays or scalars); a missing toGo or yardLine counts as 10 or 50, and a missing
+    # scoreDiff or gmSecRem raises ValueError, as no bucket stands for it
+    def _index(self, toGo, yardLine, scoreDiff, gmSecRem):
+        scoreDiff = np.asarray(scoreDiff, dtype=np.float64)
+        gmSecRem = np.asarray(gmSecRem, dtype=np.float64)
+        if np.isnan(scoreDiff).any() or np.isnan(gmSecRem).any():
+            raise ValueError('scoreDiff and gmSecRem must not be NaN')
+        toGoKey = np.clip(np.nan_to_num(np.asarray(toGo, dtype=np.float64), nan=10), 1, self.maxToGo) \
+            .astype(np.intp) - 1
+        yardLineKey = np.clip(np.rint(np.nan_to_num(np.asarray(yardLine, dtype=np.float64), nan=50)), 1, 99) \
+            .astype(np.intp) - 1
+        diffKey = (np.clip(scoreDiff, -self.maxDiff, self.maxDiff) + self.maxDiff).astype(np.intp)
+        timeKey = np.rint(np.clip(gmSecRem, 0, 3600) / self.timeStep).astype(np.intp)
+        return toGoKey, yardLineKey, diffKey, timeKey
+
+    # Look up the WP and EP of every action for each state
+    # Returns (wp, ep), each of shape (number of states, 3) in fourthDownActions order
+    def values(self, toGo, yardLine, scoreDiff, gmSecRem):
+        toGoKey, yardLineKey, diffKey, timeKey = self._index(toGo, yardLine, scoreDiff, gmSecRem)
+        wp = self.wp[:, timeKey, diffKey, toGoKey, yardLineKey]
+        ep = self.ep[:, toGoKey, yardLineKey]
+        return np.atleast_2d(wp.T), np.atleast_2d(ep.T)
+
+    # Return the recommended action (highest WP) of each state
+    def decide(self, toGo, yardLine, scoreDiff, gmSecRem):
+        wp, _ = self.values(toGo, yardLine, scoreDiff, gmSecRem)
+        return np.array(fourthDownActions)[wp.argmax(axis=1)]
+
+    # Write the grid to an .npz file
+    def save(self, path):
+        np.savez_compressed(path, ep=self.ep, wp=self.wp, maxToGo=self.maxToGo, maxDiff=self.maxDiff,
+                            timeStep=self.timeStep)
+
+    # Read a grid written by save
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['ep'], data['wp'], data['maxToGo'], data['maxDiff'], data['timeStep'])
+
+
+# Return the fourth down grid of an nflscrapR csv, built (fitting the EP and WP models on its allPlays) and cached in
+# directory on the first call only; the cache is keyed like pbp_cache.load_all_plays plus the source of gridModules,
+# and stale grids of the same source (and grids cached under the key alone, before grids were named by source) are
+# removed when a new one is written
+def load_grid(pbpPath, directory=cacheDir, rebuild=False):
+    name = 'fourth_down-' + os.path.splitext(os.path.basename(pbpPath))[0].replace(' ', '_')
+    path = os.path.join(directory, '%s-%s.npz' % (name, cache_key(pbpPath, modules=gridModules)))
+    if os.path.exists(path) and not rebuild:
+        return FourthDownGrid.load(path)
+    allPlays = load_all_plays(pbpPath, directory=directory)
+    grid = FourthDownGrid.build(EPModel.fit(allPlays), WPModel.fit(allPlays, GameStore.from_csv(pbpPath)),
+                                fourth_down_outcomes(load_pbp(pbpPath, columns=outcomeCols)))
+    os.makedirs(directory, exist_ok=True)
+    for entry in os.listdir(directory):
+        if entry.endswith('.npz') and entry[:-len('.npz')].rsplit('-', 1)[0] in (name, 'fourth_down') and \
+                entry != os.path.basename(path):
+            os.remove(os.path.join(directory, entry))
+    grid.save(path)
+    return grid
+
+
+# Evaluate every fourth down of allPlays that was a run, pass, sack, punt or field goal (with a score and a clock): the
+# action taken, the grid's recommendation, each action's WP and EP, and the WP given up by the action taken (wpLost)
+def evaluate_fourth_downs(allPlays, grid):
+    plays = allPlays[(allPlays.down == 4) & allPlays.playType.isin(list(actionTypes)) &
+                     allPlays.offScoreDiff.notnull() & allPlays.gmSecRem.notnull()]
+    wp, ep = grid.values(plays.toGo.values, plays.yardLine.values, plays.offScoreDiff.values, plays.gmSecRem.values)
+    actual = plays.playType.map(actionTypes).values
+    taken = pd.Index(fourthDownActions).get_indexer(actual)
+    out = pd.DataFrame({'gameID': plays.gameID.values, 'offTeam': plays.offTeam.values, 'toGo': plays.toGo.values,
+                        'yardLine': plays.yardLine.values, 'offScoreDiff': plays.offScoreDiff.values,
+                        'gmSecRem': plays.gmSecRem.values, 'actual': actual,
+                        'recommended': np.array(fourthDownActions)[wp.argmax(axis=1)]}, index=plays.index)
+    for j, a in enumerate(fourthDownActions):
+        out['wp' + a.capitalize()] = wp[:, j]
+        out['ep' + a.capitalize()] = ep[:, j]
+    out['wpLost'] = wp.max(axis=1) - wp[np.arange(len(plays)), taken]
+    return out
+
+
+# Build (or read) the grid for the bundled csv, time live lookups and the re-evaluation of every fourth down of a
+# replicated season
+# Usage: python fourth_down.py [path to nflscrapR pbp csv]
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'pbp-2019_v2.csv'
+    start = time.perf_counter()
+    grid = load_grid(path, rebuild=True)
+    buildTime = time.perf_counter() - start
+    start = time.perf_counter()
+    grid = load_grid(path)
+    loadTime = time.perf_counter() - start
+    print('grid of %d states built in %.1fs, read from the cache in %.3fs'
+          % (grid.wp[0].size, buildTime, loadTime))
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        grid.decide(2, 60, -3, 400)
+    print('live query: %.1f us; 4th and 2 at opp 40, down 3 with 6:40 left: %s'
+          % ((time.perf_counter() - start) * 1000, grid.decide(2, 60, -3, 400)[0]))
+    wp, ep = grid.values([1, 1, 10, 4], [45, 70, 30, 75], [0, 0, 0, -4], [1800, 1800, 1800, 100])
+    print(pd.DataFrame(np.hstack([wp, ep]), columns=['wpGo', 'wpPunt', 'wpFg', 'epGo', 'epPunt', 'epFg'],
+                       index=['4th and 1 own 45', '4th and 1 opp 30', '4th and 10 own 30',
+                              '4th and 4 opp 25, down 4, 1:40 left']).round(3).to_string())
+
+    try:
+        grid.decide(2, 60, np.nan, 400)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('a NaN scoreDiff was given a bucket')
+
+    allPlays = load_all_plays(path)
+    season = pd.concat([allPlays] * 16)
+    start = time.perf_counter()
+    evaluated = evaluate_fourth_downs(season, grid)
+    print('%d fourth downs re-evaluated in %.3fs' % (len(evaluated), time.perf_counter() - start))
+    single = evaluate_fourth_downs(allPlays, grid)
+    print(pd.crosstab(single.actual, single.recommended))
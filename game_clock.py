@@ -0,0 +1,92 @@
+# import sys, time, numpy and pandas
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Length in seconds of a regulation quarter
+quarterSeconds = 900
+
+
+# Parse game clock strings ('MM:SS' or 'M:SS', as in nflscrapR's time column) into seconds left in the quarter
+# The strings are converted once into a fixed width byte matrix and the digits are read off its columns, so no string
+# is split in Python; missing or malformed clocks give NaN
+def parse_clock(times):
+    raw = np.asarray(times, dtype='S6')
+    chars = raw.view(np.uint8).reshape(len(raw), 6).astype(np.int64)
+    digits = chars - ord('0')
+    isDigit = (digits >= 0) & (digits <= 9)
+
+    # 'MM:SS' has its colon third, 'M:SS' second (and a trailing pad byte where 'MM:SS' has a digit)
+    long = (chars[:, 2] == ord(':')) & isDigit[:, [0, 1, 3, 4]].all(axis=1) & (chars[:, 5] == 0)
+    short = (chars[:, 1] == ord(':')) & isDigit[:, [0, 2, 3]].all(axis=1) & (chars[:, 4] == 0)
+    seconds = np.where(long, (digits[:, 0] * 10 + digits[:, 1]) * 60 + digits[:, 3] * 10 + digits[:, 4],
+                       digits[:, 0] * 60 + digits[:, 2] * 10 + digits[:, 3])
+    return np.where(long | short, seconds, np.nan)
+
+
+# Return qtrSecRem, halfSecRem and gmSecRem from arrays (or scalars) of quarters and seconds left in the quarter
+# Overtime (quarter 5 and later) is a period of its own, so its plays count the overtime clock in all three, as
+# nflscrapR's half_seconds_remaining and game_seconds_remaining do
+def clock_features(quarter, qtrSecRem):
+    quarter = np.asarray(quarter, dtype=np.int64)
+    qtrSecRem = np.asarray(qtrSecRem, dtype=np.float64)
+    regulation = quarter <= 4
+    halfSecRem = np.where(regulation & (quarter % 2 == 1), qtrSecRem + quarterSeconds, qtrSecRem)
+    gmSecRem = np.where(regulation, (4 - quarter) * quarterSeconds + qtrSecRem, qtrSecRem)
+    return qtrSecRem, halfSecRem, gmSecRem
+
+
+# Add qtrSecRem, halfSecRem and gmSecRem columns to plays (columns quarter and minute / second, or qtrSecRem)
+def add_clock(plays):
+    if 'qtrSecRem' in plays:
+        qtrSecRem = plays.qtrSecRem.astype('float64').values
+    else:
+        qtrSecRem = (plays.minute * 60 + plays.second).astype('float64').values
+    qtrSecRem, halfSecRem, gmSecRem = clock_features(plays.quarter.values, qtrSecRem)
+    plays['qtrSecRem'] = qtrSecRem
+    plays['gmSecRem'] = gmSecRem
+    plays['halfSecRem'] = halfSecRem
+    return plays
+
+
+# Check the parsed clock and the time remaining columns against nflscrapR's on copies of the bundled season and time
+# them against splitting the strings and mapping quarters
+# Usage: python game_clock.py [copies of the bundled season]
+if __name__ == '__main__':
+    from pbp_loader import load_pbp
+
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    pbp = load_pbp('pbp-2019_v2.csv', columns=['qtr', 'time', 'quarter_seconds_remaining', 'half_seconds_remaining',
+                                               'game_seconds_remaining'])
+    pbp = pd.concat([pbp] * copies, ignore_index=True)
+
+    start = time.perf_counter()
+    parts = pbp.time.str.split(':', expand=True).astype('float64')
+    splitSecRem = parts[0] * 60 + parts[1]
+    splitTime = time.perf_counter() - start
+    start = time.perf_counter()
+    qtrSecRem = parse_clock(pbp.time.values)
+    parseTime = time.perf_counter() - start
+    np.testing.assert_array_equal(qtrSecRem, splitSecRem.values)
+    np.testing.assert_array_equal(qtrSecRem, pbp.quarter_seconds_remaining.astype('float64').values)
+    np.testing.assert_array_equal(parse_clock(['15:00', '9:24', '0:07', '', 'NA', '1:2', '123:45']),
+                                  [900, 564, 7, np.nan, np.nan, np.nan, np.nan])
+
+    quarter = pbp.qtr.astype('int64')
+    timeMapQtr = {1: 1800, 2: 900, 3: 1800, 4: 900}
+    start = time.perf_counter()
+    mapHalfSecRem = quarter.map(timeMapQtr) - 900 + qtrSecRem
+    mapTime = time.perf_counter() - start
+    start = time.perf_counter()
+    _, halfSecRem, gmSecRem = clock_features(quarter.values, qtrSecRem)
+    clockTime = time.perf_counter() - start
+    for values, column in [(halfSecRem, 'half_seconds_remaining'), (gmSecRem, 'game_seconds_remaining')]:
+        np.testing.assert_array_equal(values, pbp[column].astype('float64').values)
+    overtime = (quarter == 5).values
+    assert not np.isnan(halfSecRem[overtime]).any() and mapHalfSecRem[overtime].isnull().all()
+
+    print('%d clocks: str.split %.1f ms, parse_clock %.1f ms; halfSecRem by map %.1f ms, clock_features %.1f ms '
+          '(%d overtime plays, none NaN)' % (len(pbp), splitTime * 1000, parseTime * 1000, mapTime * 1000,
+                                             clockTime * 1000, overtime.sum()))
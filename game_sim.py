@@ -0,0 +1,290 @@
+# import concurrent.futures, os, sys, time, numpy and pandas
+import concurrent.futures
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from wp_model import fit_logistic
+
+# Distance buckets (upper edges of toGo) that scrimmage play outcomes are drawn by, with the down
+toGoEdges = [3, 7, 10]
+
+# Seconds off the clock for plays the transition data has no timing for
+puntSeconds, fieldGoalSeconds, kickoffSeconds = 8, 5, 5
+
+# Points of a touchdown (with the extra point) and a safety
+tdPoints, fieldGoalPoints, safetyPoints = 7, 3, 2
+
+# Scrimmage play types that outcomes are drawn from
+scrimmageTypes = ['RUSH', 'PASS', 'SACK']
+
+# Fourth down actions
+actions = ['go', 'punt', 'fg']
+
+
+# Empirical transition data of allPlays: scrimmage play outcomes (yards, turnover, seconds run off) pooled by down and
+# toGo bucket, net punt distances, the field position after kick offs and a logistic fit of field goal success by
+# distance
+class Transitions:
+
+    def __init__(self, yards, turnover, seconds, offsets, puntNet, kickoffYardLine, fieldGoalCoef):
+        self.yards = yards
+        self.turnover = turnover
+        self.seconds = seconds
+        self.offsets = offsets
+        self.puntNet = puntNet
+        self.kickoffYardLine = kickoffYardLine
+        self.fieldGoalCoef = fieldGoalCoef
+
+    # Estimate the transitions from allPlays (in play order)
+    # A fumble is a turnover when the next play in the game has the other offense (and the play was not a touchdown);
+    # seconds are the gmSecRem elapsed before the next play, capped at 60
+    @classmethod
+    def from_plays(cls, allPlays):
+        nextOff = allPlays.groupby('gameID', sort=False).offTeam.shift(-1)
+        nextYardLine = allPlays.groupby('gameID', sort=False).yardLine.shift(-1)
+        nextClock = allPlays.groupby('gameID', sort=False).gmSecRem.shift(-1)
+        changed = (nextOff.notnull() & (nextOff != allPlays.offTeam)).values
+
+        plays = (allPlays.playType.isin(scrimmageTypes) & allPlays.down.between(1, 4)).values
+        group = (allPlays.down.values[plays].astype(np.intp) - 1) * (len(toGoEdges) + 1) + \
+            np.searchsorted(toGoEdges, allPlays.toGo.values[plays])
+        order = np.argsort(group, kind='stable')
+        yards = np.nan_to_num(allPlays.yards.values[plays].astype(np.float64))
+        turnover = (allPlays.isInterception.values[plays] == 1) | \
+            ((allPlays.isFumble.values[plays] == 1) & changed[plays] & (allPlays.isTouchdown.values[plays] != 1))
+        seconds = (allPlays.gmSecRem.values - nextClock.values)[plays]
+        seconds = np.clip(np.where(np.isnan(seconds), np.nanmedian(seconds), seconds), 0, 60)
+        offsets = np.append(0, np.cumsum(np.bincount(group, minlength=4 * (len(toGoEdges) + 1))))
+
+        # Net punts (the receiving offense's next yardLine) and kick off returns
+        punts = (allPlays.playType == 'PUNT').values & changed & nextYardLine.notnull().values
+        puntNet = 100 - allPlays.yardLine.values[punts] - nextYardLine.values[punts]
+        kickoffs = (allPlays.playType == 'KICK OFF').values & nextYardLine.notnull().values
+        kickoffYardLine = nextYardLine.values[kickoffs]
+
+        # Field goal success by distance (yardLine to the goal line plus 17), a logistic fit (see wp_model.fit_logistic)
+        kicks = allPlays[(allPlays.playType == 'FIELD GOAL') & allPlays.yardLine.notnull()]
+        X = np.column_stack([np.ones(len(kicks)), 117 - kicks.yardLine.values])
+        coef = fit_logistic(X, kicks.isFieldGoalSuccessful.values.astype(np.float64), ridge=1e-3)
+        kickoffYardLine = kickoffYardLine[(kickoffYardLine >= 1) & (kickoffYardLine <= 99)]
+        return cls(yards[order], turnover[order], seconds[order], offsets, puntNet[(puntNet >= 0) & (puntNet <= 80)],
+                   kickoffYardLine, coef)
+
+    # Return the outcome group drawn from for each down x toGo bucket: the bucket itself, or the nearest bucket of the
+    # same down that has plays (the shorter one on a tie); raises ValueError if a down has no plays at all
+    def draw_groups(self):
+        counts = np.diff(self.offsets).reshape(4, len(toGoEdges) + 1)
+        buckets = np.arange(counts.shape[1])
+        groups = np.empty(counts.shape, dtype=np.intp)
+        for d in range(4):
+            filled = np.flatnonzero(counts[d])
+            if not len(filled):
+                raise ValueError('no scrimmage plays on down %d to draw outcomes from' % (d + 1))
+            groups[d] = d * counts.shape[1] + filled[np.abs(buckets[:, None] - filled).argmin(axis=1)]
+        return groups.ravel()
+
+    # Probability of making a field goal from yardLine
+    def field_goal_prob(self, yardLine):
+        return 1 / (1 + np.exp(-(self.fieldGoalCoef[0] + self.fieldGoalCoef[1] * (117 - yardLine))))
+
+    # Write the transitions to an .npz file
+    def save(self, path):
+        np.savez_compressed(path, **vars(self))
+
+    # Read transitions written by save
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(**{k: data[k] for k in data.files})
+
+
+# Default fourth down decisions (0 go, 1 punt, 2 field goal): kick a field goal of 55 yards or less unless trailing
+# by more than 3 in the last five minutes, go for it on 4th and 1 past midfield or when trailing in the last five
+# minutes, otherwise punt
+def default_policy(toGo, yardLine, scoreDiff, gmSecRem):
+    late = (scoreDiff < 0) & (gmSecRem < 300)
+    fg = (yardLine >= 62) & ~(late & (scoreDiff < -3))
+    go = ~fg & (((toGo <= 1) & (yardLine >= 50)) | late)
+    return np.where(fg, 2, np.where(go, 0, 1))
+
+
+# Simulate n games from one state (down, toGo, yardLine, gmSecRem and scoreDiff of the offense) with random generator
+# rng, all games advancing one play per vectorized step until gmSecRem runs out (no halftime kick off or overtime, so
+# games can end tied)
+# firstAction: force the first play to 'go', 'punt' or 'fg' (for fourth down decisions); driveOnly: stop every game
+# at the end of the first drive
+# Returns the final score differential of the starting offense and the points of the first drive (for it)
+def _simulate(trans, state, n, rng, firstAction=None, driveOnly=False, policy=default_policy, maxSteps=1000):
+    offense = np.zeros(n, dtype=np.int8)
+    scores = np.zeros((n, 2))
+    scores[:, 0] = state.get('scoreDiff', 0)
+    down = np.full(n, state.get('down', 1), dtype=np.int64)
+    toGo = np.full(n, state.get('toGo', 10), dtype=np.float64)
+    yardLine = np.full(n, state.get('yardLine', 25), dtype=np.float64)
+    clock = np.full(n, state.get('gmSecRem', 3600), dtype=np.float64)
+    drivePoints = np.zeros(n)
+    driveOver = np.zeros(n, dtype=bool)
+    drawGroups = trans.draw_groups()
+    groupCounts = np.diff(trans.offsets)
+    rows = np.arange(n)
+
+    for step in range(maxSteps):
+        live = np.flatnonzero((clock > 0) & ~(driveOnly & driveOver))
+        if not len(live):
+            break
+        off = offense[live]
+        diff = scores[live, off] - scores[live, 1 - off]
+        d, tg, yl = down[live], toGo[live], yardLine[live]
+        action = np.zeros(len(live), dtype=np.int64)
+        fourth = d == 4
+        action[fourth] = policy(tg[fourth], yl[fourth], diff[fourth], clock[live][fourth])
+        if step == 0 and firstAction is not None:
+            action[:] = actions.index(firstAction)
+
+        points = np.zeros(len(live))
+        change = np.zeros(len(live), dtype=bool)
+        newYardLine = yl.copy()
+        seconds = np.zeros(len(live))
+
+        # Scrimmage plays: draw an outcome from the pooled plays of the down and toGo bucket (see draw_groups)
+        go = action == 0
+        group = drawGroups[(d[go] - 1) * (len(toGoEdges) + 1) + np.searchsorted(toGoEdges, tg[go])]
+        pick = trans.offsets[group] + (rng.random(go.sum()) * groupCounts[group]).astype(np.int64)
+        gained, lost = trans.yards[pick], trans.turnover[pick]
+        spot = yl[go] + gained
+        td, safety = ~lost & (spot >= 100), ~lost & (spot <= 0)
+        first = ~lost & ~td & ~safety & (gained >= tg[go])
+        failed = ~lost & ~td & ~safety & ~first & (d[go] == 4)
+        goPoints = np.where(td, tdPoints, np.where(safety, -safetyPoints, 0))
+        seconds[go] = trans.seconds[pick]
+        points[go] = goPoints
+        change[go] = lost | td | safety | failed
+        newYardLine[go] = np.where(lost | failed, 100 - np.clip(spot, 1, 99), np.clip(spot, 1, 99))
+        kickoff = np.zeros(len(live), dtype=bool)
+        kickoff[go] = td | safety
+
+        # Down and distance after a scrimmage play that keeps the ball
+        keep = np.flatnonzero(go)[~change[go]]
+        down[live[keep]] = np.where(first[~change[go]], 1, d[keep] + 1)
+        toGo[live[keep]] = np.where(first[~change[go]], np.minimum(10, 100 - newYardLine[keep]),
+                                    tg[keep] - gained[~change[go]])
+
+        # Punts (a touchback when the net punt reaches the end zone) and field goals (a miss gives the ball at the
+        # spot of the kick, or the 20)
+        punt = np.flatnonzero(action == 1)
+        net = trans.puntNet[rng.integers(0, len(trans.puntNet), len(punt))]
+        newYardLine[punt] = np.where(yl[punt] + net >= 100, 20, 100 - np.clip(yl[punt] + net, 1, 99))
+        change[punt] = True
+        seconds[punt] = puntSeconds
+        fg = np.flatnonzero(action == 2)
+        made = rng.random(len(fg)) < trans.field_goal_prob(yl[fg])
+        points[fg] = np.where(made, fieldGoalPoints, 0)
+        newYardLine[fg] = np.where(made, yl[fg], np.maximum(100 - (yl[fg] - 7), 20))
+        change[fg] = True
+        kickoff[fg] = made
+        seconds[fg] = fieldGoalSeconds
+
+        # Score (points are signed for the offense, so a safety scores for the defense), then hand the ball to the other
+        # team on every change of possession, including kick offs after scores
+        scorer = np.where(points >= 0, off, 1 - off)
+        scores[live, scorer] += np.abs(points)
+        firstDrive = ~driveOver[live]
+        drivePoints[live[firstDrive]] += points[firstDrive]
+        driveOver[live[change]] = True
+        kicked = np.flatnonzero(kickoff)
+        newYardLine[kicked] = trans.kickoffYardLine[rng.integers(0, len(trans.kickoffYardLine), len(kicked))]
+        seconds[kicked] += kickoffSeconds
+        changed = np.flatnonzero(change)
+        offense[live[changed]] = 1 - off[changed]
+        down[live[changed]] = 1
+        toGo[live[changed]] = np.minimum(10, 100 - newYardLine[changed])
+        yardLine[live] = newYardLine
+        clock[live] -= seconds
+
+    return scores[rows, 0] - scores[rows, 1], drivePoints
+
+
+# Simulate one chunk of games (the unit of work of the process pool)
+def _simulate_chunk(args):
+    trans, state, n, seedSequence, firstAction, driveOnly = args
+    return _simulate(trans, state, n, np.random.default_rng(seedSequence), firstAction, driveOnly)
+
+
+# Simulate n games (or first drives, with driveOnly) from state in chunks seeded from seed, so the results are the same
+# whatever the number of processes
+# Returns a frame with the final scoreDiff of the starting offense and its first drive's points
+def simulate_games(trans, state, n, seed=0, processes=1, chunks=16, firstAction=None, driveOnly=False):
+    sizes = [len(c) for c in np.array_split(np.arange(n), chunks)]
+    work = [(trans, state, size, seedSequence, firstAction, driveOnly)
+            for size, seedSequence in zip(sizes, np.random.SeedSequence(seed).spawn(chunks))]
+    if processes > 1:
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_simulate_chunk, work))
+    else:
+        results = [_simulate_chunk(w) for w in work]
+    return pd.DataFrame({'scoreDiff': np.concatenate([r[0] for r in results]),
+                         'drivePoints': np.concatenate([r[1] for r in results])})
+
+
+# Summarize simulated games: win probability of the starting offense (ties count half), mean and quantiles of the
+# final score differential
+def summarize(games):
+    diff = games.scoreDiff.values
+    return pd.Series({'wp': np.mean(diff > 0) + 0.5 * np.mean(diff == 0), 'meanDiff': diff.mean(),
+                      'p10': np.percentile(diff, 10), 'p50': np.percentile(diff, 50), 'p90': np.percentile(diff, 90),
+                      'drivePoints': games.drivePoints.mean()})
+
+
+# Compare the fourth down actions from state by simulating n games after each
+def fourth_down(trans, state, n, seed=0, processes=1):
+    return pd.DataFrame({a: summarize(simulate_games(trans, dict(state, down=4), n, seed, processes, firstAction=a))
+                         for a in actions}).T
+
+
+# Estimate the transitions from the bundled season, time games and drives, check seeded runs reproduce across process
+# counts and compare fourth down decisions
+# Usage: python game_sim.py [games]
+if __name__ == '__main__':
+    from pbp_cache import cacheDir, load_all_plays
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    allPlays = load_all_plays('pbp-2019_v2.csv')
+    trans = Transitions.from_plays(allPlays)
+    os.makedirs(cacheDir, exist_ok=True)
+    trans.save(os.path.join(cacheDir, 'transitions.npz'))
+    trans = Transitions.load(os.path.join(cacheDir, 'transitions.npz'))
+
+    kickoff = {'down': 1, 'toGo': 10, 'yardLine': 25, 'gmSecRem': 3600, 'scoreDiff': 0}
+    for name, driveOnly in [('drives', True), ('games', False)]:
+        start = time.perf_counter()
+        sims = simulate_games(trans, kickoff, n, seed=1, driveOnly=driveOnly)
+        elapsed = time.perf_counter() - start
+        print('%d %s from 1st and 10 at own 25: %.2fs (%d per second)' % (n, name, elapsed, n / elapsed))
+        print(summarize(sims).round(3).to_string())
+
+    pd.testing.assert_frame_equal(simulate_games(trans, kickoff, 2000, seed=7),
+                                  simulate_games(trans, kickoff, 2000, seed=7, processes=2))
+    print('seeded runs match with 1 and 2 processes')
+
+    # A down and toGo bucket without plays (4th and more than 10) draws from the nearest bucket of the same down, and
+    # a down without plays cannot be simulated
+    buckets = len(toGoEdges) + 1
+    sparse = Transitions.from_plays(allPlays[~((allPlays.down == 4) & (allPlays.toGo > toGoEdges[-1]))])
+    assert np.diff(sparse.offsets)[4 * buckets - 1] == 0 and sparse.draw_groups()[4 * buckets - 1] == 4 * buckets - 2
+    assert (sparse.draw_groups()[:4 * buckets - 1] == np.arange(4 * buckets - 1)).all()
+    longGo = simulate_games(sparse, {'down': 4, 'toGo': 15, 'yardLine': 60}, 2000, seed=5, firstAction='go',
+                            driveOnly=True)
+    assert np.isfinite(longGo.values).all()
+    try:
+        Transitions.from_plays(allPlays[allPlays.down != 4]).draw_groups()
+        raise AssertionError('a down without plays was simulated')
+    except ValueError:
+        pass
+    for state in [{'toGo': 1, 'yardLine': 55, 'gmSecRem': 1800, 'scoreDiff': 0},
+                  {'toGo': 4, 'yardLine': 70, 'gmSecRem': 120, 'scoreDiff': -4}]:
+        print(state)
+        print(fourth_down(trans, state, n // 4, seed=3).round(3).to_string())
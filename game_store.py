@@ -0,0 +1,119 @@
+# import sys, time, numpy and pandas
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from pbp_loader import gameCols, game_frame, load_pbp
+
+
+# Game level metadata (the sched columns: week, teams, winner, loser, points, yards, turnovers) keyed by integer gameID
+# Games are kept in gameID order and found for any play by a binary search of its gameID, so plays only need to carry
+# the key and a game attribute is gathered by position when it is asked for
+class GameStore:
+
+    def __init__(self, games):
+        self.games = games.sort_index()
+        self.gameIDs = self.games.index.values.astype(np.int64)
+
+    # Build the store from a typed nflscrapR pbp frame (see pbp_loader.game_frame), so no schedule csv is needed
+    @classmethod
+    def from_pbp(cls, pbp, seasonOpeners=None):
+        return cls(game_frame(pbp, seasonOpeners))
+
+    # Build the store from an nflscrapR csv, reading only the columns the game table is derived from
+    @classmethod
+    def from_csv(cls, path):
+        return cls.from_pbp(load_pbp(path, columns=gameCols))
+
+    # Build the store of the source csv file(s) of all_plays.read_source: the schedule csv (indexed by gameID) with
+    # schedPath, otherwise the games derived from the nflscrapR csv at pbpPath
+    @classmethod
+    def from_source(cls, pbpPath, schedPath=None):
+        if schedPath is None:
+            return cls.from_csv(pbpPath)
+        return cls(pd.read_csv(schedPath, index_col='gameID'))
+
+    # Return the int32 positions of gameIDs in the store (-1 for games it does not have)
+    def locate(self, gameIDs):
+        gameIDs = np.asarray(gameIDs, dtype=np.int64)
+        if not len(self.gameIDs):
+            return np.full(gameIDs.shape, -1, dtype=np.int32)
+        pos = np.minimum(np.searchsorted(self.gameIDs, gameIDs), len(self.gameIDs) - 1)
+        return np.where(self.gameIDs[pos] == gameIDs, pos, -1).astype(np.int32)
+
+    # Return columns (all by default) of the games of gameIDs, one row per gameID in the same order (NaN for games
+    # the store does not have)
+    def lookup(self, gameIDs, columns=None):
+        pos = self.locate(gameIDs)
+        games = self.games if columns is None else self.games[list(columns)]
+        if (pos < 0).any():
+            return games.reset_index(drop=True).reindex(pos).reset_index(drop=True)
+        return games.iloc[pos].reset_index(drop=True)
+
+    # Add columns (all by default) of each play's game to plays (which have a gameID column), dropping plays of games
+    # the store does not have, as an inner merge on gameID would
+    def attach(self, plays, columns=None):
+        pos = self.locate(plays.gameID.values)
+        if (pos < 0).any():
+            plays = plays[pos >= 0]
+            pos = pos[pos >= 0]
+        games = self.games if columns is None else self.games[list(columns)]
+        return pd.concat([plays, games.take(pos).set_axis(plays.index)], axis=1)
+
+    # Write the games to a Parquet file
+    def save(self, path):
+        self.games.to_parquet(path)
+
+    # Read a store written by save
+    @classmethod
+    def load(cls, path):
+        return cls(pd.read_parquet(path))
+
+
+# Derive the store from the bundled csv, check it against the sched of the pipeline and compare merging the game
+# columns onto copies of the season's plays with attaching them and looking one up by position
+# Usage: python game_store.py [copies of the bundled season]
+if __name__ == '__main__':
+    import os
+
+    from all_plays import playGameCols
+    from pbp_cache import cacheDir, load_all_plays
+    from pbp_loader import to_pipeline_frames
+
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    start = time.perf_counter()
+    store = GameStore.from_csv('pbp-2019_v2.csv')
+    storeTime = time.perf_counter() - start
+    pd.testing.assert_frame_equal(store.games, to_pipeline_frames(load_pbp('pbp-2019_v2.csv'))[1])
+
+    allPlays = load_all_plays('pbp-2019_v2.csv')
+    gameColumns = [c for c in store.games.columns if c != 'Date']
+    keyed = allPlays.drop(columns=playGameCols)
+    keyed = pd.concat([keyed.assign(gameID=keyed.gameID + c * 10 ** 10) for c in range(copies)], ignore_index=True)
+    store = GameStore(pd.concat([store.games.set_axis(store.games.index + c * 10 ** 10) for c in range(copies)]))
+
+    start = time.perf_counter()
+    merged = keyed.merge(store.games, left_on='gameID', right_index=True).drop(['Date'], axis=1)
+    mergeTime = time.perf_counter() - start
+    start = time.perf_counter()
+    attached = store.attach(keyed, gameColumns)
+    attachTime = time.perf_counter() - start
+    pd.testing.assert_frame_equal(attached, merged)
+    start = time.perf_counter()
+    winner = store.lookup(keyed.gameID.values, ['winner']).winner
+    lookupTime = time.perf_counter() - start
+    assert (winner.values == merged.winner.values).all()
+
+    print('%d games derived from the csv in %.1f ms' % (len(store.games) // copies, storeTime * 1000))
+    print('%d plays: merge %.1f ms, attach %.1f ms, winner by position %.2f ms; game columns on every play %.1f MB, '
+          'store %.2f MB' % (len(keyed), mergeTime * 1000, attachTime * 1000, lookupTime * 1000,
+                             merged[gameColumns].memory_usage(deep=True).sum() / 2 ** 20,
+                             store.games.memory_usage(deep=True).sum() / 2 ** 20))
+
+    os.makedirs(cacheDir, exist_ok=True)
+    store.save(os.path.join(cacheDir, 'games.parquet'))
+    pd.testing.assert_frame_equal(GameStore.load(os.path.join(cacheDir, 'games.parquet')).games, store.games,
+                                  check_dtype=False)
+    assert store.lookup([1, store.gameIDs[-1]], ['homeTeam']).homeTeam.isnull().tolist() == [True, False]
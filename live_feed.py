@@ -0,0 +1,209 @@
+# import csv, sys, time and numpy
+import csv
+import sys
+import time
+
+import numpy as np
+
+from game_clock import clock_features, parse_clock
+
+# Timeouts each team has at the start of a half and of overtime
+halfTimeouts = 3
+overtimeTimeouts = 2
+
+
+# Yield the plays of an nflscrapR csv one record (a dict of strings) at a time, in file order, as a stand-in for a
+# live feed
+# delay: seconds to wait before every play
+def replay_feed(path, delay=0):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for play in csv.DictReader(f):
+            if delay:
+                time.sleep(delay)
+            yield play
+
+
+# Return a field of a play record as a float (None when missing or 'NA')
+def _num(play, field):
+    value = play.get(field)
+    if value is None or value == '' or value == 'NA':
+        return None
+    return float(value)
+
+
+# Return a field of a play record as a string (None when missing or 'NA')
+def _str(play, field):
+    value = play.get(field)
+    return None if value is None or value == '' or value == 'NA' else value
+
+
+# Compact state of one game in progress: the teams, the score and the timeouts of each (home first) and the quarter
+# of the last play seen
+class GameState:
+    __slots__ = ['homeTeam', 'awayTeam', 'scores', 'timeouts', 'quarter']
+
+    def __init__(self, homeTeam, awayTeam):
+        self.homeTeam = homeTeam
+        self.awayTeam = awayTeam
+        self.scores = [0, 0]
+        self.timeouts = [halfTimeouts, halfTimeouts]
+        self.quarter = 1
+
+    # Return 0 for the home team and 1 for the away team
+    def side(self, team):
+        return 0 if team == self.homeTeam else 1
+
+
+# Process a live feed one play at a time: every play record is enriched from the state of its game before the play
+# (score, timeouts, clock, field position flags, expected points and win probability of the offense), then the state
+# is moved on by the play's scoring and timeout fields
+# epModel / wpModel: fitted ep_model.EPModel / wp_model.WPModel (either may be None to skip ep / wp)
+class LiveProcessor:
+
+    def __init__(self, epModel=None, wpModel=None):
+        self.epModel = epModel
+        self.wpModel = wpModel
+        self.games = {}
+
+    # Return the enriched play (a dict of allPlays-named values) for one play record
+    def process(self, play):
+        gameID = int(play['game_id'])
+        state = self.games.get(gameID)
+        if state is None:
+            state = self.games[gameID] = GameState(play['home_team'], play['away_team'])
+
+        # A new half resets the timeouts, overtime gives each team fewer
+        quarter = int(play['qtr'])
+        if quarter != state.quarter:
+            if quarter == 3 or quarter == 5:
+                state.timeouts = [halfTimeouts if quarter == 3 else overtimeTimeouts] * 2
+            state.quarter = quarter
+
+        # Clock, as build_all_plays derives it (from the 'MM:SS' time field when the record has no seconds)
+        qtrSecRem = _num(play, 'quarter_seconds_remaining')
+        if qtrSecRem is None:
+            qtrSecRem = parse_clock([play.get('time') or ''])[0]
+        qtrSecRem, halfSecRem, gmSecRem = (float(t) for t in clock_features(quarter, qtrSecRem))
+
+        offTeam = _str(play, 'posteam')
+        defTeam = _str(play, 'defteam')
+        down = _num(play, 'down')
+        toGo = _num(play, 'ydstogo')
+        yardLine = _num(play, 'yardline_100')
+        yardLine = None if yardLine is None else 100 - yardLine
+        out = {'gameID': gameID, 'playID': gameID * 10000 + int(play['play_id']), 'quarter': quarter,
+               'offTeam': offTeam, 'defTeam': defTeam, 'down': down, 'toGo': toGo, 'yardLine': yardLine,
+               'qtrSecRem': qtrSecRem, 'halfSecRem': halfSecRem, 'gmSecRem': gmSecRem,
+               'homeScore': state.scores[0], 'awayScore': state.scores[1],
+               'homeTimeoutsRem': state.timeouts[0], 'awayTimeoutsRem': state.timeouts[1],
+               'isGoalToGo': int(yardLine is not None and yardLine >= 90),
+               'isRedZone': int(yardLine is not None and yardLine > 80), 'isUTM': int(halfSecRem <= 120)}
+
+        if offTeam is not None:
+            off = state.side(offTeam)
+            out['homeTeamPoss'] = 1 - off
+            out['offScoreDiff'] = state.scores[off] - state.scores[1 - off]
+            out['offTimeoutsRem'] = state.timeouts[off]
+            out['defTimeoutsRem'] = state.timeouts[1 - off]
+            nan = float('nan')
+            if self.epModel is not None:
+                out['ep'] = float(self.epModel.ep(nan if down is None else down, nan if toGo is None else toGo,
+                                                  nan if yardLine is None else yardLine, halfSecRem))
+            if self.wpModel is not None:
+                out['wp'] = float(self.wpModel.wp_state(
+                    out['offScoreDiff'], gmSecRem, nan if down is None else down, nan if toGo is None else toGo,
+                    nan if yardLine is None else yardLine, out['homeTeamPoss'], out['offTimeoutsRem'],
+                    out['defTimeoutsRem'])[0])
+
+        self._update(state, play, offTeam, defTeam)
+        return out
+
+    # Move the state of a game on by one play's scoring and timeout fields
+    def _update(self, state, play, offTeam, defTeam):
+        tdTeam = _str(play, 'td_team')
+        if tdTeam is not None:
+            state.scores[state.side(tdTeam)] += 6
+        if offTeam is not None:
+            off = state.side(offTeam)
+            if play.get('field_goal_result') == 'made':
+                state.scores[off] += 3
+            if play.get('extra_point_result') == 'good':
+                state.scores[off] += 1
+            if play.get('two_point_conv_result') == 'success':
+                state.scores[off] += 2
+            if play.get('safety') == '1' and defTeam is not None:
+                state.scores[1 - off] += 2
+            if play.get('defensive_two_point_conv') == '1' or play.get('defensive_extra_point_conv') == '1':
+                state.scores[1 - off] += 2
+        if play.get('timeout') == '1':
+            timeoutTeam = _str(play, 'timeout_team')
+            if timeoutTeam is not None:
+                side = state.side(timeoutTeam)
+                state.timeouts[side] = max(state.timeouts[side] - 1, 0)
+
+    # Drop the state of a finished game and return it
+    def end_game(self, gameID):
+        return self.games.pop(gameID, None)
+
+
+# Replay the bundled csv through the processor, check the running scores and timeouts against nflscrapR's, compare
+# ep / wp with the batch models and report the per-play latency
+# Usage: python live_feed.py [path to nflscrapR pbp csv]
+if __name__ == '__main__':
+    from ep_model import EPModel
+    from game_store import GameStore
+    from pbp_cache import load_all_plays
+    from wp_model import WPModel, add_wp
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'pbp-2019_v2.csv'
+    allPlays = load_all_plays(path)
+    epModel = EPModel.fit(allPlays)
+    wpModel = WPModel.fit(allPlays, GameStore.from_csv(path))
+    processor = LiveProcessor(epModel, wpModel)
+
+    latencies = []
+    plays = {}
+    changed = set()
+    scoreMisses = timeoutMisses = 0
+    for play in replay_feed(path):
+        start = time.perf_counter()
+        out = processor.process(play)
+        latencies.append(time.perf_counter() - start)
+        plays[out['playID']] = out
+
+        # nflscrapR's scores and timeouts are those after the play
+        state = processor.games[out['gameID']]
+        if state.scores != [out['homeScore'], out['awayScore']] or \
+                state.timeouts != [out['homeTimeoutsRem'], out['awayTimeoutsRem']]:
+            changed.add(out['playID'])
+        scores = [_num(play, 'total_home_score'), _num(play, 'total_away_score')]
+        if None not in scores and state.scores != scores:
+            scoreMisses += 1
+        timeouts = [_num(play, 'home_timeouts_remaining'), _num(play, 'away_timeouts_remaining')]
+        if None not in timeouts and state.timeouts != timeouts:
+            timeoutMisses += 1
+
+    latencies = np.array(latencies) * 1e6
+    print('%d plays of %d games: score mismatches %d, timeout mismatches %d'
+          % (len(plays), len(processor.games), scoreMisses, timeoutMisses))
+    print('latency per play: p50 %.0f us, p99 %.0f us, max %.0f us'
+          % (np.percentile(latencies, 50), np.percentile(latencies, 99), latencies.max()))
+
+    # The live values match the batch models wherever allPlays has the play
+    scored = add_wp(allPlays, wpModel)
+    live = [plays[playID] for playID in scored.index]
+    liveEP = np.array([p.get('ep', np.nan) for p in live])
+    liveWP = np.array([p.get('wp', np.nan) for p in live])
+    batchEP = epModel.ep(scored.down.values, scored.toGo.values, scored.yardLine.values)
+    hasOff = scored.offTeam.notnull().values
+    np.testing.assert_allclose(liveEP[hasOff], batchEP[hasOff], equal_nan=True)
+    # allPlays' scores and timeouts are those after the play, so the wp of a play that scores or takes a timeout is
+    # scored from a different state; every other play with an offense has the same state on both paths
+    same = hasOff & ~scored.index.isin(list(changed))
+    np.testing.assert_array_equal(np.array([p.get('offScoreDiff', np.nan) for p in live])[same],
+                                  scored.offScoreDiff.values[same])
+    np.testing.assert_allclose(liveWP[same], scored.wp.values[same], rtol=1e-9)
+    print('ep of %d plays and wp of %d plays match the batch models; wp of the %d plays that score or take a timeout '
+          'differ by %.3f on average' % (hasOff.sum(), same.sum(), (hasOff & ~same).sum(),
+                                         np.abs(liveWP - scored.wp.values)[hasOff & ~same].mean()))
+    assert np.percentile(latencies, 99) < 1000
@@ -0,0 +1,89 @@
+# import pandas, numpy and time
+import time
+
+import numpy as np
+import pandas as pd
+
+# Create dictionary by quarter that maps each quarter to its scoring period (overtime is its own period)
+halfMapQtr = {1: 1, 2: 1, 3: 2, 4: 2, 5: 3}
+
+
+# Label every play in allPlays with the next score (nextScore) and the team that scored it (nextScoreTeamCode)
+# scorePlay and scoreTeamCode are back filled within each gameID / half in one grouped pass, so the next score never
+# crosses a game or half boundary. Plays with no later score in their half get nextScore = 0.
+# Expects allPlays to be sorted in play order (as at the end of test 8.py) with columns gameID, quarter, scorePlay,
+# scoreTeamCode and offTeamCode
+def add_next_score(allPlays, gameCol='gameID', qtrCol='quarter'):
+
+    # Only non-zero scorePlay values mark a scoring play
+    scorePlay = allPlays.scorePlay.where(allPlays.scorePlay > 0)
+    scoreTeamCode = allPlays.scoreTeamCode.where(scorePlay.notnull())
+
+    # Back fill scorePlay and scoreTeamCode by gameID and half
+    half = allPlays[qtrCol].map(halfMapQtr)
+    nextScores = pd.DataFrame({'nextScore': scorePlay, 'nextScoreTeamCode': scoreTeamCode}, index=allPlays.index)
+    nextScores = nextScores.groupby([allPlays[gameCol], half], sort=False, dropna=False).bfill()
+    allPlays['nextScoreTeamCode'] = nextScores.nextScoreTeamCode
+
+    # Establish binary columns for whether offTeamCode or defTeamCode == nextScoreTeamCode
+    isNextScoreOffTeam = (allPlays.offTeamCode == allPlays.nextScoreTeamCode).astype(int)
+    allPlays['isNextScoreOffTeam'] = isNextScoreOffTeam
+    allPlays['isNextScoreDefTeam'] = (1 - isNextScoreOffTeam) * -1
+
+    # nextScore is positive in rows where offTeam == nextScoreTeam and negative where offTeam != nextScoreTeam
+    allPlays['nextScore'] = ((allPlays.isNextScoreDefTeam + isNextScoreOffTeam) * nextScores.nextScore).fillna(0)
+
+    return allPlays
+
+
+# Original loop from test 8.py, kept for the benchmark below (O(plays^2) and leaks across games)
+def legacy_next_score(allPlays):
+    for g in allPlays.gameID:
+        allPlays.nextScore = allPlays.scorePlay.bfill()
+        allPlays['nextScoreTeamCode'] = allPlays.scoreTeamCode.bfill()
+    return allPlays
+
+
+# Build a minimal allPlays-like frame (gameID, quarter, offTeamCode, scorePlay, scoreTeamCode) from the bundled
+# nflscrapR csv, replicated `copies` times under new gameIDs to simulate multiple seasons
+def benchmark_frame(path='pbp-2019_v2.csv', copies=1):
+    pbp = pd.read_csv(path, usecols=['game_id', 'qtr', 'posteam', 'defteam', 'total_home_score',
+                                     'total_away_score', 'home_team', 'away_team'])
+    teamCodes = {t: i + 1 for i, t in enumerate(sorted(pd.concat([pbp.posteam, pbp.defteam]).dropna().unique()))}
+
+    # Points scored on each play come from the change in the running home / away totals
+    homePts = pbp.groupby('game_id').total_home_score.diff().fillna(0)
+    awayPts = pbp.groupby('game_id').total_away_score.diff().fillna(0)
+    frame = pd.DataFrame({'gameID': pbp.game_id,
+                          'quarter': pbp.qtr,
+                          'offTeamCode': pbp.posteam.map(teamCodes),
+                          'scorePlay': (homePts + awayPts).replace({0: np.nan})})
+    frame['scoreTeamCode'] = np.where(homePts > 0, pbp.home_team.map(teamCodes),
+                                      np.where(awayPts > 0, pbp.away_team.map(teamCodes), np.nan))
+    frame['scoreTeamCode'] = frame.scoreTeamCode.where(frame.scorePlay.notnull())
+    frame['nextScore'] = np.nan
+
+    # Replicate the season under offset gameIDs
+    frames = [frame.assign(gameID=frame.gameID + c * 10 ** 10) for c in range(copies)]
+    return pd.concat(frames, ignore_index=True)
+
+
+# Time the legacy loop against add_next_score on the bundled csv and on a replicated multi-season frame
+if __name__ == '__main__':
+    small = benchmark_frame()
+    start = time.perf_counter()
+    legacy_next_score(small.copy())
+    legacyTime = time.perf_counter() - start
+    start = time.perf_counter()
+    add_next_score(small.copy())
+    newTime = time.perf_counter() - start
+    print('%d plays: legacy loop %.3fs, add_next_score %.4fs (%.0fx)'
+          % (len(small), legacyTime, newTime, legacyTime / newTime))
+
+    # Legacy cost grows with plays^2, so extrapolate it rather than run it on the large frame
+    large = benchmark_frame(copies=16 * 5)
+    start = time.perf_counter()
+    add_next_score(large)
+    newTime = time.perf_counter() - start
+    print('%d plays: legacy loop ~%.0fs (extrapolated), add_next_score %.4fs'
+          % (len(large), legacyTime * (len(large) / len(small)) ** 2, newTime))
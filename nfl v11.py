@@ -1,84 +1,39 @@
-# Import nflgame, pandas, numpy and matplotlib
-import nflgame
+# Import pandas, numpy, matplotlib, the player stat sources (nflscrapR play by play csv files or the cached nflgame
+# fetch layer), the player stat accumulator, the rolling player metrics and the table export
 import pandas as pd
 import numpy as np
 import matplotlib as plt
-
-# Initiate season and week variables
-week = 1
-season = 2017
-
-# Establish games set (games) set referencing week and season variables
-games = nflgame.games(season, week=week)
-
-# Establish players set (players) referencing games variables and aggregate data by play
-players = nflgame.combine(games, plays=True)
-
-# Initiate dictionary of lists by statistic
-dict = {
-        'playerName': [],
-        'position': [],
-        'team': [],
-        'playerID': [],
-        'rushingAtt': [],
-        'rushingYd': [],
-        'rushingTD': [],
-        'receivingRec': [],
-        'receivingYd': [],
-        'receivingTD': [],
-        'receivingYAC': [],
-        'receivingTar': [],
-        'passingAtt': [],
-        'passingComp': [],
-        'passingYd': [],
-        'passingTD': [],
-        'passingInt': [],
-        'defenseInt': [],
-        'defenseTkl': [],
-        'defenseFFum': [],
-        'defenseSk': [],
-        'season': [],
-        'week': [],
-        'gameID': []
-        }
-
-# While season less than 2017, execute embedded while loop then increase season by 1
-while season <= 2019:
-
-    # While week is less than or equal to week 17, execute embedded for loop then reset week to 1
-    while week <= 17:
-
-        # For each player (p) in players set, extract data from games set and append to dictionary
-        for p in players:
-            dict['playerName'].append(p.name)
-            dict['position'].append(p.guess_position)
-            dict['team'].append(p.team)
-            dict['playerID'].append(p.playerid)
-            dict['rushingAtt'].append(p.rushing_att)
-            dict['rushingYd'].append(p.rushing_yds)
-            dict['rushingTD'].append(p.rushing_tds)
-            dict['receivingRec'].append(p.receiving_rec)
-            dict['receivingYd'].append(p.receiving_yds)
-            dict['receivingTD'].append(p.receiving_tds)
-            dict['receivingYAC'].append(p.receiving_yac_yds)
-            dict['receivingTar'].append(p.receiving_tar)
-            dict['passingAtt'].append(p.passing_att)
-            dict['passingComp'].append(p.passing_cmp)
-            dict['passingYd'].append(p.passing_yds)
-            dict['passingTD'].append(p.passing_tds)
-            dict['passingInt'].append(p.passing_int)
-            dict['defenseInt'].append(p.defense_int)
-            dict['defenseTkl'].append(p.defense_tkl)
-            dict['defenseFFum'].append(p.defense_ffum)
-            dict['defenseSk'].append(p.defense_sk)
-            dict['season'].append(season)
-            dict['week'].append(week)
-            dict['gameID'].append(str(season) + str(week) + str(p.team))
-
-        week += 1
-
-    season += 1
-    week = 1
+from box_scores import boxScoreCols, player_games
+from nflgame_fetch import fetch_weeks
+from pbp_loader import load_pbp
+from play_export import write_table
+from player_metrics import player_metrics
+from stat_accumulator import StatAccumulator
+
+# Initiate seasons and weeks
+seasons = range(2017, 2020)
+weeks = range(1, 18)
+
+# Build player stats by game from the nflscrapR play by play csv file of each season (no network), or set
+# pbpPaths = None to fetch them from nflgame
+pbpPaths = {2019: 'pbp-2019_v2.csv'}
+
+if pbpPaths:
+    playerGames = pd.concat([player_games(load_pbp(path, columns=boxScoreCols)) for path in pbpPaths.values()],
+                            ignore_index=True)
+else:
+    # Fetch player stats aggregated by play for every game of every season and week (8 weeks at a time), reading
+    # weeks already fetched and final from the cache in .pbp_cache/nflgame
+    players = fetch_weeks(seasons, weeks, maxWorkers=8)
+
+    # Accumulate the player games into typed columns, with player names, positions, teams and ids interned to codes
+    stats = StatAccumulator()
+    stats.extend(players)
+
+    # Build gameID from season, week and team
+    playerGames = stats.frame()
+    playerGames['gameID'] = playerGames.season.astype(str) + playerGames.week.astype(str) + \
+        playerGames.team.astype(str)
 
 # Initiate list of columns (names and order) for data frame initiated below
 colNames = [
@@ -114,10 +69,11 @@ colNames = [
             'gameID'
             ]
 
-# Convert dictionary (dict) to data frame (index set to Player_name)
-df = pd.DataFrame(dict, index=dict['playerName'], columns=colNames)
+# Reindex the player games (playerGames) to colNames in a data frame (index set to playerName)
+df = playerGames.set_axis(playerGames.playerName.astype(str).values).reindex(columns=colNames)
 
 # Fill im Tyrunn Walker's position (DT, LAR)
+df['position'] = df['position'].astype(object)
 df.loc['T.Walker', 'position'] = 'DT'
 
 # Convert gameID column to str (to facilitate indexing by game)
@@ -133,10 +89,11 @@ df['passingComp%'] = df['passingComp'] / df['passingAtt']
 df['passingYdAtt'] = df['passingYd'] / df['passingAtt']
 
 # Calculate QB rating by component in new columns ['a', 'b', 'c', 'd'] then drop component columns in final df
-df['a'] = (df['passingComp%'] - 0.3) * 5
-df['b'] = (df['passingYdAtt'] - 3) * 0.25
-df['c'] = (df['passingTD'] / df['passingAtt']) * 20
-df['d'] = 2.375 - ((df['passingInt'] / df['passingAtt']) * 25)
+# Each component is clipped to the official bounds of 0 to 2.375
+df['a'] = ((df['passingComp%'] - 0.3) * 5).clip(0, 2.375)
+df['b'] = ((df['passingYdAtt'] - 3) * 0.25).clip(0, 2.375)
+df['c'] = ((df['passingTD'] / df['passingAtt']) * 20).clip(0, 2.375)
+df['d'] = (2.375 - ((df['passingInt'] / df['passingAtt']) * 25)).clip(0, 2.375)
 df['passingQBR'] = (df['a'] + df['b'] + df['c'] + df['d']) / 6 * 100
 #df = df.drop(['a', 'b', 'c', 'd'], axis=1)
 
@@ -154,13 +111,17 @@ df['teamTotalOpptys'] = g['opptys'].sum()
 # Calculate opportunity share by player by week
 df['opptyShare'] = df['opptys'] / df['teamTotalOpptys']
 
-# Export data frame (df) to csv
-export_csv = df.to_csv('export_dataframe.csv', index=False, header=True)
+# Calculate last 3 games, season to date and exponentially weighted (half life of 2 games) opportunity share, passer
+# rating and the other rate stats by player (columns such as opptyShareLast3, passerRatingSeason and rushingYdAttEwm)
+df = player_metrics(df, windows=[3], halflife=2)
+
+# Export data frame (df) to a compressed Parquet file (play_export.write_csv writes a csv in chunks when needed)
+write_table(df, 'export_dataframe.parquet', index=False)
 
 # Print summary info of data frame (df1)
-print df.head(n=70)    # first 70 rows
-print df.info()
-print df.describe()
+print(df.head(n=70))    # first 70 rows
+print(df.info())
+print(df.describe())
 
 
 # -----------------------------------------------------------------
@@ -0,0 +1,187 @@
+# import concurrent.futures, json, os, shutil, sys, tempfile and time
+import concurrent.futures
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Default cache directory for the player stats of fetched games
+cacheDir = os.path.join('.pbp_cache', 'nflgame')
+
+# Create dictionary that maps the player stat columns of nfl v11.py to nflgame player attributes
+statAttrs = {'playerName': 'name',
+             'position': 'guess_position',
+             'team': 'team',
+             'playerID': 'playerid',
+             'rushingAtt': 'rushing_att',
+             'rushingYd': 'rushing_yds',
+             'rushingTD': 'rushing_tds',
+             'receivingRec': 'receiving_rec',
+             'receivingYd': 'receiving_yds',
+             'receivingTD': 'receiving_tds',
+             'receivingYAC': 'receiving_yac_yds',
+             'receivingTar': 'receiving_tar',
+             'passingAtt': 'passing_att',
+             'passingComp': 'passing_cmp',
+             'passingYd': 'passing_yds',
+             'passingTD': 'passing_tds',
+             'passingInt': 'passing_int',
+             'defenseInt': 'defense_int',
+             'defenseTkl': 'defense_tkl',
+             'defenseFFum': 'defense_ffum',
+             'defenseSk': 'defense_sk'}
+
+
+# Data source backed by the nflgame package (imported on first use, so the cache and fixtures work without it)
+class NflgameSource:
+
+    def __init__(self):
+        import nflgame
+        self.nflgame = nflgame
+
+    # Return {game key: {'final': whether the game is over, 'players': [player stat dictionaries]}} for one week,
+    # aggregating each game's stats by play as nfl v11.py does
+    def fetch_week(self, season, week):
+        games = self.nflgame.games(season, week=week) or []
+        return {g.eid: {'final': bool(g.game_over()),
+                        'players': [{col: getattr(p, attr) for col, attr in statAttrs.items()}
+                                    for p in self.nflgame.combine([g], plays=True)]}
+                for g in games}
+
+
+# Stand-in for NflgameSource that serves weeks from json files (<directory>/<season>/<week>.json, each holding what
+# fetch_week returns), with an optional delay per week to stand in for network latency
+class FixtureSource:
+
+    def __init__(self, directory, delay=0):
+        self.directory = directory
+        self.delay = delay
+        self.calls = []
+
+    def fetch_week(self, season, week):
+        self.calls.append((season, week))
+        time.sleep(self.delay)
+        path = os.path.join(self.directory, str(season), '%d.json' % week)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+
+# Write weeks ({(season, week): what fetch_week returns}) as a FixtureSource directory
+def write_fixture(directory, weeks):
+    for (season, week), games in weeks.items():
+        os.makedirs(os.path.join(directory, str(season)), exist_ok=True)
+        with open(os.path.join(directory, str(season), '%d.json' % week), 'w') as f:
+            json.dump(games, f)
+
+
+# Write obj as json to path through a temporary file, so a crash never leaves a partial file
+def _write_json(path, obj):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(obj, f)
+    os.replace(path + '.tmp', path)
+
+
+# Return the cached games of a week ({game key: [player stat dictionaries]}) if the whole week was cached with every
+# game final, else None
+def read_week(directory, season, week):
+    weekDir = os.path.join(directory, str(season), str(week))
+    marker = os.path.join(weekDir, '_complete.json')
+    if not os.path.exists(marker):
+        return None
+    with open(marker) as f:
+        gameKeys = json.load(f)
+    games = {}
+    for key in gameKeys:
+        with open(os.path.join(weekDir, '%s.json' % key)) as f:
+            games[key] = json.load(f)
+    return games
+
+
+# Cache the games of a week by season / week / game, marking the week complete when every game is final
+def write_week(directory, season, week, games):
+    weekDir = os.path.join(directory, str(season), str(week))
+    os.makedirs(weekDir, exist_ok=True)
+    for key, game in games.items():
+        _write_json(os.path.join(weekDir, '%s.json' % key), game['players'])
+    if games and all(game['final'] for game in games.values()):
+        _write_json(os.path.join(weekDir, '_complete.json'), sorted(games))
+
+
+# Fetch the player stats of every game of every season and week in seasons x weeks from source (NflgameSource by
+# default), maxWorkers weeks at a time in a thread pool
+# Weeks already cached complete in directory are read from disk and never fetched again; weeks with games still in
+# progress (or not played yet) are fetched every time
+# Returns a list of player stat dictionaries (statAttrs columns plus season, week and gameKey) in season, week and
+# game order
+def fetch_weeks(seasons, weeks=range(1, 18), source=None, directory=cacheDir, maxWorkers=8):
+    keys = [(season, week) for season in seasons for week in weeks]
+    cached = {key: read_week(directory, *key) for key in keys}
+    missing = [key for key in keys if cached[key] is None]
+    if missing:
+        source = source or NflgameSource()
+
+        def fetch(key):
+            games = source.fetch_week(*key)
+            write_week(directory, key[0], key[1], games)
+            return {gameKey: game['players'] for gameKey, game in games.items()}
+
+        with concurrent.futures.ThreadPoolExecutor(maxWorkers) as pool:
+            cached.update(zip(missing, pool.map(fetch, missing)))
+
+    return [dict(player, season=season, week=week, gameKey=gameKey)
+            for season, week in keys
+            for gameKey, players in sorted(cached[(season, week)].items())
+            for player in players]
+
+
+# Build a fixture of per game rushing, passing and receiving stats from the bundled csv (the week 2 game left in
+# progress) and fetch it serially and concurrently with simulated latency, then again from the cache
+# Usage: python nflgame_fetch.py [seconds of latency per week]
+if __name__ == '__main__':
+    import pandas as pd
+
+    from pbp_loader import load_pbp, to_pipeline_frames
+
+    delay = float(sys.argv[1]) if len(sys.argv) > 1 else 0.2
+    pbp = load_pbp('pbp-2019_v2.csv')
+    week = to_pipeline_frames(pbp)[1].week.reindex(pbp.game_id).values
+    stats = [pbp.groupby(['game_id', 'rusher_player_name'], observed=True)
+             .agg(rushingAtt=('rush_attempt', 'sum'), rushingYd=('yards_gained', 'sum')),
+             pbp.groupby(['game_id', 'passer_player_name'], observed=True)
+             .agg(passingAtt=('pass_attempt', 'sum'), passingComp=('complete_pass', 'sum'),
+                  passingYd=('yards_gained', 'sum')),
+             pbp.groupby(['game_id', 'receiver_player_name'], observed=True)
+             .agg(receivingTar=('pass_attempt', 'sum'), receivingRec=('complete_pass', 'sum'),
+                  receivingYd=('yards_gained', 'sum'))]
+    for s in stats:
+        s.index.names = ['gameID', 'playerName']
+    stats = pd.concat(stats, axis=1).fillna(0).reset_index()
+    weeks = {}
+    for gameID, players in stats.groupby('gameID'):
+        gameWeek = int(week[pbp.game_id.values == gameID][0])
+        records = [{col: row.get(col, 0) for col in statAttrs}
+                   for row in players.drop(columns='gameID').astype({c: int for c in players.columns[2:]})
+                   .to_dict('records')]
+        weeks.setdefault((2019, gameWeek), {})[str(gameID)] = {'final': gameWeek == 1, 'players': records}
+
+    tmp = tempfile.mkdtemp()
+    try:
+        write_fixture(os.path.join(tmp, 'fixture'), weeks)
+        times = {}
+        for maxWorkers in [1, 8]:
+            source = FixtureSource(os.path.join(tmp, 'fixture'), delay)
+            start = time.perf_counter()
+            records = fetch_weeks([2019], range(1, 18), source, os.path.join(tmp, 'cache%d' % maxWorkers), maxWorkers)
+            times[maxWorkers] = time.perf_counter() - start
+        source = FixtureSource(os.path.join(tmp, 'fixture'), delay)
+        again = fetch_weeks([2019], range(1, 18), source, os.path.join(tmp, 'cache8'))
+        assert again == records
+        assert (2019, 1) not in source.calls
+        print('%d player games over 17 weeks: serial %.2fs, 8 threads %.2fs; refetch read week 1 from the cache and '
+              'fetched %d weeks' % (len(records), times[1], times[8], len(source.calls)))
+    finally:
+        shutil.rmtree(tmp)
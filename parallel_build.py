@@ -0,0 +1,82 @@
+# import concurrent.futures, os, sys, time, numpy and pandas
+import concurrent.futures
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from all_plays import build_all_plays, read_source, sort_all_plays
+
+
+# Read one source (an nflscrapR csv path, or a (play by play csv, schedule csv) pair) and build its allPlays
+def _build_source(source):
+    pbpPath, schedPath = source if isinstance(source, tuple) else (source, None)
+    return build_all_plays(*read_source(pbpPath, schedPath))
+
+
+# Build allPlays for one group of games
+def _build_games(args):
+    pbp, sched = args
+    return build_all_plays(pbp, sched)
+
+
+# Split pbp into about n groups of whole games (contiguous in gameID order)
+def split_games(pbp, sched, n):
+    games = np.sort(pbp.gameID.unique())
+    firstGames = [g[0] for g in np.array_split(games, min(n, len(games)))]
+    playChunk = np.searchsorted(firstGames, pbp.gameID.values, side='right')
+    schedChunk = np.searchsorted(firstGames, sched.index.values, side='right')
+    return [(plays, sched[schedChunk == k]) for k, plays in pbp.groupby(playChunk, sort=True)]
+
+
+# Build allPlays from pbp and sched in a process pool, splitting the games into processes * chunksPerProcess chunks
+# Games never share state (cumulative scores and next score restart every game), so the chunk results are simply
+# concatenated and sorted in the order build_all_plays uses
+def build_games(pbp, sched, processes=None, chunksPerProcess=4):
+    processes = processes or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        frames = list(pool.map(_build_games, split_games(pbp, sched, processes * chunksPerProcess)))
+    return sort_all_plays(pd.concat(frames))
+
+
+# Build one allPlays from several seasons of play by play data in a process pool
+# sources: list of nflscrapR csv paths or (play by play csv, schedule csv) pairs
+# by='season' reads and builds each source in its own process; by='game' reads the sources here and splits their
+# games across the pool with build_games, which balances uneven or few seasons
+def build_seasons(sources, processes=None, by='season', chunksPerProcess=4):
+    if by == 'game':
+        frames = [read_source(*(s if isinstance(s, tuple) else (s, None))) for s in sources]
+        return build_games(pd.concat([f[0] for f in frames]), pd.concat([f[1] for f in frames]), processes,
+                           chunksPerProcess)
+    if by != 'season':
+        raise ValueError("by must be 'season' or 'game', not %r" % by)
+    with concurrent.futures.ProcessPoolExecutor(processes or os.cpu_count()) as pool:
+        frames = list(pool.map(_build_source, sources))
+    return sort_all_plays(pd.concat(frames))
+
+
+# Time a serial build against build_games with 1, 2, 4 ... processes on the bundled csv replicated
+# `copies` times under new gameIDs
+# Usage: python parallel_build.py [copies]
+if __name__ == '__main__':
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    pbp, sched = read_source('pbp-2019_v2.csv')
+    pbp = pd.concat([pbp.assign(gameID=pbp.gameID + c * 10 ** 10).set_axis(pbp.index + c * 10 ** 14)
+                     for c in range(copies)])
+    sched = pd.concat([sched.set_axis(sched.index + c * 10 ** 10) for c in range(copies)])
+
+    start = time.perf_counter()
+    serial = build_all_plays(pbp, sched)
+    serialTime = time.perf_counter() - start
+    print('%d plays: serial %.2fs' % (len(serial), serialTime))
+
+    processes = 1
+    while processes <= os.cpu_count():
+        start = time.perf_counter()
+        parallel = build_games(pbp, sched, processes)
+        parallelTime = time.perf_counter() - start
+        pd.testing.assert_frame_equal(parallel, serial)
+        print('%d processes: %.2fs (%.1fx)' % (processes, parallelTime, serialTime / parallelTime))
+        processes *= 2
@@ -0,0 +1,117 @@
+# import hashlib, inspect, os, shutil, sys, time and pandas
+import hashlib
+import inspect
+import os
+import shutil
+import sys
+import time
+
+import pandas as pd
+
+import all_plays
+import description_parser
+import encoding
+import game_clock
+import game_store
+import next_score
+import pbp_loader
+from stage_profiler import unprofiled
+
+# Modules whose source defines allPlays; any change to them changes the cache key
+derivationModules = [all_plays, description_parser, encoding, game_clock, game_store, next_score, pbp_loader]
+
+# Default cache directory and the columns allPlays is partitioned by
+cacheDir = '.pbp_cache'
+partitionCols = ['seasonYear', 'week']
+
+
+# Hash the source csv file(s) and the derivation code into a cache key
+# modules: further modules whose source goes into the key, for caches of values derived from allPlays
+def cache_key(pbpPath, schedPath=None, modules=()):
+    h = hashlib.sha256()
+    for path in [pbpPath, schedPath]:
+        if path is None:
+            continue
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    for module in derivationModules + list(modules):
+        h.update(inspect.getsource(module).encode())
+    h.update(pd.__version__.encode())
+    return h.hexdigest()[:16]
+
+
+# Write allPlays as Parquet partitioned by seasonYear and week into path
+def write_all_plays(allPlays, path):
+    tmpPath = path + '.tmp'
+    shutil.rmtree(tmpPath, ignore_errors=True)
+    write_partitions(allPlays, tmpPath, range(len(allPlays)))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmpPath, path)
+
+
+# Write (or rewrite) only the seasonYear / week partitions that plays falls in under path
+# Row order is kept in an extra column (rowOrder, each row's position in the full allPlays) because partitioned reads
+# come back grouped by partition, and column order in _columns.txt because partition columns come back last
+def write_partitions(plays, path, rowOrder):
+    for season, week in plays[partitionCols].drop_duplicates().itertuples(index=False):
+        shutil.rmtree(os.path.join(path, 'seasonYear=%d' % season, 'week=%d' % week), ignore_errors=True)
+    plays.assign(rowOrder=rowOrder).to_parquet(path, partition_cols=partitionCols)
+    with open(os.path.join(path, '_columns.txt'), 'w') as f:
+        f.write('\n'.join(plays.columns))
+
+
+# Memory-map allPlays back from a partitioned Parquet directory in its original row and column order
+def read_all_plays(path, columns=None):
+    allPlays = pd.read_parquet(path, columns=columns, memory_map=True)
+    if 'rowOrder' in allPlays:
+        allPlays = allPlays.sort_values('rowOrder').drop('rowOrder', axis=1)
+
+    # Partition columns come back as categoricals at the end of the frame
+    for c in partitionCols:
+        if c in allPlays:
+            allPlays[c] = allPlays[c].astype('int64')
+    with open(os.path.join(path, '_columns.txt')) as f:
+        order = f.read().split('\n')
+    return allPlays[[c for c in order if c in allPlays]]
+
+
+# Return the enriched allPlays for the source csv file(s), building and caching it on the first run only
+# The cache is keyed by the content of the source csv file(s) and the derivation code, so editing either rebuilds it;
+# stale entries for the same source are removed when a new one is written. The shared encoding registry is merged
+# from and saved to encodings.npz in directory, so the codes in a cached allPlays stay valid in later runs
+# profiler: optional stage_profiler.StageProfiler the read, build and write stages are run under
+def load_all_plays(pbpPath, schedPath=None, directory=cacheDir, rebuild=False, profiler=None):
+    stage = profiler.run if profiler is not None else unprofiled
+    key = cache_key(pbpPath, schedPath)
+    name = os.path.splitext(os.path.basename(pbpPath))[0].replace(' ', '_')
+    path = os.path.join(directory, '%s-%s' % (name, key))
+    registryPath = os.path.join(directory, 'encodings.npz')
+    encoding.load_registry(registryPath)
+    if os.path.isdir(path) and not rebuild:
+        return stage('read cache', read_all_plays, path)
+
+    pbp, sched = stage('read source', all_plays.read_source, pbpPath, schedPath, profiler)
+    allPlays = stage('build', all_plays.build_all_plays, pbp, sched, profiler)
+
+    # Remove stale caches of the same source and write the new one
+    os.makedirs(directory, exist_ok=True)
+    for entry in os.listdir(directory):
+        if entry.rsplit('-', 1)[0] == name and entry != os.path.basename(path):
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    stage('write cache', write_all_plays, allPlays, path)
+    encoding.registry.save(registryPath)
+    return stage('read cache', read_all_plays, path)
+
+
+# Time a cold build against a warm cache read
+# Usage: python pbp_cache.py [path to nflscrapR pbp csv]
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'pbp-2019_v2.csv'
+    start = time.perf_counter()
+    cold = load_all_plays(path, rebuild=True)
+    coldTime = time.perf_counter() - start
+    start = time.perf_counter()
+    warm = load_all_plays(path)
+    warmTime = time.perf_counter() - start
+    print('%d plays: build + write %.3fs, cached read %.3fs' % (len(warm), coldTime, warmTime))
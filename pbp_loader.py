@@ -0,0 +1,352 @@
+# import pandas, numpy, pyarrow, multiprocessing, resource, sys and time
+import multiprocessing
+import resource
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+from game_clock import parse_clock
+
+# Team columns of the nflscrapR play by play csv (categorical)
+teamCols = ['home_team', 'away_team', 'posteam', 'defteam', 'side_of_field', 'timeout_team', 'td_team',
+            'forced_fumble_player_1_team', 'forced_fumble_player_2_team', 'solo_tackle_1_team', 'solo_tackle_2_team',
+            'assist_tackle_1_team', 'assist_tackle_2_team', 'assist_tackle_3_team', 'assist_tackle_4_team',
+            'fumbled_1_team', 'fumbled_2_team', 'fumble_recovery_1_team', 'fumble_recovery_2_team', 'return_team',
+            'penalty_team']
+
+# Player id / name roles of the nflscrapR play by play csv (each role has a _player_id and _player_name column)
+playerRoles = ['passer', 'receiver', 'rusher', 'lateral_receiver', 'lateral_rusher', 'lateral_sack', 'interception',
+               'lateral_interception', 'punt_returner', 'lateral_punt_returner', 'kickoff_returner',
+               'lateral_kickoff_returner', 'punter', 'kicker', 'own_kickoff_recovery', 'blocked',
+               'tackle_for_loss_1', 'tackle_for_loss_2', 'qb_hit_1', 'qb_hit_2', 'forced_fumble_player_1',
+               'forced_fumble_player_2', 'solo_tackle_1', 'solo_tackle_2', 'assist_tackle_1', 'assist_tackle_2',
+               'assist_tackle_3', 'assist_tackle_4', 'pass_defense_1', 'pass_defense_2', 'fumbled_1', 'fumbled_2',
+               'fumble_recovery_1', 'fumble_recovery_2', 'penalty']
+playerCols = [r + s for r in playerRoles for s in ['_player_id', '_player_name']]
+
+# Other low cardinality text columns (categorical)
+categoryCols = ['posteam_type', 'game_date', 'game_half', 'play_type', 'pass_length', 'pass_location', 'run_location',
+                'run_gap', 'field_goal_result', 'extra_point_result', 'two_point_conv_result',
+                'replay_or_challenge_result', 'penalty_type']
+
+# Free text columns
+stringCols = ['time', 'yrdln', 'desc']
+
+# Binary flag columns (0/1 or NA)
+flagCols = ['quarter_end', 'sp', 'goal_to_go', 'shotgun', 'no_huddle', 'qb_dropback', 'qb_kneel', 'qb_spike',
+            'qb_scramble', 'timeout', 'punt_blocked', 'first_down_rush', 'first_down_pass', 'first_down_penalty',
+            'third_down_converted', 'third_down_failed', 'fourth_down_converted', 'fourth_down_failed',
+            'incomplete_pass', 'touchback', 'interception', 'punt_inside_twenty', 'punt_in_endzone',
+            'punt_out_of_bounds', 'punt_downed', 'punt_fair_catch', 'kickoff_inside_twenty', 'kickoff_in_endzone',
+            'kickoff_out_of_bounds', 'kickoff_downed', 'kickoff_fair_catch', 'fumble_forced', 'fumble_not_forced',
+            'fumble_out_of_bounds', 'solo_tackle', 'safety', 'penalty', 'tackled_for_loss', 'fumble_lost',
+            'own_kickoff_recovery', 'own_kickoff_recovery_td', 'qb_hit', 'rush_attempt', 'pass_attempt', 'sack',
+            'touchdown', 'pass_touchdown', 'rush_touchdown', 'return_touchdown', 'extra_point_attempt',
+            'two_point_attempt', 'field_goal_attempt', 'kickoff_attempt', 'punt_attempt', 'fumble', 'complete_pass',
+            'assist_tackle', 'lateral_reception', 'lateral_rush', 'lateral_return', 'lateral_recovery',
+            'replay_or_challenge', 'defensive_two_point_attempt', 'defensive_two_point_conv',
+            'defensive_extra_point_attempt', 'defensive_extra_point_conv']
+
+# Small integer columns: downs, quarters, timeouts, drives, yard lines and distances fit in int8
+int8Cols = ['qtr', 'down', 'drive', 'yardline_100', 'ydstogo', 'home_timeouts_remaining', 'away_timeouts_remaining',
+            'posteam_timeouts_remaining', 'defteam_timeouts_remaining']
+
+# Wider integer columns: yards, clock seconds and scores
+int16Cols = ['play_id', 'quarter_seconds_remaining', 'half_seconds_remaining', 'game_seconds_remaining', 'ydsnet',
+             'yards_gained', 'air_yards', 'yards_after_catch', 'kick_distance', 'total_home_score',
+             'total_away_score', 'posteam_score', 'defteam_score', 'score_differential', 'posteam_score_post',
+             'defteam_score_post', 'score_differential_post', 'fumble_recovery_1_yards', 'fumble_recovery_2_yards',
+             'return_yards', 'penalty_yards']
+
+# Probability, EP and WP columns (float32)
+float32Cols = ['no_score_prob', 'opp_fg_prob', 'opp_safety_prob', 'opp_td_prob', 'fg_prob', 'safety_prob', 'td_prob',
+               'extra_point_prob', 'two_point_conversion_prob', 'ep', 'epa', 'total_home_epa', 'total_away_epa',
+               'total_home_rush_epa', 'total_away_rush_epa', 'total_home_pass_epa', 'total_away_pass_epa', 'air_epa',
+               'yac_epa', 'comp_air_epa', 'comp_yac_epa', 'total_home_comp_air_epa', 'total_away_comp_air_epa',
+               'total_home_comp_yac_epa', 'total_away_comp_yac_epa', 'total_home_raw_air_epa',
+               'total_away_raw_air_epa', 'total_home_raw_yac_epa', 'total_away_raw_yac_epa', 'wp', 'def_wp',
+               'home_wp', 'away_wp', 'wpa', 'home_wp_post', 'away_wp_post', 'total_home_rush_wpa',
+               'total_away_rush_wpa', 'total_home_pass_wpa', 'total_away_pass_wpa', 'air_wpa', 'yac_wpa',
+               'comp_air_wpa', 'comp_yac_wpa', 'total_home_comp_air_wpa', 'total_away_comp_air_wpa',
+               'total_home_comp_yac_wpa', 'total_away_comp_yac_wpa', 'total_home_raw_air_wpa',
+               'total_away_raw_air_wpa', 'total_home_raw_yac_wpa', 'total_away_raw_yac_wpa']
+
+# Create dictionary mapping every nflscrapR column to its dtype (nullable Int8 / Int16 since most columns carry NA)
+pbpSchema = {'game_id': 'int64'}
+pbpSchema.update({c: 'category' for c in teamCols + playerCols + categoryCols})
+pbpSchema.update({c: 'str' for c in stringCols})
+pbpSchema.update({c: 'Int8' for c in flagCols + int8Cols})
+pbpSchema.update({c: 'Int16' for c in int16Cols})
+pbpSchema.update({c: 'float32' for c in float32Cols})
+
+
+# Arrow type that each pbpSchema dtype is parsed into, and the pandas dtypes of the nullable integer types
+arrowTypes = {'int64': pa.int64(), 'category': pa.dictionary(pa.int32(), pa.string()), 'str': pa.string(),
+              'Int8': pa.int8(), 'Int16': pa.int16(), 'float32': pa.float32()}
+arrowNullable = {pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype()}
+
+
+# Read the nflscrapR play by play csv into a typed data frame (pbp)
+# The csv is parsed by Arrow's multithreaded reader straight into the schema types (dictionary encoded text for the
+# categoricals, int8 / int16 for the nullable integers), so no column is parsed wide and narrowed afterwards
+# columns: optional list of columns to materialize (all 256 schema columns by default); columns missing from the
+# schema are parsed with Arrow's type inference
+# chunksize (or any other pd.read_csv keyword): read with pd.read_csv instead; with chunksize, return an iterator of
+# typed data frames of up to chunksize rows
+def load_pbp(path='pbp-2019_v2.csv', columns=None, **kwargs):
+    if columns is None:
+        columns = list(pbpSchema)
+    dtypes = {c: pbpSchema[c] for c in columns if c in pbpSchema}
+    if kwargs:
+        return _read_csv(path, columns, dtypes, **kwargs)
+
+    options = pacsv.ConvertOptions(include_columns=columns, column_types={c: arrowTypes[t] for c, t in dtypes.items()},
+                                   null_values=['', 'NA'], strings_can_be_null=True)
+    # Free each Arrow column as soon as it is converted
+    table = pacsv.read_csv(path, convert_options=options)
+    pbp = table.to_pandas(types_mapper=arrowNullable.get, split_blocks=True, self_destruct=True)
+    del table
+
+    # Sort the categories, as pd.read_csv gives them (Arrow keeps them in order of appearance), by remapping the codes
+    sortedCols = {}
+    for c, t in dtypes.items():
+        if t != 'category':
+            continue
+        values = pbp[c].array
+        order = np.argsort(values.categories.to_numpy(), kind='stable')
+        if (order[1:] > order[:-1]).all():
+            continue
+        rank = np.full(len(order) + 1, -1, dtype=np.int32)
+        rank[order] = np.arange(len(order))
+        dtype = pd.CategoricalDtype(values.categories[order])
+        sortedCols[c] = pd.Categorical.from_codes(rank[values.codes], dtype=dtype, validate=False)
+    return pbp.assign(**sortedCols)[columns]
+
+
+# Read the csv with pd.read_csv into dtypes (see load_pbp)
+def _read_csv(path, columns, dtypes, **kwargs):
+
+    # Parse nullable integer columns as float32 and cast afterwards (the C parser is much slower on Int8 / Int16)
+    intDtypes = {c: t for c, t in dtypes.items() if t in ('Int8', 'Int16')}
+    parseDtypes = dict(dtypes, **{c: 'float32' for c in intDtypes})
+
+    # Parse in one block so all-NA chunks cannot give a categorical column mismatched category dtypes
+    kwargs.setdefault('low_memory', False)
+    pbp = pd.read_csv(path, usecols=columns, dtype=parseDtypes, encoding='utf-8-sig', **kwargs)
+    if kwargs.get('chunksize'):
+        return (chunk.astype(intDtypes)[columns] for chunk in pbp)
+    return pbp.astype(intDtypes)[columns]
+
+
+# Create dictionary that maps nflscrapR play_type to the playType labels used by test 8.py
+playTypeMap = {'run': 'RUSH', 'pass': 'PASS', 'kickoff': 'KICK OFF', 'punt': 'PUNT', 'field_goal': 'FIELD GOAL',
+               'extra_point': 'EXTRA POINT', 'qb_kneel': 'QB KNEEL', 'qb_spike': 'SPIKE', 'no_play': 'NO PLAY'}
+
+
+# Return the week of each game from its date (gameDay, indexed by gameID), counting Tuesday to Monday weeks from the
+# season opener
+# seasonOpeners: optional dictionary of season -> opening game date, updated in place, for weeks of a season that
+# arrives in several pieces
+def game_weeks(gameDay, seasonOpeners=None):
+    gameID = gameDay.index.values
+    season = pd.Series(gameID // 1000000 - ((gameID // 10000) % 100 < 3), index=gameDay.index)
+    opener = gameDay.groupby(season).transform('min')
+    if seasonOpeners is not None:
+        for s, day in gameDay.groupby(season).min().items():
+            seasonOpeners[s] = min(day, seasonOpeners.get(s, day))
+        opener = season.map(seasonOpeners)
+    return ((gameDay - opener).dt.days + (opener.dt.dayofweek - 1) % 7) // 7 + 1
+
+
+# nflscrapR columns read by to_pipeline_frames
+pipelineCols = ['game_id', 'play_id', 'game_date', 'home_team', 'away_team', 'posteam', 'defteam', 'qtr',
+                'quarter_seconds_remaining', 'down', 'ydstogo', 'yardline_100', 'desc', 'play_type', 'yards_gained',
+                'shotgun', 'pass_length', 'pass_location', 'run_location', 'run_gap', 'first_down_rush',
+                'first_down_pass', 'first_down_penalty', 'incomplete_pass', 'interception', 'fumble', 'fumble_lost',
+                'sack', 'rush_attempt', 'pass_attempt', 'two_point_attempt', 'two_point_conv_result', 'penalty',
+                'penalty_team', 'penalty_type', 'penalty_yards', 'replay_or_challenge', 'replay_or_challenge_result',
+                'total_home_score', 'total_away_score', 'rusher_player_name', 'passer_player_name',
+                'receiver_player_name', 'posteam_timeouts_remaining', 'defteam_timeouts_remaining']
+
+
+# Convert a typed nflscrapR pbp frame into the play columns (pbp) and game columns (sched) that test 8.py reads from
+# the play by play and schedule csv files, so the same derivation runs on the bundled csv
+# seasonOpeners: optional dictionary of season -> opening game date, updated in place, for converting a season in
+# several pieces (weeks are counted from the opener)
+def to_pipeline_frames(pbp, seasonOpeners=None):
+    gameID = pbp.game_id.astype('int64')
+    yardLine = 100 - pbp.yardline_100.astype('float64')
+    gameDate = pd.to_datetime(pbp.game_date.astype(str), format='%m/%d/%y')
+
+    # Seconds left in the quarter, parsed from the 'MM:SS' time column when the csv has no quarter_seconds_remaining
+    if 'quarter_seconds_remaining' in pbp:
+        qtrSecRem = pbp.quarter_seconds_remaining
+    else:
+        qtrSecRem = pd.Series(parse_clock(pbp.time.values), index=pbp.index)
+
+    # Season year is the year of the game_id unless the game is played in January or February
+    seasonYear = gameID // 1000000 - ((gameID // 10000) % 100 < 3)
+
+    # Label sacks and two point conversions the way the play by play csv does
+    playType = pbp.play_type.astype(object).map(playTypeMap)
+    playType = playType.mask(pbp.sack.fillna(0) == 1, 'SACK').mask(pbp.two_point_attempt.fillna(0) == 1,
+                                                             'TWO-POINT CONVERSION')
+
+    # Build pbp (indexed by a playID unique across games)
+    plays = pd.DataFrame({'gameID': gameID,
+                          'gameDate': gameDate.dt.strftime('%Y-%m-%d'),
+                          'quarter': pbp.qtr.astype('int64'),
+                          'minute': qtrSecRem // 60,
+                          'second': qtrSecRem % 60,
+                          'offTeam': pbp.posteam.astype(object),
+                          'defTeam': pbp.defteam.astype(object),
+                          'down': pbp.down.fillna(0),
+                          'toGo': pbp.ydstogo,
+                          'yardLine': yardLine,
+                          'seriesFirstDown': (pbp.first_down_rush + pbp.first_down_pass + pbp.first_down_penalty)
+                          .clip(upper=1),
+                          'nextScore': 0,
+                          'description': pbp.desc.str.upper(),
+                          'teamWin': np.nan,
+                          'seasonYear': seasonYear,
+                          'yards': pbp.yards_gained,
+                          'formation': np.where(pbp.shotgun.fillna(0) == 1, 'SHOTGUN', 'UNDER CENTER'),
+                          'playType': playType,
+                          'isRush': pbp.rush_attempt,
+                          'isPass': pbp.pass_attempt,
+                          'isIncomplete': pbp.incomplete_pass,
+                          'passType': (pbp.pass_length.astype(object) + ' ' + pbp.pass_location.astype(object))
+                          .str.upper(),
+                          'isSack': pbp.sack,
+                          'isChallenge': pbp.replay_or_challenge,
+                          'isChallengeReversed': (pbp.replay_or_challenge_result == 'reversed').astype(int),
+                          'challenger': np.nan,
+                          'isMeasurement': 0,
+                          'isInterception': pbp.interception,
+                          'isFumble': pbp.fumble,
+                          'isPenalty': pbp.penalty,
+                          'isTwoPointConversion': pbp.two_point_attempt,
+                          'isTwoPointConversionSuccessful': (pbp.two_point_conv_result == 'success').astype(int),
+                          'rushDirection': (pbp.run_location.astype(object) + ' ' + pbp.run_gap.astype(object))
+                          .str.upper(),
+                          'yardLineFixed': 50 - (yardLine - 50).abs(),
+                          'yardLineDirection': np.where(yardLine > 50, 'OPP', 'OWN'),
+                          'isPenaltyAccepted': pbp.penalty,
+                          'penaltyTeam': pbp.penalty_team.astype(object),
+                          'isNoPlay': (pbp.play_type == 'no_play').astype(int),
+                          'penaltyType': pbp.penalty_type.astype(object).str.upper(),
+                          'penaltyYards': pbp.penalty_yards})
+    # nflscrapR descriptions have no jersey numbers for description_parser to find player names by, so hand over the
+    # names nflscrapR gives (upper case as in the descriptions) for rushes and passes
+    plays['rushingPlayerName'] = pbp.rusher_player_name.astype(object).str.upper().where(playType == 'RUSH')
+    plays['passingPlayerName'] = pbp.passer_player_name.astype(object).str.upper().where(playType == 'PASS')
+    plays['targetPlayerName'] = pbp.receiver_player_name.astype(object).str.upper().where(playType == 'PASS')
+    plays['offTimeoutsRem'] = pbp.posteam_timeouts_remaining.astype('float64')
+    plays['defTimeoutsRem'] = pbp.defteam_timeouts_remaining.astype('float64')
+
+    # Hand over nflscrapR's running scores, which credit defensive scores and safeties to the right team and leave out
+    # touchdowns nullified by penalties
+    plays['homeScoreCum'] = pbp.total_home_score.astype('float64')
+    plays['awayScoreCum'] = pbp.total_away_score.astype('float64')
+    plays.index = pd.Index(gameID * 10000 + pbp.play_id.astype('int64'), name='playID')
+    plays = plays.fillna({c: 0 for c in ['isRush', 'isPass', 'isIncomplete', 'isSack', 'isChallenge',
+                                         'isInterception', 'isFumble', 'isPenalty', 'isTwoPointConversion',
+                                         'isPenaltyAccepted']})
+
+    # Hand back plain numpy dtypes (int64, or float64 where NA remains) as pd.read_csv would infer them
+    nullableCols = [c for c in plays.columns if isinstance(plays[c].dtype, pd.api.extensions.ExtensionDtype)
+                    and plays[c].dtype.kind in 'iu']
+    plays = plays.astype({c: 'float64' if plays[c].hasnans else 'int64' for c in nullableCols})
+
+    # Build sched (indexed by gameID) from the last play of each game
+    sched = _game_frame(pbp, gameID, gameDate, seasonOpeners)
+    return plays, sched
+
+
+# nflscrapR columns read by game_frame
+gameCols = ['game_id', 'game_date', 'home_team', 'away_team', 'posteam', 'play_type', 'yards_gained', 'interception',
+            'fumble_lost', 'total_home_score', 'total_away_score']
+
+
+# Build the game table (sched, indexed by gameID) of a typed nflscrapR pbp frame (columns gameCols at least): week,
+# teams, winner and loser with their points, yards and turnovers, from the last play of each game
+def game_frame(pbp, seasonOpeners=None):
+    return _game_frame(pbp, pbp.game_id.astype('int64'), pd.to_datetime(pbp.game_date.astype(str), format='%m/%d/%y'),
+                       seasonOpeners)
+
+
+# Build the game table from pbp with its gameID and parsed gameDate (shared with to_pipeline_frames, which has them)
+def _game_frame(pbp, gameID, gameDate, seasonOpeners):
+    games = pbp.assign(gameDate=gameDate).groupby(gameID, sort=True)
+    last = games.last()
+    homePts = last.total_home_score.astype('int64')
+    awayPts = last.total_away_score.astype('int64')
+    homeWin = homePts >= awayPts
+
+    gameDay = games.gameDate.min()
+    week = game_weeks(gameDay, seasonOpeners)
+
+    # Total yards and turnovers by offensive team by game
+    offense = pbp.assign(gameID=gameID, isTurnover=pbp.interception + pbp.fumble_lost)
+    offense = offense[offense.play_type.isin(['run', 'pass'])]
+    teamYds = offense.groupby(['gameID', 'posteam'], observed=True).yards_gained.sum()
+    teamTurnovers = offense.groupby(['gameID', 'posteam'], observed=True).isTurnover.sum()
+    winner = np.where(homeWin, last.home_team.astype(object), last.away_team.astype(object))
+    loser = np.where(homeWin, last.away_team.astype(object), last.home_team.astype(object))
+    winnerKey = pd.MultiIndex.from_arrays([last.index, winner])
+    loserKey = pd.MultiIndex.from_arrays([last.index, loser])
+    sched = pd.DataFrame({'week': week,
+                          'Date': gameDay.dt.strftime('%Y-%m-%d'),
+                          'time': np.nan,
+                          'awayTeam': last.away_team.astype(object),
+                          'homeTeam': last.home_team.astype(object),
+                          'winner': winner,
+                          'loser': loser,
+                          'isTie': (homePts == awayPts).astype(int),
+                          'ptsWinner': np.maximum(homePts, awayPts),
+                          'ptsLoser': np.minimum(homePts, awayPts),
+                          'ydWinner': teamYds.reindex(winnerKey).values,
+                          'turnoversWinner': teamTurnovers.reindex(winnerKey).values,
+                          'ydLoser': teamYds.reindex(loserKey).values,
+                          'turnoversLoser': teamTurnovers.reindex(loserKey).values})
+    sched.index.name = 'gameID'
+
+    return sched
+
+
+# Parse the csv in the current process and report (parse seconds, peak RSS in MB, frame MB)
+def _measure(path, typed, columns):
+    start = time.perf_counter()
+    if typed:
+        pbp = load_pbp(path, columns=columns)
+    else:
+        pbp = pd.read_csv(path, usecols=columns, low_memory=False)
+    parseTime = time.perf_counter() - start
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return parseTime, peakRss, pbp.memory_usage(deep=True).sum() / 2 ** 20
+
+
+# Compare plain pd.read_csv against load_pbp, each in a fresh process so peak RSS is not shared
+# Usage: python pbp_loader.py [path to pbp csv]
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'pbp-2019_v2.csv'
+    ctx = multiprocessing.get_context('spawn')
+    projection = ['game_id', 'qtr', 'down', 'ydstogo', 'yardline_100', 'posteam', 'defteam', 'play_type', 'ep', 'wp']
+    for label, typed, columns in [('pd.read_csv', False, None),
+                                  ('load_pbp', True, None),
+                                  ('pd.read_csv (10 cols)', False, projection),
+                                  ('load_pbp (10 cols)', True, projection)]:
+        with ctx.Pool(1) as pool:
+            parseTime, peakRss, frameMb = pool.apply(_measure, (path, typed, columns))
+        print('%-22s parse %.3fs  peak RSS %.1f MB  frame %.2f MB' % (label, parseTime, peakRss, frameMb))
+
+    # The Arrow reader gives the same typed frame as pd.read_csv with the schema dtypes
+    for columns in [None, projection]:
+        columns = columns or list(pbpSchema)
+        dtypes = {c: pbpSchema[c] for c in columns}
+        pd.testing.assert_frame_equal(load_pbp(path, columns=columns), _read_csv(path, columns, dtypes))
+    print('Arrow and pd.read_csv typed frames match')
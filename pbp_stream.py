@@ -0,0 +1,84 @@
+# import os, sys, time and pandas
+import os
+import sys
+import time
+
+import pandas as pd
+
+from all_plays import build_all_plays
+from pbp_loader import load_pbp, pipelineCols, to_pipeline_frames
+
+
+# Read the pipelineCols of an nflscrapR csv in chunks of about chunksize rows and yield typed frames holding only
+# complete games
+# The last game of every chunk is held back and prepended to the next chunk, so a game is never split; games must be
+# contiguous in the file (as nflscrapR writes them)
+def iter_games(pbpPath, chunksize=20000):
+    carry = None
+    for chunk in load_pbp(pbpPath, columns=pipelineCols, chunksize=chunksize):
+        if carry is not None and len(carry):
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        isLastGame = (chunk.game_id == chunk.game_id.iloc[-1]).values
+        carry = chunk[isLastGame]
+        if not isLastGame.all():
+            yield chunk[~isLastGame]
+    if carry is not None and len(carry):
+        yield carry
+
+
+# Append allPlays to a csv file, writing the header only when the file is new
+def csv_sink(path):
+    def write(allPlays):
+        allPlays.to_csv(path, mode='a', header=not os.path.exists(path), index_label='playID')
+    return write
+
+
+# Run the flag derivation, score accumulation and next score stages over an nflscrapR csv that may not fit in memory
+# Each batch of complete games is built with build_all_plays and handed to sink (a callable, or a csv path appended
+# to); memory is bounded by one chunk plus the largest game instead of by the file size
+# Batches are written in file order, and each batch is sorted as build_all_plays sorts it
+# Returns the number of plays and games written
+def stream_all_plays(pbpPath, sink, chunksize=20000):
+    if isinstance(sink, str):
+        if os.path.exists(sink):
+            os.remove(sink)
+        sink = csv_sink(sink)
+
+    seasonOpeners = {}
+    seenGames = set()
+    plays = 0
+    for games in iter_games(pbpPath, chunksize):
+        gameIDs = set(games.game_id.unique().tolist())
+        if gameIDs & seenGames:
+            raise ValueError('games %s are not contiguous in %s' % (sorted(gameIDs & seenGames), pbpPath))
+        seenGames |= gameIDs
+
+        pbp, sched = to_pipeline_frames(games, seasonOpeners)
+        allPlays = build_all_plays(pbp, sched)
+        sink(allPlays)
+        plays += len(allPlays)
+    return plays, len(seenGames)
+
+
+# Check a streamed build (small chunks) against a full build of the bundled csv and time it
+# Usage: python pbp_stream.py [path to nflscrapR pbp csv] [chunksize]
+if __name__ == '__main__':
+    from all_plays import read_source, sort_all_plays
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'pbp-2019_v2.csv'
+    chunksize = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    frames = []
+    start = time.perf_counter()
+    plays, games = stream_all_plays(path, frames.append, chunksize)
+    streamTime = time.perf_counter() - start
+    start = time.perf_counter()
+    full = build_all_plays(*read_source(path))
+    fullTime = time.perf_counter() - start
+
+    # Batches come out in file order, which is not gameID order, and a batch without any rushes has object (not str)
+    # name columns
+    streamed = sort_all_plays(pd.concat(frames)).astype(full.dtypes.to_dict())
+    pd.testing.assert_frame_equal(streamed, full)
+    print('%d plays in %d games: streamed in %d batches %.2fs (largest batch %d plays), full build %.2fs'
+          % (plays, games, len(frames), streamTime, max(len(f) for f in frames), fullTime))
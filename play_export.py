@@ -0,0 +1,133 @@
+# import concurrent.futures, os, shutil, sys, tempfile, time and pandas
+import concurrent.futures
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from all_plays import ep_play_mask
+
+# Create dictionary of the play sets test 8.py exported as separate csv files, each a filter of allPlays:
+# name -> (columns the filter reads, function returning the mask)
+playViews = {'rushing': (['playType'], lambda plays: plays.playType == 'RUSH'),
+             'passing': (['playType'], lambda plays: plays.playType == 'PASS'),
+             'ep': (['quarter', 'playType', 'isTwoMinWarning', 'absScoreDiff', 'isNoPlay', 'offTeam'], ep_play_mask)}
+
+
+# Return the format of path from its extension ('parquet' or 'feather')
+def _format(path):
+    fmt = os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in ('parquet', 'feather'):
+        raise ValueError('export path must end in .parquet or .feather, not %r' % path)
+    return fmt
+
+
+# Write frame as a compressed columnar file (Parquet or Feather by the extension of path), through a temporary file
+# so readers never see a partial table
+# index: keep the index as a column (Feather has no index, so it comes back as the first column there)
+def write_table(frame, path, index=True, compression='zstd'):
+    tmpPath = path + '.tmp'
+    if _format(path) == 'parquet':
+        frame.to_parquet(tmpPath, index=index, compression=compression)
+    else:
+        (frame.reset_index() if index else frame.reset_index(drop=True)).to_feather(tmpPath, compression=compression)
+    os.replace(tmpPath, path)
+
+
+# Read a table written by write_table (only columns, if given)
+def read_table(path, columns=None):
+    if _format(path) == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_feather(path, columns=columns)
+
+
+# Return view (a key of playViews) of allPlays
+def view(allPlays, name):
+    return allPlays[playViews[name][1](allPlays).values]
+
+
+# Read view (a key of playViews) of a stored allPlays table, with only columns (plus those the view filters on) if
+# given
+def read_view(path, name, columns=None):
+    if columns is not None:
+        columns = list(dict.fromkeys(list(columns) + playViews[name][0]))
+    return view(read_table(path, columns), name)
+
+
+# Format one chunk of a frame as csv text
+def _csv_chunk(args):
+    chunk, header, kwargs = args
+    return chunk.to_csv(header=header, **kwargs)
+
+
+# Write frame as csv, formatting chunks of chunksize rows in a process pool (processes=1 formats them here) and
+# writing them in order, so the file matches frame.to_csv(path, **kwargs)
+def write_csv(frame, path, chunksize=50000, processes=None, **kwargs):
+    starts = range(0, max(len(frame), 1), chunksize)
+    chunks = [(frame.iloc[start:start + chunksize], start == 0, kwargs) for start in starts]
+    processes = processes or os.cpu_count()
+    with open(path + '.tmp', 'w', newline='') as f:
+        if processes > 1:
+            with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+                for text in pool.map(_csv_chunk, chunks):
+                    f.write(text)
+        else:
+            for chunk in chunks:
+                f.write(_csv_chunk(chunk))
+    os.replace(path + '.tmp', path)
+
+
+# Time test 8.py's four csv dumps against one Parquet / Feather table with views on copies of the bundled season,
+# check the views against the csv play sets and the chunked csv writer against to_csv
+# Usage: python play_export.py [copies of the bundled season]
+if __name__ == '__main__':
+    from all_plays import ep_play_set
+    from pbp_cache import load_all_plays
+
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    allPlays = load_all_plays('pbp-2019_v2.csv')
+    allPlays = pd.concat([allPlays.set_axis(allPlays.index + c * 10 ** 14) for c in range(copies)])
+    tmp = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        sets = {'all': allPlays, 'rushing': allPlays[allPlays.playType == 'RUSH'],
+                'passing': allPlays[allPlays.playType == 'PASS'], 'ep': ep_play_set(allPlays)}
+        for name, plays in sets.items():
+            plays.to_csv(os.path.join(tmp, '%s_export_dataframe.csv' % name), index=True, header=True,
+                         index_label='playID')
+        csvTime = time.perf_counter() - start
+        csvSize = sum(os.path.getsize(os.path.join(tmp, '%s_export_dataframe.csv' % name)) for name in sets)
+        print('%d plays: 4 csv files %.2fs, %.1f MB' % (len(allPlays), csvTime, csvSize / 2 ** 20))
+
+        for ext in ['parquet', 'feather']:
+            path = os.path.join(tmp, 'all_plays.%s' % ext)
+            start = time.perf_counter()
+            write_table(allPlays, path)
+            writeTime = time.perf_counter() - start
+            start = time.perf_counter()
+            rushing = read_view(path, 'rushing', columns=['gameID', 'offTeam', 'yards'])
+            viewTime = time.perf_counter() - start
+            print('%-7s one table %.2fs, %.1f MB; rushing view of 3 columns read in %.3fs'
+                  % (ext, writeTime, os.path.getsize(path) / 2 ** 20, viewTime))
+            assert len(rushing) == len(sets['rushing'])
+
+        stored = read_table(os.path.join(tmp, 'all_plays.parquet'))
+        for name in ['rushing', 'passing', 'ep']:
+            pd.testing.assert_index_equal(view(stored, name).index, sets[name].index)
+
+        start = time.perf_counter()
+        allPlays.to_csv(os.path.join(tmp, 'pandas.csv'), index_label='playID')
+        pandasTime = time.perf_counter() - start
+        for processes in [1, 2]:
+            start = time.perf_counter()
+            write_csv(allPlays, os.path.join(tmp, 'chunked.csv'), processes=processes, index_label='playID')
+            chunkTime = time.perf_counter() - start
+            with open(os.path.join(tmp, 'pandas.csv'), 'rb') as a, open(os.path.join(tmp, 'chunked.csv'), 'rb') as b:
+                assert a.read() == b.read()
+            print('all plays csv: to_csv %.2fs, write_csv with %d process(es) %.2fs' % (pandasTime, processes,
+                                                                                       chunkTime))
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,142 @@
+# import sys, time, numpy and pandas
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Sizes of the situation key fields: downs 0 to 4, toGo 0 to 99 (longer distances share 99) and yardLine 0 to 100
+# (rounded, with 101 for plays without a yardLine)
+_downs, _toGos, _yardLines = 5, 100, 102
+
+
+# Combine team codes, downs, toGo and yardLine into sortable int64 situation keys
+def _situation_keys(team, down, toGo, yardLine):
+    return ((team * _downs + down) * _toGos + toGo) * _yardLines + yardLine
+
+
+# Return the values of a query argument: all of domain for None, lo to hi (inclusive) for a (lo, hi) tuple, else the
+# value(s) given
+def _values(arg, domain):
+    if arg is None:
+        return np.asarray(domain)
+    if isinstance(arg, tuple):
+        return np.arange(arg[0], arg[1] + 1)
+    return np.atleast_1d(arg)
+
+
+# Sorted indexes over allPlays for slice queries by lookup instead of boolean masks over every play:
+# game (gameID to a range of rows) and situation (rows sorted by offense or defense team, down, toGo and yardLine,
+# so any combination of them is a few binary searches)
+# Queries return sorted row positions in allPlays (use frame to get the plays)
+class PlayIndex:
+
+    def __init__(self, allPlays):
+        self.allPlays = allPlays
+        self.gameOrder = np.argsort(allPlays.gameID.values, kind='stable')
+        self.gameIDs = allPlays.gameID.values[self.gameOrder]
+
+        # Situation fields of every play, clipped to the key ranges
+        self.down = np.clip(allPlays.down.fillna(0).values, 0, _downs - 1).astype(np.int64)
+        self.toGo = np.clip(allPlays.toGo.fillna(0).values, 0, _toGos - 1).astype(np.int64)
+        yardLine = allPlays.yardLine.values.astype(np.float64)
+        self.yardLine = np.where(np.isnan(yardLine), _yardLines - 1,
+                                 np.clip(np.rint(np.nan_to_num(yardLine)), 0, 100)).astype(np.int64)
+
+        # One sorted situation index per side (offTeam, defTeam) and one over every team (team code 0)
+        self.teams = pd.Index(sorted(set(allPlays.offTeam.dropna()) | set(allPlays.defTeam.dropna())))
+        self.situations = {}
+        for side in ['offTeam', 'defTeam', None]:
+            team = np.zeros(len(allPlays), dtype=np.int64) if side is None else \
+                self.teams.get_indexer(allPlays[side].values).astype(np.int64) + 1
+            keys = _situation_keys(team, self.down, self.toGo, self.yardLine)
+            order = np.argsort(keys, kind='stable')
+            self.situations[side] = (keys[order], order)
+
+    # Return the rows of a game
+    def game(self, gameID):
+        lo = np.searchsorted(self.gameIDs, gameID, side='left')
+        hi = np.searchsorted(self.gameIDs, gameID, side='right')
+        return np.sort(self.gameOrder[lo:hi])
+
+    # Return the rows of the plays of team(s) on offense (side='offTeam') or defense (side='defTeam')
+    def team(self, team, side='offTeam'):
+        return self.situation(team=team, side=side)
+
+    # Return the rows of the plays matching every argument given
+    # team: team code(s) of side ('offTeam' or 'defTeam'); down, toGo and yardLine: a value, a list of values or an
+    # inclusive (lo, hi) tuple (yardLine is rounded to whole yards, toGo over 99 counts as 99)
+    # flags: columns of allPlays to match exactly after the lookup, e.g. isUTM=1
+    # e.g. 3rd and 1 to 3 in the red zone for KC: situation(team='KC', down=3, toGo=(1, 3), yardLine=(81, 100))
+    def situation(self, team=None, side='offTeam', down=None, toGo=None, yardLine=None, **flags):
+        if team is None:
+            keys, order = self.situations[None]
+            teams = np.zeros(1, dtype=np.int64)
+        else:
+            keys, order = self.situations[side]
+            teams = self.teams.get_indexer(np.atleast_1d(team)).astype(np.int64) + 1
+            teams = teams[teams > 0]
+        downs = _values(down, range(_downs))
+        toGos = np.clip(_values(toGo, range(_toGos)), 0, _toGos - 1)
+        if isinstance(yardLine, tuple) or yardLine is None:
+            lo, hi = (0, _yardLines - 1) if yardLine is None else (max(yardLine[0], 0), min(yardLine[1], 100))
+            ranges = [(lo, hi)]
+        else:
+            ranges = [(y, y) for y in np.atleast_1d(yardLine)]
+
+        # Every team x down x toGo x yardLine range combination is one contiguous block of the sorted keys
+        prefix = _situation_keys(teams[:, None, None], downs[None, :, None], toGos[None, None, :], 0).ravel()
+        bounds = np.array(ranges, dtype=np.int64)
+        starts = np.searchsorted(keys, (prefix[:, None] + bounds[None, :, 0]).ravel(), side='left')
+        ends = np.searchsorted(keys, (prefix[:, None] + bounds[None, :, 1]).ravel(), side='right')
+        lengths = ends - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        rows = np.sort(order[positions])
+        for col, value in flags.items():
+            rows = rows[self.allPlays[col].values[rows] == value]
+        return rows
+
+    # Return the plays at rows
+    def frame(self, rows):
+        return self.allPlays.iloc[rows]
+
+
+# Build the index over copies of the bundled season (as separate seasons with their own gameIDs), check queries
+# against boolean masks and time both
+# Usage: python play_index.py [copies of the bundled season]
+if __name__ == '__main__':
+    from pbp_cache import load_all_plays
+
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    allPlays = load_all_plays('pbp-2019_v2.csv')
+    allPlays = pd.concat([allPlays.assign(gameID=allPlays.gameID + c * 10 ** 10) for c in range(copies)],
+                         ignore_index=True)
+    start = time.perf_counter()
+    index = PlayIndex(allPlays)
+    buildTime = time.perf_counter() - start
+
+    queries = {'KC 3rd and 1-3 in the red zone':
+               (lambda: index.situation(team='KC', down=3, toGo=(1, 3), yardLine=(81, 100)),
+                lambda: (allPlays.offTeam == 'KC') & (allPlays.down == 3) & allPlays.toGo.between(1, 3) &
+                (allPlays.isRedZone == 1)),
+               'NE defense, two minutes, 1st down':
+               (lambda: index.situation(team='NE', side='defTeam', down=1, isUTM=1),
+                lambda: (allPlays.defTeam == 'NE') & (allPlays.down == 1) & (allPlays.isUTM == 1)),
+               'goal to go, any team':
+               (lambda: index.situation(down=[1, 2, 3, 4], yardLine=(90, 100)),
+                lambda: allPlays.down.between(1, 4) & (allPlays.isGoalToGo == 1)),
+               'one game': (lambda: index.game(allPlays.gameID.iloc[len(allPlays) // 2]),
+                            lambda: allPlays.gameID == allPlays.gameID.iloc[len(allPlays) // 2]),
+               'KC offense': (lambda: index.team('KC'), lambda: allPlays.offTeam == 'KC')}
+    print('%d plays, index built in %.1f ms' % (len(allPlays), buildTime * 1000))
+    for name, (lookup, mask) in queries.items():
+        rows = lookup()
+        np.testing.assert_array_equal(rows, np.flatnonzero(mask().values))
+        times = {}
+        for method, query in [('index', lookup), ('mask', lambda: allPlays[mask()])]:
+            start = time.perf_counter()
+            for _ in range(20):
+                query()
+            times[method] = (time.perf_counter() - start) / 20
+        print('%-34s %5d plays: index %.3f ms, boolean mask %.3f ms'
+              % (name, len(rows), times['index'] * 1000, times['mask'] * 1000))
@@ -0,0 +1,210 @@
+# import sys, time, numpy and pandas
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from encoding import registry
+
+# Create dictionary of rate metrics as (numerator, denominator) columns of the player week table; every version of a
+# metric (week, last N games, season to date, exponentially weighted) is the ratio of the summed columns
+ratioMetrics = {'opptyShare': ('opptys', 'teamTotalOpptys'),
+                'passingCompPct': ('passingComp', 'passingAtt'),
+                'passingYdAtt': ('passingYd', 'passingAtt'),
+                'passingTDPct': ('passingTD', 'passingAtt'),
+                'passingIntPct': ('passingInt', 'passingAtt'),
+                'rushingYdAtt': ('rushingYd', 'rushingAtt'),
+                'receivingYdTar': ('receivingYd', 'receivingTar'),
+                'epaPerPlay': ('epa', 'epaPlays')}
+
+# Columns the passer rating is calculated from
+passerRatingCols = ['passingComp', 'passingAtt', 'passingYd', 'passingTD', 'passingInt']
+
+# Columns identifying a player week (rows are grouped by player and season and ordered by week)
+playerWeekCols = ['playerID', 'season', 'week']
+
+
+# Calculate the NFL passer rating from summed completions, attempts, yards, touchdowns and interceptions, with each
+# component clipped to the official 0 to 2.375 bounds
+def passer_rating(comp, att, yds, td, ints):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a = np.clip((comp / att - 0.3) * 5, 0, 2.375)
+        b = np.clip((yds / att - 3) * 0.25, 0, 2.375)
+        c = np.clip(td / att * 20, 0, 2.375)
+        d = np.clip(2.375 - ints / att * 25, 0, 2.375)
+    return (a + b + c + d) / 6 * 100
+
+
+# Sum epa and count plays (epaPlays) of every rusher, passer and target by season, week, team and player name from
+# allPlays with epa (see epa.add_epa), to join to a player week table by upper case player name
+# The plays are grouped on int32 team and player name codes of the shared registry, so team is the franchise's
+# current abbreviation (see encoding.teamAliases)
+def player_epa(allPlays):
+    plays = allPlays[allPlays.epa.notnull()]
+    isRush = (plays.playType == 'RUSH').values
+    isPass = (plays.playType == 'PASS').values
+    roles = pd.DataFrame({'season': np.concatenate([plays.seasonYear.values[m] for m in [isRush, isPass, isPass]]),
+                          'week': np.concatenate([plays.week.values[m] for m in [isRush, isPass, isPass]]),
+                          'team': np.concatenate([plays.offTeamCode.values[m] for m in [isRush, isPass, isPass]]),
+                          'player': np.concatenate([registry.encode('playerName', plays[c])[m] for c, m in
+                                                    [('rushingPlayerName', isRush), ('passingPlayerName', isPass),
+                                                     ('targetPlayerName', isPass)]]),
+                          'epa': np.concatenate([plays.epa.values[m] for m in [isRush, isPass, isPass]])})
+    games = roles[roles.player >= 0].groupby(['season', 'week', 'team', 'player']).epa.agg(epa='sum', epaPlays='size')
+    games = games.reset_index()
+    games['team'] = registry.decode('team', games.team)
+    games.insert(3, 'playerName', registry.decode('playerName', games.pop('player')))
+    return games
+
+
+# Rolling, season to date and exponentially weighted player metrics over a player week table that weeks are
+# appended to
+# Windows are the last N games a player played in the season; the exponentially weighted sums decay by half every
+# halflife games. Between appends only the last max(windows) - 1 rows of every player season are kept, with the
+# cumulative and exponentially weighted sums before them, so an append costs the size of the new weeks
+class PlayerMetrics:
+
+    def __init__(self, windows=(3,), halflife=2):
+        self.windows = list(windows)
+        self.decay = 0.5 ** (1 / halflife)
+        self.history = None
+        self.bases = None
+
+    # Calculate the metrics of games (player week rows with playerWeekCols and the metric columns, later in the
+    # season than any week appended before for the same player) and append them to the state
+    # Returns games with a column per metric and version: <metric> (the week), <metric>Last<N>, <metric>Season and
+    # <metric>Ewm, plus passerRating in the same versions
+    def append(self, games):
+        metrics = {m: cols for m, cols in ratioMetrics.items() if set(cols) <= set(games.columns)}
+        sumCols = sorted(set(c for cols in metrics.values() for c in cols) |
+                         (set(passerRatingCols) if set(passerRatingCols) <= set(games.columns) else set()))
+        new = games[playerWeekCols + sumCols].assign(_row=np.arange(len(games)))
+        frame = new if self.history is None else pd.concat([self.history.assign(_row=-1), new], ignore_index=True)
+        frame = frame.sort_values(playerWeekCols, kind='stable')
+        n = len(frame)
+        rows = frame._row.values
+        X = frame[sumCols].to_numpy(np.float64)
+
+        # Group boundaries (player seasons) and each row's position in its group
+        key = frame[['playerID', 'season']]
+        isStart = np.ones(n, dtype=bool)
+        isStart[1:] = (key.iloc[1:].values != key.iloc[:-1].values).any(axis=1)
+        group = np.cumsum(isStart) - 1
+        starts = np.flatnonzero(isStart)
+        ends = np.append(starts[1:], n) - 1
+        groupStart = starts[group]
+        position = np.arange(n) - groupStart
+        oldAfterNew = (rows[1:] < 0) & (rows[:-1] >= 0) & (group[1:] == group[:-1])
+        if oldAfterNew.any():
+            raise ValueError('appended weeks must follow the weeks already appended for each player season')
+
+        # Cumulative and exponentially weighted sums before the first row kept for each group
+        groupKeys = pd.MultiIndex.from_frame(key.iloc[starts])
+        if self.bases is None:
+            cumBase = np.zeros((len(starts), len(sumCols)))
+            ewmBase = np.zeros((len(starts), len(sumCols)))
+        else:
+            bases = self.bases.reindex(groupKeys).fillna(0)
+            cumBase = bases[['cum_' + c for c in sumCols]].to_numpy()
+            ewmBase = bases[['ewm_' + c for c in sumCols]].to_numpy()
+
+        # Running and exponentially weighted sums within each group, one vectorized step per week position (a player
+        # season has at most ~20 rows, and stepping avoids the cancellation of differencing one long cumulative sum)
+        cs = X.copy()
+        ewm = X + self.decay * ewmBase[group] * (position == 0)[:, None]
+        for p in range(1, position.max() + 1 if n else 0):
+            at = np.flatnonzero(position == p)
+            cs[at] += cs[at - 1]
+            ewm[at] += self.decay * ewm[at - 1]
+
+        # Week, season to date, last N and exponentially weighted sums of every column
+        sums = {'': X, 'Season': cumBase[group] + cs}
+        for w in self.windows:
+            sums['Last%d' % w] = cs - np.where((position >= w)[:, None], cs[np.maximum(np.arange(n) - w, 0)], 0)
+        sums['Ewm'] = ewm
+
+        # Ratios of the sums, for the new rows in the order of games
+        isNew = rows >= 0
+        order = np.argsort(rows[isNew])
+        out = games.copy()
+        col = {c: j for j, c in enumerate(sumCols)}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for version, S in sums.items():
+                S = S[isNew][order]
+                for m, (num, den) in metrics.items():
+                    out[m + version] = S[:, col[num]] / S[:, col[den]]
+                if set(passerRatingCols) <= set(col):
+                    out['passerRating' + version] = passer_rating(*[S[:, col[c]] for c in passerRatingCols])
+
+        # Keep the last max(windows) - 1 rows of every group (none without windows) and the sums before them
+        keep = max(self.windows, default=1) - 1
+        first = np.maximum(ends + 1 - keep, starts)
+        kept = position >= (first - starts)[group]
+        dropped = (first > starts)[:, None]
+        cumBefore = np.where(dropped, sums['Season'][first - 1], cumBase)
+        ewmBefore = np.where(dropped, ewm[first - 1], ewmBase)
+        bases = pd.DataFrame(np.hstack([cumBefore, ewmBefore]), index=groupKeys,
+                             columns=['cum_' + c for c in sumCols] + ['ewm_' + c for c in sumCols])
+        if self.bases is not None:
+            bases = pd.concat([self.bases[~self.bases.index.isin(groupKeys)], bases])
+        self.history = frame[kept].drop(columns='_row')
+        self.bases = bases
+        return out
+
+
+# Calculate the rolling, season to date and exponentially weighted metrics of a whole player week table
+def player_metrics(games, windows=(3,), halflife=2):
+    return PlayerMetrics(windows, halflife).append(games)
+
+
+# Check appending week by week against one pass and against pandas rolling / expanding / ewm on synthetic player
+# weeks, and time both
+# Usage: python player_metrics.py [players]
+if __name__ == '__main__':
+    players = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = np.random.default_rng(0)
+    n = players * 3 * 17
+    games = pd.DataFrame({'playerID': np.repeat(np.arange(players), 51),
+                          'season': np.tile(np.repeat([2017, 2018, 2019], 17), players),
+                          'week': np.tile(np.arange(1, 18), 3 * players)})
+    for c in ['opptys', 'passingComp', 'passingTD', 'passingInt', 'rushingAtt', 'receivingTar']:
+        games[c] = rng.integers(0, 10, n)
+    games['teamTotalOpptys'] = games.opptys + rng.integers(40, 60, n)
+    games['passingAtt'] = games.passingComp + rng.integers(0, 15, n)
+    games['passingYd'] = games.passingComp * rng.integers(5, 15, n)
+    games['rushingYd'] = games.rushingAtt * rng.integers(0, 8, n)
+    games['receivingYd'] = games.receivingTar * rng.integers(0, 12, n)
+    games = games.sample(frac=1, random_state=0)
+
+    start = time.perf_counter()
+    full = player_metrics(games, windows=[3, 5])
+    fullTime = time.perf_counter() - start
+
+    engine = PlayerMetrics(windows=[3, 5])
+    start = time.perf_counter()
+    weekly = [engine.append(games[(games.season == s) & (games.week == w)])
+              for s in [2017, 2018, 2019] for w in range(1, 18)]
+    appendTime = time.perf_counter() - start
+    pd.testing.assert_frame_equal(pd.concat(weekly).loc[full.index], full, rtol=1e-9)
+
+    # Against pandas per group
+    ordered = full.sort_values(playerWeekCols)
+    grouped = ordered.groupby(['playerID', 'season'])
+    opptys, total = grouped.opptys, grouped.teamTotalOpptys
+    np.testing.assert_allclose(ordered.opptyShareLast3, opptys.transform(lambda s: s.rolling(3, 1).sum()) /
+                               total.transform(lambda s: s.rolling(3, 1).sum()))
+    np.testing.assert_allclose(ordered.opptyShareSeason, opptys.cumsum() / total.cumsum())
+    decay = 0.5 ** (1 / 2)
+    np.testing.assert_allclose(ordered.opptyShareEwm,
+                               opptys.transform(lambda s: s.ewm(alpha=1 - decay, adjust=True).mean()) /
+                               total.transform(lambda s: s.ewm(alpha=1 - decay, adjust=True).mean()))
+    assert full.filter(like='passerRating').stack().dropna().between(0, 158.3334).all()
+
+    # Without windows, weekly appends keep only the sums and match one pass
+    season = games[games.season == 2019]
+    engine = PlayerMetrics(windows=())
+    weekly = [engine.append(season[season.week == w]) for w in range(1, 18)]
+    pd.testing.assert_frame_equal(pd.concat(weekly).loc[season.index], player_metrics(season, windows=()), rtol=1e-9)
+    print('%d player weeks: one pass %.2fs, 51 weekly appends %.2fs (%.1f ms each)'
+          % (n, fullTime, appendTime, appendTime / 51 * 1000))
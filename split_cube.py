@@ -0,0 +1,184 @@
+# import os, sys, time, numpy and pandas
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Dimensions of the cube: columns of allPlays plus the buckets added by split_dims
+cubeDims = ['offTeam', 'defTeam', 'down', 'distance', 'fieldZone', 'isUTM', 'scoreDiff', 'playType']
+
+# Measures summed into every cell (epa is used when allPlays has it, see epa.add_epa)
+cubeMeasures = ['nextScore', 'yards', 'epa']
+
+# Distance buckets by toGo (upper edges and labels, the last open ended)
+distanceEdges = [3, 7, 10]
+distanceLabels = ['1-3', '4-7', '8-10', '11+']
+
+# Score differential buckets by offScoreDiff (upper edges and labels, the last open ended)
+scoreDiffEdges = [-17, -9, -4, -1, 0, 3, 8, 16]
+scoreDiffLabels = ['<=-17', '-16 to -9', '-8 to -4', '-3 to -1', 'tied', '1-3', '4-8', '9-16', '>=17']
+
+
+# Return the cube's bucket dimensions of allPlays: distance (toGo bucket), fieldZone (ownDeep 0-20, own 21-50, opp
+# 51-80, then the existing isRedZone and isGoalToGo flags as redZone and goalToGo) and scoreDiff (offScoreDiff bucket,
+# 'none' for plays without an offense, whose offScoreDiff is 0 without the score being level)
+def split_dims(allPlays):
+    toGo = allPlays.toGo.values
+    yardLine = allPlays.yardLine.values.astype(np.float64)
+    zone = np.select([allPlays.isGoalToGo.values == 1, allPlays.isRedZone.values == 1, yardLine > 50, yardLine > 20,
+                      yardLine >= 0], ['goalToGo', 'redZone', 'opp', 'own', 'ownDeep'], 'none')
+    return pd.DataFrame({'distance': np.where(toGo > 0, np.array(distanceLabels)[np.searchsorted(distanceEdges, toGo)],
+                                              'none'),
+                         'fieldZone': zone,
+                         'scoreDiff': np.where(allPlays.offTeam.notnull().values,
+                                               np.array(scoreDiffLabels)[np.searchsorted(scoreDiffEdges,
+                                                                                         allPlays.offScoreDiff.values)],
+                                               'none')},
+                        index=allPlays.index)
+
+
+# Materialized aggregate cube of plays over dims: one row per occupied cell with the number of plays and, for every
+# measure, the count of non-missing values, their sum and their sum of squares, so means and variances of any
+# roll-up come from summing cells instead of plays
+class SplitCube:
+
+    def __init__(self, cells, dims, measures):
+        self.cells = cells
+        self.dims = list(dims)
+        self.measures = list(measures)
+
+    # Build the cube from allPlays (dims missing from allPlays are derived by split_dims)
+    @classmethod
+    def from_plays(cls, allPlays, dims=cubeDims, measures=cubeMeasures):
+        measures = [m for m in measures if m in allPlays]
+        derived = split_dims(allPlays)
+        columns = {d: (allPlays[d] if d in allPlays else derived[d]) for d in dims}
+
+        # Encode every dimension and combine the codes into one int64 cell key
+        codes, uniques = [], []
+        for d in dims:
+            c, u = pd.factorize(columns[d], use_na_sentinel=False)
+            codes.append(c.astype(np.int64))
+            uniques.append(u)
+        key = np.zeros(len(allPlays), dtype=np.int64)
+        for c, u in zip(codes, uniques):
+            key = key * len(u) + c
+        cellKeys, cell = np.unique(key, return_inverse=True)
+
+        cells = {}
+        rest = cellKeys
+        for d, u in reversed(list(zip(dims, uniques))):
+            cells[d] = np.asarray(u, dtype=object)[rest % len(u)]
+            rest = rest // len(u)
+        cells = {d: cells[d] for d in dims}
+        cells['plays'] = np.bincount(cell, minlength=len(cellKeys))
+        for m in measures:
+            values = allPlays[m].values.astype(np.float64)
+            seen = ~np.isnan(values)
+            values = np.where(seen, values, 0)
+            cells[m + 'Count'] = np.bincount(cell, weights=seen, minlength=len(cellKeys))
+            cells[m + 'Sum'] = np.bincount(cell, weights=values, minlength=len(cellKeys))
+            cells[m + 'SumSq'] = np.bincount(cell, weights=values ** 2, minlength=len(cellKeys))
+        return cls(pd.DataFrame(cells), dims, measures)
+
+    # Add plays (e.g. a new week) to the cube, merging their cells into the existing ones
+    def add(self, allPlays):
+        new = SplitCube.from_plays(allPlays, self.dims, self.measures)
+        cells = pd.concat([self.cells, new.cells], ignore_index=True)
+        self.cells = cells.groupby(self.dims, sort=False, dropna=False).sum().reset_index()
+        return self
+
+    # Roll the cube up to dims (an empty list gives the totals), keeping only the cells matching filters ({dimension:
+    # value or list of values})
+    # Returns plays plus count, mean and (sample) variance of every measure by dims
+    def rollup(self, dims=(), **filters):
+        cells = self.cells
+        for d, value in filters.items():
+            cells = cells[cells[d].isin(value if isinstance(value, (list, tuple, set)) else [value])]
+        sumCols = ['plays'] + [m + s for m in self.measures for s in ['Count', 'Sum', 'SumSq']]
+        if dims:
+            totals = cells.groupby(list(dims), dropna=False)[sumCols].sum()
+        else:
+            totals = cells[sumCols].sum().to_frame().T
+        values = totals.to_numpy(np.float64)
+        out = {'plays': values[:, 0].astype(np.int64)}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for j, m in enumerate(self.measures):
+                n, s, ss = values[:, 1 + 3 * j], values[:, 2 + 3 * j], values[:, 3 + 3 * j]
+                out[m + 'Count'] = n
+                out[m + 'Mean'] = s / n
+                out[m + 'Var'] = np.where(n > 1, (ss - s ** 2 / n) / (n - 1), np.nan)
+        return pd.DataFrame(out, index=totals.index)
+
+    # Write the cells to a Parquet file (dims first, then plays and the measure columns, which is how load reads them)
+    def save(self, path):
+        self.cells.to_parquet(path)
+
+    # Read a cube written by save
+    @classmethod
+    def load(cls, path):
+        cells = pd.read_parquet(path)
+        dims = list(cells.columns[:list(cells.columns).index('plays')])
+        measures = [c[:-len('Count')] for c in cells.columns if c.endswith('Count')]
+        return cls(cells, dims, measures)
+
+
+# Build the cube from copies of the bundled season, check roll-ups against groupby over the plays and time both
+# Usage: python split_cube.py [copies of the bundled season]
+if __name__ == '__main__':
+    from epa import add_epa
+    from ep_model import EPModel
+    from pbp_cache import cacheDir, load_all_plays
+
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    allPlays = load_all_plays('pbp-2019_v2.csv')
+    allPlays = add_epa(allPlays, EPModel.fit(allPlays))
+    allPlays = pd.concat([allPlays.assign(gameID=allPlays.gameID + c * 10 ** 10) for c in range(copies)],
+                         ignore_index=True)
+
+    start = time.perf_counter()
+    cube = SplitCube.from_plays(allPlays)
+    buildTime = time.perf_counter() - start
+    plays = pd.concat([allPlays, split_dims(allPlays)], axis=1)
+
+    # The tied bucket holds only plays with level scores, so away possessions that trail or lead are bucketed by their
+    # margin, from the away offense's point of view
+    tied = (plays.scoreDiff == 'tied').values
+    level = (plays.homeScoreCum == plays.awayScoreCum).values
+    away = ((plays.homeTeamPoss == 0) & plays.offTeam.notnull()).values
+    assert level[tied].all() and (away & ~level).any() and not tied[away & ~level].any()
+    trailing = away & (plays.awayScoreCum < plays.homeScoreCum).values
+    assert np.isin(plays.scoreDiff.values[trailing], scoreDiffLabels[:scoreDiffLabels.index('tied')]).all()
+
+    for dims, filters in [(['down', 'distance'], {}), (['fieldZone'], {'offTeam': 'KC'}),
+                          (['scoreDiff', 'isUTM'], {'playType': ['RUSH', 'PASS']}), ([], {'down': 3})]:
+        start = time.perf_counter()
+        rolled = cube.rollup(dims, **filters)
+        cubeTime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        subset = plays
+        for d, value in filters.items():
+            subset = subset[subset[d].isin(value if isinstance(value, list) else [value])]
+        if dims:
+            expected = subset.groupby(dims, dropna=False)[cube.measures].agg(['mean', 'var'])
+        else:
+            expected = subset[cube.measures].agg(['mean', 'var']).unstack().to_frame().T
+        playTime = time.perf_counter() - start
+        for m in cube.measures:
+            np.testing.assert_allclose(rolled[m + 'Mean'].values, expected[(m, 'mean')].values, rtol=1e-9)
+            np.testing.assert_allclose(rolled[m + 'Var'].values, expected[(m, 'var')].values, rtol=1e-6, atol=1e-9)
+        print('%-22s %-34s %4d rows: cube %.2f ms, plays %.2f ms'
+              % (dims, filters, len(rolled), cubeTime * 1000, playTime * 1000))
+
+    # Adding the plays in two parts gives the same cube
+    half = len(allPlays) // 2
+    parts = SplitCube.from_plays(allPlays.iloc[:half]).add(allPlays.iloc[half:])
+    pd.testing.assert_frame_equal(parts.rollup(['offTeam', 'down']), cube.rollup(['offTeam', 'down']))
+    os.makedirs(cacheDir, exist_ok=True)
+    cube.save(os.path.join(cacheDir, 'split_cube.parquet'))
+    loaded = SplitCube.load(os.path.join(cacheDir, 'split_cube.parquet'))
+    assert loaded.dims == cube.dims and loaded.measures == cube.measures
+    print('%d plays in %d cells, built in %.1f ms' % (len(allPlays), len(cube.cells), buildTime * 1000))
@@ -0,0 +1,182 @@
+# import cProfile, json, os, pstats, resource, sys, time, tracemalloc, numpy and pandas
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+
+# Return the peak resident set size of this process in MB (ru_maxrss is in KB on Linux)
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Return the number of rows of a stage's input or output (the first element of a tuple; None for anything else)
+def _rows(value):
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    return None
+
+
+# Call func as an unprofiled stage (what build_all_plays and load_all_plays run stages with when given no profiler)
+def unprofiled(name, func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+# Record wall time, rows in and out and memory of the named stages of a pipeline run
+# Stages run inside another stage are recorded under its path ('build;descriptions'), so the report nests like a call
+# tree. Every stage records the growth of the process' peak RSS; with tracemalloc=True also the peak and net Python
+# allocations during the stage, and with cprofile=True the top functions of the stage by own time (the profile of a
+# stage leaves out the stages run inside it, as its collapsed stack time does)
+class StageProfiler:
+
+    def __init__(self, cprofile=False, tracemalloc=False, top=15):
+        self.cprofile = cprofile
+        self.tracemalloc = tracemalloc
+        self.top = top
+        self.stages = []
+        self.profiles = {}
+        self.path = []
+        self._running = []
+
+    # Run func(*args, **kwargs) as stage name and return its result; rows in are those of the first argument
+    def run(self, name, func, *args, **kwargs):
+        self.path.append(name)
+        stage = {'stage': ';'.join(self.path), 'rowsIn': _rows(args[0]) if args else None}
+        self.stages.append(stage)
+        outer = self._running[-1] if self._running else None
+        peakRss = _peak_rss_mb()
+
+        # Fold the enclosing stage's peak allocation so far into it before resetting the peak for this stage
+        traced = 0
+        if self.tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            traced, peak = tracemalloc.get_traced_memory()
+            if outer is not None:
+                outer['peak'] = max(outer['peak'], peak)
+            tracemalloc.reset_peak()
+        running = {'peak': traced, 'profile': cProfile.Profile() if self.cprofile else None}
+        if outer is not None and outer['profile'] is not None:
+            outer['profile'].disable()
+        self._running.append(running)
+
+        start = time.perf_counter()
+        try:
+            if running['profile'] is not None:
+                running['profile'].enable()
+            result = func(*args, **kwargs)
+        finally:
+            if running['profile'] is not None:
+                running['profile'].disable()
+            stage['seconds'] = time.perf_counter() - start
+            self._running.pop()
+            self.path.pop()
+            if outer is not None and outer['profile'] is not None:
+                outer['profile'].enable()
+
+        stage['rowsOut'] = _rows(result)
+        stage['peakRssGrowthMB'] = _peak_rss_mb() - peakRss
+        if self.tracemalloc:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, running['peak'])
+            if outer is not None:
+                outer['peak'] = max(outer['peak'], peak)
+            stage['peakAllocMB'] = (peak - traced) / 2 ** 20
+            stage['netAllocMB'] = (current - traced) / 2 ** 20
+        if running['profile'] is not None:
+            self.profiles[stage['stage']] = running['profile']
+            stats = pstats.Stats(running['profile']).stats
+            functions = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:self.top]
+            stage['functions'] = [{'function': '%s:%d(%s)' % key, 'calls': calls, 'ownSeconds': own,
+                                   'cumulativeSeconds': cumulative}
+                                  for key, (_, calls, own, cumulative, _) in functions]
+        return result
+
+    # Return the stages as a data frame (one row per stage, without the function lists)
+    def frame(self):
+        return pd.DataFrame([{k: v for k, v in s.items() if k != 'functions'} for s in self.stages])
+
+    # Return the report: the stages with their measurements, plus the run's environment
+    def report(self):
+        return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+                'pandas': pd.__version__, 'numpy': np.__version__, 'stages': self.stages}
+
+    # Write the report as JSON
+    def save(self, path):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.report(), f, indent=1)
+        os.replace(path + '.tmp', path)
+
+    # Return the stages in collapsed stack format ('outer;inner microseconds' per line, the time of a stage less that
+    # of the stages inside it), as read by flamegraph.pl and speedscope
+    def collapsed(self):
+        own = {}
+        for s in self.stages:
+            own[s['stage']] = own.get(s['stage'], 0) + s['seconds']
+            parent = s['stage'].rpartition(';')[0]
+            if parent:
+                own[parent] = own.get(parent, 0) - s['seconds']
+        return ''.join('%s %d\n' % (stage, max(round(seconds * 1e6), 0)) for stage, seconds in own.items())
+
+    # Write the cProfile stats of every profiled stage to directory (one .prof file per stage, for snakeviz or pstats)
+    def dump_profiles(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for stage, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(directory, stage.replace(';', '.').replace(' ', '_') + '.prof'))
+
+
+# Compare the stage times of two reports (dictionaries or JSON paths): seconds before and after and their ratio by
+# stage, for tracking regressions between runs
+def compare_reports(before, after):
+    times = []
+    for report in [before, after]:
+        if isinstance(report, str):
+            with open(report) as f:
+                report = json.load(f)
+        times.append(pd.DataFrame(report['stages']).groupby('stage', sort=False).seconds.sum())
+    compared = pd.concat(times, axis=1, keys=['before', 'after'])
+    compared['ratio'] = compared.after / compared.before
+    return compared
+
+
+# Profile a cold build of allPlays stage by stage, print the stages, write the JSON report and collapsed stacks to the
+# cache directory and compare with the previous report there
+# Usage: python stage_profiler.py [path to nflscrapR pbp csv] [--cprofile] [--tracemalloc]
+if __name__ == '__main__':
+    from pbp_cache import cacheDir, load_all_plays
+
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    path = args[0] if args else 'pbp-2019_v2.csv'
+    profiler = StageProfiler(cprofile='--cprofile' in sys.argv, tracemalloc='--tracemalloc' in sys.argv)
+    profiler.run('load_all_plays', load_all_plays, path, rebuild=True, profiler=profiler)
+
+    pd.set_option('display.width', 160)
+    print(profiler.frame().round(4).to_string(index=False))
+    for stage in profiler.stages:
+        if stage.get('functions') and ';' in stage['stage']:
+            print('\n%s: top functions by own time' % stage['stage'])
+            for f in stage['functions'][:5]:
+                print('  %8.4fs %8d  %s' % (f['ownSeconds'], f['calls'], f['function']))
+
+    os.makedirs(cacheDir, exist_ok=True)
+    reportPath = os.path.join(cacheDir, 'profile.json')
+    previous = reportPath if os.path.exists(reportPath) else None
+    if previous:
+        os.replace(reportPath, reportPath + '.previous')
+        previous += '.previous'
+    profiler.save(reportPath)
+    with open(os.path.join(cacheDir, 'profile.folded'), 'w') as f:
+        f.write(profiler.collapsed())
+    if profiler.profiles:
+        profiler.dump_profiles(os.path.join(cacheDir, 'profiles'))
+    if previous:
+        print('\nagainst the previous run:\n%s' % compare_reports(previous, reportPath).round(4).to_string())
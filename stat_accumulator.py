@@ -0,0 +1,143 @@
+# import sys, time, tracemalloc, numpy and pandas
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from nflgame_fetch import statAttrs
+
+# Columns of the player stat table: text columns interned to integer codes, counting stats (of which sacks can be
+# halves, shared with another defender) and the season / week
+playerCodeCols = ['playerName', 'position', 'team', 'playerID']
+playerStatCols = [c for c in statAttrs if c not in playerCodeCols]
+playerFloatCols = ['defenseSk']
+playerKeyCols = ['season', 'week']
+
+
+# Typed columnar table that rows are appended to: one NumPy array per column, doubled in capacity when full (so
+# appends are amortized O(1)), with the values of codeCols interned to int32 codes (-1 for a missing value)
+class StatAccumulator:
+
+    def __init__(self, codeCols=playerCodeCols, intCols=None, smallCols=playerKeyCols, floatCols=playerFloatCols,
+                 capacity=1024):
+        if intCols is None:
+            intCols = [c for c in playerStatCols if c not in floatCols]
+        self.dtypes = dict([(c, np.int32) for c in codeCols] + [(c, np.int32) for c in intCols] +
+                           [(c, np.float32) for c in floatCols] + [(c, np.int16) for c in smallCols])
+        self.arrays = {c: np.zeros(capacity, dtype=dtype) for c, dtype in self.dtypes.items()}
+        self.codes = {c: {} for c in codeCols}
+        self.n = 0
+
+    # Grow every array to hold at least size rows
+    def _reserve(self, size):
+        capacity = len(next(iter(self.arrays.values())))
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for c, array in self.arrays.items():
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:self.n] = array[:self.n]
+            self.arrays[c] = grown
+
+    # Return the codes of values in column col, adding new values to its table (None is -1 and not added, which
+    # pd.Categorical.from_codes reads as missing)
+    def intern(self, col, values):
+        table = self.codes[col]
+        return [-1 if v is None else table.setdefault(v, len(table)) for v in values]
+
+    # Append one row (a dictionary with every column; missing stats count as 0)
+    def append(self, row):
+        self.extend([row])
+
+    # Append rows (dictionaries with every column, e.g. the player games of nflgame_fetch.fetch_weeks), converting
+    # each column of the batch in one step
+    def extend(self, rows):
+        rows = rows if isinstance(rows, list) else list(rows)
+        start, end = self.n, self.n + len(rows)
+        self._reserve(end)
+        for c in self.dtypes:
+            values = [row.get(c) for row in rows]
+            if c in self.codes:
+                values = self.intern(c, values)
+            else:
+                values = np.nan_to_num(np.asarray(values, dtype=np.float64)).astype(self.dtypes[c])
+            self.arrays[c][start:end] = values
+        self.n = end
+
+    # Hand the table to pandas without copying the counting columns (each is a view of the accumulator's array);
+    # interned columns become Categoricals over their codes (pandas narrows the codes to the smallest integer type)
+    def frame(self):
+        data = {}
+        for c in self.dtypes:
+            if c in self.codes:
+                categories = pd.Index(list(self.codes[c]), dtype=object)
+                data[c] = pd.Categorical.from_codes(self.arrays[c][:self.n], categories=categories)
+            else:
+                data[c] = self.arrays[c][:self.n]
+        return pd.DataFrame(data, copy=False)
+
+
+# Build the original dict of lists and data frame from the rows, as nfl v11.py did
+def _dict_of_lists(rows):
+    stats = {c: [] for c in playerCodeCols + playerStatCols + playerKeyCols}
+    for row in rows:
+        for c in stats:
+            stats[c].append(row[c])
+    return pd.DataFrame(stats)
+
+
+# Compare time and peak memory of the dict of lists and StatAccumulator for a three season player table of
+# synthetic player games
+# Usage: python stat_accumulator.py [player games per week]
+if __name__ == '__main__':
+    perWeek = int(sys.argv[1]) if len(sys.argv) > 1 else 1500
+    rng = np.random.default_rng(0)
+    teams = ['ARI', 'ATL', 'BAL', 'BUF', 'CAR', 'CHI', 'CIN', 'CLE', 'DAL', 'DEN', 'DET', 'GB', 'HOU', 'IND', 'JAX',
+             'KC', 'LA', 'LAC', 'MIA', 'MIN', 'NE', 'NO', 'NYG', 'NYJ', 'OAK', 'PHI', 'PIT', 'SEA', 'SF', 'TB', 'TEN',
+             'WAS']
+    rows = [dict({c: int(v) for c, v in zip(playerStatCols, rng.integers(0, 30, len(playerStatCols)))},
+                 playerName='P.Player%d' % p, position='RB', team=teams[p % 32], playerID='00-%07d' % p,
+                 season=season, week=week)
+            for season in range(2017, 2020) for week in range(1, 18)
+            for p in rng.choice(3000, perWeek, replace=False)]
+
+    # Half sacks, and team-only or unknown position rows that nflgame returns with missing text values
+    for i, row in enumerate(rows[:300]):
+        row['defenseSk'] = i % 4 / 2
+        if i % 10 == 0:
+            row.update(playerName=None, position=None, playerID=None)
+        elif i % 10 == 1:
+            row.update(position=None, team=None)
+
+    # Build the player table from the rows with StatAccumulator
+    def _accumulate(rows):
+        acc = StatAccumulator()
+        acc.extend(rows)
+        return acc, acc.frame()
+
+    results = {}
+    for name, build in [('dict of lists', lambda r: (None, _dict_of_lists(r))), ('StatAccumulator', _accumulate)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        acc, df = build(rows)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = df
+        print('%-16s %d rows: %.2fs, peak %.1f MB, frame %.1f MB'
+              % (name, len(df), elapsed, peak / 2 ** 20, df.memory_usage(deep=True).sum() / 2 ** 20))
+
+    assert np.shares_memory(results['StatAccumulator'].rushingYd.values, acc.arrays['rushingYd'])
+    # Half sacks keep their half and missing text values come back as missing
+    accumulated, listed = results['StatAccumulator'], results['dict of lists']
+    halves = (listed.defenseSk % 1 == 0.5).values
+    assert halves.any() and (accumulated.defenseSk.values[halves] == listed.defenseSk.values[halves]).all()
+    for c in playerCodeCols:
+        assert (accumulated[c].isnull() == listed[c].isnull()).all()
+    assert accumulated.playerName.isnull().any()
+    pd.testing.assert_frame_equal(results['StatAccumulator'].astype({c: object for c in playerCodeCols}),
+                                  results['dict of lists'].astype({c: object for c in playerCodeCols}),
+                                  check_dtype=False)
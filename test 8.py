@@ -1,263 +1,45 @@
-# import pandas as pd, urllib, numpy as np, and matplotlib.pyplot
+# import pandas as pd and matplotlib.pyplot
 import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
-import statsmodels.api as sm
-from scipy.interpolate import interp1d
-
-# Read .csv of play by play data into data frame (pbp)
-pbp = pd.read_csv('/Users/samgreen/Desktop/Python/pbp-2019.csv', index_col='playID')
-
-# Change order of columns in pbp
-pbp = pbp[['gameID',
-           'gameDate',
-           'quarter',
-           'minute',
-           'second',
-           'offTeam',
-           'defTeam',
-           'down',
-           'toGo',
-           'yardLine',
-           'seriesFirstDown',
-           'nextScore',
-           'description',
-           'teamWin',
-           'seasonYear',
-           'yards',
-           'formation',
-           'playType',
-           'isRush',
-           'isPass',
-           'isIncomplete',
-           'passType',
-           'isSack',
-           'isChallenge',
-           'isChallengeReversed',
-           'challenger',
-           'isMeasurement',
-           'isInterception',
-           'isFumble',
-           'isPenalty',
-           'isTwoPointConversion',
-           'isTwoPointConversionSuccessful',
-           'rushDirection',
-           'yardLineFixed',
-           'yardLineDirection',
-           'isPenaltyAccepted',
-           'penaltyTeam',
-           'isNoPlay',
-           'penaltyType',
-           'penaltyYards']]
-
-# Create a copy of pbp called otherPlays containing all rows from pbp of playType != RUSH or PASS
-otherPlays = pbp[pbp.playType != 'RUSH']
-otherPlays = otherPlays[otherPlays.playType != 'PASS']
-
-# Create a copy of pbp called rushingPlays, which contains all data from pbp for rushing plays only
-rushingPlays = pbp[pbp.playType == 'RUSH']
-
-# Extract rushingPlayerName from play description and drop into a new column of rushingPlays
-rushingPlays['rushingPlayerName'] = rushingPlays.description.str.extract('\d-(.+?)\s')
-
-# Strip '.' from end of rushingPlayerName elements
-rushingPlays.rushingPlayerName = rushingPlays.rushingPlayerName.str.rstrip('.')
-
-# Create a copy of pbp called passingPlays, which contains all data from pbp for passing plays only
-passingPlays = pbp[pbp.playType == 'PASS']
-
-# Extract rushingPlayerName from play description and drop into a new column of rushingPlays
-passingPlays['passingPlayerName'] = passingPlays.description.str.extract('\d-(.+?)\s')
-passingPlays['targetPlayerName1'] = passingPlays.description.str.extract('\w\w\s\d+-(.+?)\s')
-passingPlays.targetPlayerName1 = passingPlays.targetPlayerName1.str.rstrip('.')
-passingPlays['targetPlayerName2'] = passingPlays.description.str.extract('\w\w\s\d+-(.+?)\W$')
-targetPlayerIsNull = passingPlays.targetPlayerName1.isnull()
-passingPlays['targetPlayerIsNull'] = targetPlayerIsNull
-passingPlays['targetPlayerName'] = (1 - passingPlays.targetPlayerIsNull) * passingPlays.targetPlayerName1 + \
-                                   passingPlays.targetPlayerIsNull * passingPlays.targetPlayerName2
-passingPlays = passingPlays.drop(['targetPlayerIsNull', 'targetPlayerName1', 'targetPlayerName2'], axis=1)
-
-# Merge passingPlays and rushingPlays
-allPlays = pd.concat([rushingPlays, passingPlays, otherPlays], ignore_index=False, sort=False)
-
-# Drop 'challenger' (empty column) of allPlays
-allPlays = allPlays.drop('challenger', axis=1)
-
-# Create binary column for whether a pass attempt was completed (isComplete)
-allPlays['isComplete'] = allPlays.isPass - allPlays.isIncomplete
-
-# Create binary column for whether a timeout was called on the play
-timeout = allPlays.description.str.contains('TIMEOUT')
-allPlays['isTimeout'] = timeout.astype(int)
-
-# Create binary column for whether a play is a two minute warning
-twoMinWarning = allPlays.description.str.contains('TWO-MINUTE WARNING')
-allPlays['isTwoMinWarning'] = twoMinWarning.astype(int)
-
-# Create binary column for whether a play is the end of a quarter
-qtrEnds = allPlays.description.str.contains('END QUARTER')
-qtrEnds1 = allPlays.description.str.contains('END OF QUARTER')
-allPlays['isQtrEnd'] = qtrEnds.astype(int) + qtrEnds1.astype(int)
-
-# Create binary column for isTouchdown (rows with TOUCHDOWN included in description)
-touchdowns = allPlays.description.str.contains('TOUCHDOWN')
-allPlays['isTouchdown'] = touchdowns.astype(int)
-
-# Create binary column for isExtraPoint (rows with EXTRA POINT included in description)
-extraPointAtt = allPlays.description.str.contains('EXTRA POINT')
-allPlays['isExtraPointAtt'] = extraPointAtt.astype(int)
-
-# Create binary column for isExtraPointSuccessful (rows with EXTRA POINT IS GOOD included in description)
-extraPointSuccessful = allPlays.description.str.contains('EXTRA POINT IS GOOD')
-allPlays['isExtraPointSuccessful'] = extraPointSuccessful.astype(int)
-
-# Create binary column for isFieldGoalSuccessful (rows with FIELD GOAL IS GOOD included in description)
-isFieldGoalSuccessful = allPlays.description.str.contains('FIELD GOAL IS GOOD')
-allPlays['isFieldGoalSuccessful'] = isFieldGoalSuccessful.astype(int)
-
-# Create binary column for isFieldGoalSuccessful (rows with FIELD GOAL IS GOOD included in description)
-isSafety = allPlays.description.str.contains(', SAFETY')
-allPlays['isSafety'] = isSafety.astype(int)
-
-# Calculate and insert column into allPlays for qtrSecRem, halfSecRem and
-allPlays['qtrSecRem'] = allPlays.minute * 60 + allPlays.second
-
-# Calculate and insert column into allPlays for gamSecRem
-allPlays['gmSecRem'] = (4 - allPlays.quarter) * 900 + allPlays.qtrSecRem
-
-# Create dictionary by quarter that maps max seconds remaining in half to a new column (halfSecRemBeg)
-timeMapQtr = {1: 1800, 2: 900, 3: 1800, 4: 900}
-allPlays['halfSecRemBeg'] = allPlays.quarter.map(timeMapQtr)
-
-# Calculate and insert column into allPlays for halfSecRem
-allPlays['halfSecRem'] = allPlays.halfSecRemBeg - 900 + allPlays.qtrSecRem
-
-# Drop halfSecRemBeg column -- no longer of use
-allPlays = allPlays.drop('halfSecRemBeg', axis=1)
-
-# Read .csv of 2019 schedule (sched) indexed by gameID into data frame (sched)
-sched = pd.read_csv('/Users/samgreen/PycharmProjects/nfl1/2019_NFL_SCHEDULE.csv', index_col='gameID')
-
-# Merge sched and allPlays based on gameID and drop Date column from sched
-allPlays = pd.merge(allPlays, sched, on=['gameID']).drop(['Date'], axis=1)
-
-# Sort allPlays for print and analysis
-allPlays = allPlays.sort_values(by=['gameID', 'gameDate', 'quarter', 'minute', 'second', 'down'],
-                                ascending=[True, True, True, False, False, True])
-
-# Add column with binary indication of whether play was in red zone
-allPlays['isGoalToGo'] = allPlays.yardLine >= 90
-allPlays.isGoalToGo = allPlays.isGoalToGo.astype(int)
-
-# Add column with binary indication of whether play was in red zone
-allPlays['isRedZone'] = allPlays.yardLine > 80
-allPlays.isRedZone = allPlays.isRedZone.astype(int)
-
-# Add binary column for whether halfSecRem <= 120 (2 min)
-allPlays['isUTM'] = allPlays.halfSecRem <= 120
-allPlays.isUTM = allPlays.isUTM.astype(int)
-
-# Calculate scoring impact of each play in new column (scorePlay) in allPlays
-allPlays['scorePlay'] = allPlays.isTouchdown * 6 + \
-                        allPlays.isExtraPointSuccessful * 1 + \
-                        allPlays.isTwoPointConversionSuccessful * 2 + \
-                        allPlays.isSafety * 2 + \
-                        allPlays.isFieldGoalSuccessful * 3
-
-# Establish binary columns in allPlays for whether homeTeam or awayTeam on offense
-homeTeamPoss = allPlays.offTeam == allPlays.homeTeam
-allPlays['homeTeamPoss'] = homeTeamPoss
-allPlays.homeTeamPoss = allPlays.homeTeamPoss.astype(int)
-allPlays['awayTeamPoss'] = 1 - allPlays.homeTeamPoss
-
-# Attribute scorePlay to one of two new columns: one for home team score and the other for away team score
-allPlays['homeScorePlay'] = allPlays.homeTeamPoss * allPlays.scorePlay
-allPlays['awayScorePlay'] = allPlays.awayTeamPoss * allPlays.scorePlay
-
-# Calculate cumulative sum of home and away team scoring plays by gameID
-allPlays['homeScoreCum'] = allPlays.groupby(['gameID'])['homeScorePlay'].cumsum()
-allPlays['awayScoreCum'] = allPlays.groupby(['gameID'])['awayScorePlay'].cumsum()
-
-# Calculate score differential for home team and away team by play
-allPlays['homeScoreDiff'] = allPlays.homeScoreCum - allPlays.awayScoreCum
-allPlays['awayScoreDiff'] = allPlays.homeScoreDiff * -1
-
-# Calculate score differential for offensive team and defensive team
-allPlays['offScoreDiff'] = allPlays.homeScoreDiff * allPlays.homeTeamPoss
-allPlays['absScoreDiff'] = np.sqrt(allPlays.offScoreDiff ** 2).astype(int)
-
-# Find index and associate scorePlay value of each non-zero instance in scorePlay
-allPlays.scorePlay = allPlays.scorePlay.replace({0: np.nan})
-
-# Establish binary column for whether a play is a scoring play and replace 0 with NaN
-allPlays['isScore'] = allPlays.isTouchdown * 1 + \
-                      allPlays.isExtraPointSuccessful * 1 + \
-                      allPlays.isTwoPointConversionSuccessful * 1 + \
-                      allPlays.isSafety * 1 + \
-                      allPlays.isFieldGoalSuccessful * 1
-
-# Establish new column in allPlays indicating the scoring team (scoreTeam) for each scoring play (isScore)
-allPlays['scoreTeam'] = allPlays.isScore * allPlays.offTeam
-allPlays.scoreTeam = allPlays.scoreTeam.replace({0: np.nan})
-
-# Create dictionary to codify teams numerically
-teamCodeMap = {'ARI': 1, 'ATL': 2, 'BAL': 3, 'BUF': 4, 'CAR': 5, 'CHI': 6, 'CIN': 7, 'CLE': 8, 'DAL': 9, 'DEN': 10,
-               'DET': 11, 'GB': 12, 'HOU': 13, 'IND': 14, 'JAX': 15, 'KC': 16, 'LA': 17, 'LAC': 18, 'MIA': 19,
-               'MIN': 20, 'NE': 21, 'NO': 22, 'NYG': 23, 'NYJ': 24, 'OAK': 25, 'PHI': 26, 'PIT': 27, 'SEA': 28,
-               'SF': 29, 'TB': 30, 'TEN': 31, 'WAS': 32}
-
-# Map scoreTeam, offTeam and defTeam by code using teamCodeMap
-allPlays['scoreTeamCode'] = allPlays.scoreTeam.map(teamCodeMap)
-allPlays['offTeamCode'] = allPlays.offTeam.map(teamCodeMap)
-allPlays['defTeamCode'] = allPlays.defTeam.map(teamCodeMap)
-
-# Back fill nextScore and nextScoreTeamCode w/ non-null values by gameID from scorePlay and scoreTeamCode, respectively
-for g in allPlays.gameID:
-    allPlays.nextScore = allPlays.scorePlay.bfill()
-    allPlays['nextScoreTeamCode'] = allPlays.scoreTeamCode.bfill()
-
-# Establish binary column for whether offTeamCode == nextScoreTeamCode
-nextScoreOffTeam = allPlays.offTeamCode == allPlays.nextScoreTeamCode
-allPlays['isNextScoreOffTeam'] = nextScoreOffTeam
-allPlays.isNextScoreOffTeam = allPlays.isNextScoreOffTeam.astype(int)
-
-# Establish binary column for whether defTeamCode == nextScoreTeamCode based on allPlays.isNextScoreOffTeam
-allPlays['isNextScoreDefTeam'] = (1 - allPlays.isNextScoreOffTeam) * -1
-
-# Apply sum of isNextScoreOffTeam and isNextScoreDefTeam to nextScore such that
-# nextScore is negative in rows where offTeam != nextScoreTeam
-# nextScore is positive in rows where offTeam == nextScoreTeam
-allPlays.nextScore = (allPlays.isNextScoreDefTeam + allPlays.isNextScoreOffTeam) * allPlays.nextScore
-
-# Export data frames to a csv files
-rushing_export_csv = rushingPlays.to_csv('rushing_export_dataframe.csv', index=True, header=True, index_label='playID')
-passing_export_csv = passingPlays.to_csv('passing_export_dataframe.csv', index=True, header=True, index_label='playID')
-all_export_csv = allPlays.to_csv('all_export_dataframe.csv', index=True, header=True, index_label='playID')
-
-# Create new data frame (epPlaySet) equal to allPlays where quarter != 2, 4 or 5
-epPlaySet = allPlays[allPlays.quarter != 2]
-epPlaySet = epPlaySet[epPlaySet.quarter != 4]
-epPlaySet = epPlaySet[epPlaySet.quarter != 5]
-
-# Drop all rows from epPlaySet with playType of KICK OFF
-epPlaySet = epPlaySet.drop(epPlaySet[epPlaySet.playType == 'KICK OFF'].index)
-
-# Drop all rows from epPlaySet with isTwoMinWarning == 1
-epPlaySet = epPlaySet.drop(epPlaySet[epPlaySet.isTwoMinWarning == 1].index)
-
-# Drop all rows from epPlaySet with absScoreDiff > 10
-epPlaySet = epPlaySet.drop(epPlaySet[epPlaySet.absScoreDiff > 10].index)
-
-# Drop all rows from epPlaySet with offTeam of KICK OFF
-epPlaySet = epPlaySet.drop(epPlaySet[epPlaySet.isNoPlay == 1].index)
-
-# Establish binary column for whether offTeam is null
-isOffTeamNull = epPlaySet.offTeam.isnull()
-epPlaySet['offTeamIsNull'] = isOffTeamNull
-epPlaySet.offTeamIsNull = epPlaySet.offTeamIsNull.astype(int)
-
-# Drop all rows where offTeam is null
-epPlaySet = epPlaySet.drop(epPlaySet[epPlaySet.offTeamIsNull == 1].index)
+from all_plays import ep_play_set
+from ep_curves import EPCurves, yardLines
+from game_store import GameStore
+from pbp_cache import load_all_plays
+from play_export import view, write_table
+from stage_profiler import StageProfiler
+from wp_model import WPModel, add_wp
+
+# Build the enriched play by play data frame (allPlays) from the play by play and 2019 schedule csv files,
+# or memory-map it from the Parquet cache when neither the csv files nor the derivation code have changed
+# Every stage's wall time, rows and memory are written to pipeline_profile.json (StageProfiler(cprofile=True,
+# tracemalloc=True) adds each stage's top functions and allocations; compare_reports compares two runs)
+profiler = StageProfiler()
+pbpPath = '/Users/samgreen/Desktop/Python/pbp-2019.csv'
+schedPath = '/Users/samgreen/PycharmProjects/nfl1/2019_NFL_SCHEDULE.csv'
+allPlays = load_all_plays(pbpPath, schedPath, profiler=profiler)
+profiler.save('pipeline_profile.json')
+
+# Keep the schedule in a GameStore: plays carry only gameID, week and homeTeam, and the other game columns (winner,
+# points, yards, ...) are looked up by gameID when needed
+games = GameStore.from_source(pbpPath, schedPath)
+
+# Create views of allPlays called rushingPlays and passingPlays containing rushing and passing plays only
+rushingPlays = view(allPlays, 'rushing')
+passingPlays = view(allPlays, 'passing')
+
+# Export allPlays and the games once to compressed Parquet files (GameStore.load reads the games back); the rushing,
+# passing and EP play sets are read back from allPlays as filtered views (read_view(path, 'rushing'), 'passing' or
+# 'ep'), and write_csv writes a csv in chunks when needed
+write_table(allPlays, 'all_plays.parquet')
+games.save('games.parquet')
+
+# Create new data frame (epPlaySet) equal to allPlays where quarter != 2, 4 or 5, dropping kick offs, two minute
+# warnings, no plays, plays with absScoreDiff > 10 and plays where offTeam is null
+epPlaySet = ep_play_set(allPlays)
+
+# Attach the game columns of the export to epPlaySet
+epPlaySet = games.attach(epPlaySet, ['time', 'awayTeam', 'winner', 'loser', 'isTie', 'ptsWinner', 'ptsLoser',
+                                     'ydWinner', 'turnoversWinner', 'ydLoser', 'turnoversLoser'])
 
 # Reorder columns in epPlaySet
 epPlaySet = epPlaySet[['gameID',
@@ -346,9 +128,6 @@ epPlaySet = epPlaySet[['gameID',
                        'isRedZone',
                        'isUTM']]
 
-# Export data frames to a csv files
-ep_export_csv = epPlaySet.to_csv('ep_export_dataframe.csv', index=True, header=True, index_label='playID')
-
 # Create new data frames for each down from epPlaySet
 epPlaySet1down = epPlaySet[epPlaySet.down == 1]
 epPlaySet2down = epPlaySet[epPlaySet.down == 2]
@@ -391,28 +170,33 @@ plt.xlabel('Yard Line (0-100)')
 plt.ylabel('Expected Points')
 plt.title('Fourth Down')
 
-# Implement locally weighted regression (lowess) on ep1downFrame to smooth data
-lowess = sm.nonparametric.lowess(ep1downFrame.yardLine, ep1downFrame.EP, frac=1)
-lowess_x = list(zip(*lowess))[0]
-lowess_y = list(zip(*lowess))[1]
-lowess1down = pd.DataFrame({'yardLine': lowess_y, 'EP': lowess_x})
-lowess1downInterp = interp1d(lowess1down.yardLine, lowess1down.EP, 'linear')
-print(lowess1downInterp)
+# Smooth EP by yardLine for all four downs in one call (Gaussian kernel weighted line fits over the yardLine bins,
+# weighted by plays) into curves that interpolate between yardLines
+epCurves = EPCurves.fit(allPlays)
+epCurves.save('ep_curves.npz')
+epCurvesFrame = pd.DataFrame(epCurves.curves.T, index=yardLines,
+                             columns=['First Down', 'Second Down', 'Third Down', 'Fourth Down'])
+print(epCurvesFrame)
 
-# Produce lowess scatter plot for EP by down by yardLine on 1st down
-lowess1down.plot(kind='line', x='yardLine', y='EP')
+# Produce smoothed line plot for EP by down by yardLine
+epCurvesFrame.plot(kind='line')
 plt.xlabel('Yard Line (0-100)')
 plt.ylabel('Expected Points')
-plt.title('First Down')
+plt.title('Smoothed EP by Down')
 plt.show()
 
+# Fit the win probability (WP) model to allPlays, add each play's WP (offense and home team) and save the model so
+# later plays are scored without a refit
+wpModel = WPModel.fit(allPlays, games)
+wpModel.save('wp_model.npz')
+allPlays = add_wp(allPlays, wpModel)
+print(allPlays[['gameID', 'quarter', 'minute', 'second', 'offTeam', 'offScoreDiff', 'wp', 'homeWP']].head(n=20))
+
 
 # -----------------------------------------------------------------
 #  TO DOs:
 #  --------
 #   Add isSnap (or some way to calculate snap counts)
-#   lowess and linear interpolation
-#   Winning probability (WP) by play
 #   Address error message:   SettingWithCopyWarning
 #                               A value is trying to be set on a copy of a slice from a DataFrame.
 #                               Try using .loc[row_indexer,col_indexer] = value instead
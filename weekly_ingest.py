@@ -0,0 +1,242 @@
+# import pandas, numpy, os and time
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import pbp_cache
+from all_plays import add_score_diffs, build_all_plays, ep_play_mask, ep_play_set, read_source, scoreCols
+from ep_curves import EPCurves
+from next_score import add_next_score, halfMapQtr
+
+# Columns written by add_next_score
+nextScoreCols = ['nextScore', 'nextScoreTeamCode', 'isNextScoreOffTeam', 'isNextScoreDefTeam']
+
+
+# Count and sum nextScore by down and yardLine over the epPlaySet rows of plays (the inputs of the EP tables)
+def ep_totals(plays):
+    plays = plays[ep_play_mask(plays)]
+    return plays.nextScore.groupby([plays.down, plays.yardLine]).agg(['count', 'sum'])
+
+
+# Sum rushing, passing and receiving attempts and yards by player name over plays
+# Each role is one grouped sum over a frame of its counting columns (attempts as ones), not a named aggregation
+def player_totals(plays):
+    rushes = (plays.playType == 'RUSH').values
+    passes = (plays.playType == 'PASS').values
+    yards = plays.yards.values
+    complete = plays.isComplete.values
+    rushing = pd.DataFrame({'rushingAtt': 1, 'rushingYd': yards[rushes]}) \
+        .groupby(plays.rushingPlayerName.values[rushes]).sum()
+    passing = pd.DataFrame({'passingAtt': 1, 'passingComp': complete[passes], 'passingYd': yards[passes]}) \
+        .groupby(plays.passingPlayerName.values[passes]).sum()
+    receiving = pd.DataFrame({'receivingTar': 1, 'receivingRec': complete[passes], 'receivingYd': yards[passes]}) \
+        .groupby(plays.targetPlayerName.values[passes]).sum()
+    totals = pd.concat([rushing, passing, receiving], axis=1).fillna(0)
+    totals.index.name = 'playerName'
+    return totals
+
+
+# Return the rows of plays with no later scoring play in the same game and half (their nextScore may still change
+# when more plays of the game arrive), keeping only each game's last half
+def pending_rows(plays):
+    half = plays.quarter.map(halfMapQtr)
+    isScore = (plays.scorePlay > 0).astype(int)
+    laterScores = isScore.iloc[::-1].groupby([plays.gameID.iloc[::-1], half.iloc[::-1]]).cumsum().iloc[::-1]
+    lastHalf = half.groupby(plays.gameID).transform('max')
+    return plays[(laterScores == 0) & (half == lastHalf)]
+
+
+# Running state of allPlays that a new week of plays is appended to
+# allPlays is held as a list of weekly chunks so an append never copies the history. Per-game state (last
+# homeScoreCum / awayScoreCum and the plays still waiting for a next score) lets a game continue across appends,
+# and the EP tables and player aggregates are kept as running sums
+class WeeklyState:
+
+    # Start from an enriched allPlays, e.g. from pbp_cache.load_all_plays; cachePath is the partitioned Parquet
+    # directory that save() updates
+    def __init__(self, allPlays, cachePath=None):
+        self.chunks = []
+        self.chunkKeys = []
+        self.dirty = set()
+        self.cachePath = cachePath
+        self.epTotals = ep_totals(allPlays.iloc[:0])
+        self.playerTotals = player_totals(allPlays.iloc[:0])
+        self.gameScores = pd.DataFrame(columns=['homeScoreCum', 'awayScoreCum'], dtype='int64')
+        self.pending = {}
+        self._add_chunk(allPlays)
+        self.dirty.clear()
+
+    # Concatenate the chunks into one allPlays data frame
+    @property
+    def allPlays(self):
+        return pd.concat(self.chunks)
+
+    # Return expected points by yardLine (rows) and down (columns), i.e. the mean nextScore of epPlaySet
+    def ep_table(self):
+        totals = self.epTotals[self.epTotals['count'] > 0]
+        return (totals['sum'] / totals['count']).unstack('down')
+
+    # Refit the smoothed EP curves of all four downs from the running EP totals (see ep_curves.smooth_bins)
+    def ep_curves(self, method='local_linear', bandwidth=10):
+        return EPCurves.from_totals(self.epTotals, method, bandwidth)
+
+    # Build the new week's plays from its pbp and sched frames and append them
+    # Games already in the state continue their cumulative scores (unless pbp supplies the running scores, which
+    # already count the earlier plays), and their plays still waiting for a next score are relabeled from the new plays
+    def append_week(self, pbp, sched):
+        newPlays = build_all_plays(pbp, sched)
+        carried = newPlays.gameID.isin(self.gameScores.index)
+        if carried.any():
+            newPlays = self._carry_forward(newPlays, carried, offset=not set(scoreCols) <= set(pbp.columns))
+        self._add_chunk(newPlays, carried)
+        return newPlays
+
+    # Offset the cumulative scores of carried games (when offset) and re-run add_next_score over their pending plays
+    def _carry_forward(self, newPlays, carried, offset=True):
+        if offset:
+            offsets = self.gameScores.reindex(newPlays.gameID).fillna(0)
+            newPlays['homeScoreCum'] = newPlays.homeScoreCum + offsets.homeScoreCum.values.astype(int)
+            newPlays['awayScoreCum'] = newPlays.awayScoreCum + offsets.awayScoreCum.values.astype(int)
+            newPlays = add_score_diffs(newPlays)
+
+        # Relabel pending plays of carried games together with the new plays of those games
+        games = newPlays.gameID[carried].unique()
+        pending = [(c, labels) for g in games for c, labels in self.pending.get(g, [])]
+        oldPlays = pd.concat([self.chunks[c].loc[labels] for c, labels in pending]) if pending else newPlays.iloc[:0]
+        relabeled = add_next_score(pd.concat([oldPlays, newPlays[carried]]))
+        newPlays.loc[carried, nextScoreCols] = relabeled[nextScoreCols].values[len(oldPlays):]
+
+        # Swap the old labels of pending plays for the new ones in the chunks and the EP totals (one change of totals)
+        if len(oldPlays):
+            self.epTotals = self.epTotals.add(ep_totals(relabeled.iloc[:len(oldPlays)]).sub(ep_totals(oldPlays),
+                                                                                             fill_value=0),
+                                              fill_value=0)
+        for c, labels in pending:
+            self.chunks[c].loc[labels, nextScoreCols] = relabeled.loc[labels, nextScoreCols]
+            self.dirty.add(c)
+
+        # Plays of carried games that are still pending after the relabel (the new chunk's are added later)
+        stillPending = pending_rows(relabeled).index
+        for g in games:
+            self.pending[g] = [(c, labels[labels.isin(stillPending)]) for c, labels in self.pending.get(g, [])]
+        return newPlays
+
+    # Append plays as a new chunk and add them to the running totals and per-game state
+    def _add_chunk(self, plays, carried=None):
+        c = len(self.chunks)
+        self.chunks.append(plays)
+        self.chunkKeys.append(set(plays[pbp_cache.partitionCols].drop_duplicates().itertuples(index=False)))
+        self.dirty.add(c)
+        self._add_totals(plays, 1)
+
+        # Last cumulative scores by game
+        last = plays.groupby('gameID')[['homeScoreCum', 'awayScoreCum']].last()
+        self.gameScores = pd.concat([self.gameScores[~self.gameScores.index.isin(last.index)], last])
+
+        # Pending plays by game; a carried game keeps its older pending plays only if they are in the same half
+        newPending = pending_rows(plays)
+        for g, rows in newPending.groupby('gameID'):
+            half = halfMapQtr.get(rows.quarter.iloc[0])
+            older = []
+            if carried is not None and g in self.pending:
+                older = [(k, labels) for k, labels in self.pending[g]
+                         if len(labels) and halfMapQtr.get(self.chunks[k].quarter.loc[labels[0]]) == half]
+            self.pending[g] = older + [(c, rows.index)]
+        for g in set(plays.gameID.unique()) - set(newPending.gameID.unique()):
+            self.pending[g] = []
+
+    # Add (sign 1) or remove (sign -1) the contribution of plays to the EP and player totals
+    def _add_totals(self, plays, sign, players=True):
+        if len(plays) == 0:
+            return
+        self.epTotals = self.epTotals.add(ep_totals(plays) * sign, fill_value=0)
+        if players:
+            self.playerTotals = self.playerTotals.add(player_totals(plays) * sign, fill_value=0)
+
+    # Write the seasonYear / week partitions touched since the last save into cachePath
+    def save(self):
+        keys = set().union(*[self.chunkKeys[c] for c in self.dirty])
+        offset = np.cumsum([0] + [len(chunk) for chunk in self.chunks])
+        frames, order = [], []
+        for c, chunk in enumerate(self.chunks):
+            if not self.chunkKeys[c] & keys:
+                continue
+            inKeys = pd.MultiIndex.from_frame(chunk[pbp_cache.partitionCols]).isin(list(keys))
+            frames.append(chunk[inKeys])
+            order.append(offset[c] + np.flatnonzero(inKeys))
+        if frames:
+            pbp_cache.write_partitions(pd.concat(frames), self.cachePath, np.concatenate(order))
+        self.dirty.clear()
+
+
+# Check an incremental build against a full build on the bundled csv, appending the second half of the last week 1
+# game and then week 2 to the rest of week 1, and time the appends against a full rebuild
+if __name__ == '__main__':
+    pbp, sched = read_source('pbp-2019_v2.csv')
+    week = sched.week.reindex(pbp.gameID).values
+    lastGame = (pbp.gameID == pbp.gameID[week == 1].max()).values
+    secondHalf = lastGame & pbp.quarter.isin([3, 4, 5]).values
+    parts = [(week == 1) & ~secondHalf, secondHalf, week == 2]
+
+    state = WeeklyState(build_all_plays(pbp[parts[0]], sched), cachePath=os.path.join(pbp_cache.cacheDir, 'weekly'))
+    appendTimes = []
+    for part in parts[1:]:
+        start = time.perf_counter()
+        state.append_week(pbp[part], sched)
+        appendTimes.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    full = build_all_plays(pbp, sched)
+    fullTime = time.perf_counter() - start
+
+    incremental = state.allPlays.loc[full.index]
+    for col in ['homeScoreCum', 'awayScoreCum', 'offScoreDiff'] + nextScoreCols:
+        pd.testing.assert_series_equal(incremental[col], full[col], check_dtype=False)
+    fullEp = ep_play_set(full).groupby(['down', 'yardLine']).nextScore.mean().unstack('down')
+    pd.testing.assert_frame_equal(state.ep_table(), fullEp, check_names=False, check_dtype=False)
+    pd.testing.assert_frame_equal(state.playerTotals.sort_index(), player_totals(full).sort_index(),
+                                  check_dtype=False)
+    start = time.perf_counter()
+    curves = state.ep_curves()
+    curvesTime = time.perf_counter() - start
+    np.testing.assert_allclose(curves.curves, EPCurves.fit(full).curves)
+
+    # The bundled season is two weeks, so building a part costs about as much as building all of it (the build is
+    # fixed overhead at this size) and an append cannot beat a full build here
+    print('incremental == full build; bundled season: appends %s s vs full build %.3f s; EP curves refit %.1f ms'
+          % (', '.join('%.3f' % t for t in appendTimes), fullTime, curvesTime * 1000))
+
+    # On a season-sized history (copies of the bundled season under new gameIDs) the appends beat rebuilding the
+    # state (allPlays, EP and player totals) from every play, which is what they replace
+    copies = 16
+
+    # Return copies of pbp and sched under new gameIDs (and playIDs), the first copy being the bundled games
+    def _replicate(pbp, sched, copies):
+        pbps = [pbp.assign(gameID=pbp.gameID + c * 10 ** 10).set_axis(pbp.index + c * 10 ** 14) for c in range(copies)]
+        scheds = [sched.set_axis(sched.index + c * 10 ** 10) for c in range(copies)]
+        return pd.concat(pbps), pd.concat(scheds)
+
+    history, bigSched = _replicate(pbp[parts[0]], sched, copies)
+    rest = pbp[parts[1] | parts[2]]
+    bigPbp = pd.concat([history, rest])
+    appendTimes, rebuildTimes = [], []
+    for _ in range(3):
+        state = WeeklyState(build_all_plays(history, bigSched))
+        times = []
+        for part in parts[1:]:
+            start = time.perf_counter()
+            state.append_week(pbp[part], bigSched)
+            times.append(time.perf_counter() - start)
+        appendTimes.append(times)
+        start = time.perf_counter()
+        rebuilt = WeeklyState(build_all_plays(bigPbp, bigSched))
+        rebuildTimes.append(time.perf_counter() - start)
+    appendTimes, rebuildTime = np.min(appendTimes, axis=0), min(rebuildTimes)
+    incremental = state.allPlays.loc[rebuilt.allPlays.index]
+    for col in ['homeScoreCum', 'awayScoreCum'] + nextScoreCols:
+        pd.testing.assert_series_equal(incremental[col], rebuilt.allPlays[col], check_dtype=False)
+    print('%d plays: appends %s s vs rebuilding the state %.3f s'
+          % (len(bigPbp), ', '.join('%.3f' % t for t in appendTimes), rebuildTime))
+    assert appendTimes.max() < rebuildTime
@@ -0,0 +1,166 @@
+# import os, sys, time, numpy and pandas
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Features of the win probability model, all from the offense's point of view
+wpFeatures = ['intercept', 'scoreDiff', 'scoreDiffTime', 'timeLeft', 'yardLine', 'logToGo', 'down2', 'down3',
+              'down4', 'noDown', 'isHome', 'timeoutDiff', 'timeoutDiffLate']
+
+
+# Build the feature matrix of plays (columns offScoreDiff, gmSecRem, down, toGo, yardLine, homeTeamPoss and, when
+# present, offTimeoutsRem / defTimeoutsRem, which count as 3 each when missing)
+def wp_features(plays):
+    timeouts = [plays[c].values if c in plays else None for c in ['offTimeoutsRem', 'defTimeoutsRem']]
+    return state_features(plays.offScoreDiff.values, plays.gmSecRem.values, plays.down.values, plays.toGo.values,
+                          plays.yardLine.values, plays.homeTeamPoss.values, *timeouts)
+
+
+# Build the feature matrix from arrays of the same values (scalars give one row, for scoring a live play)
+# scoreDiffTime is the score differential scaled up as the game runs out (1 / sqrt of the share of the game left), so
+# a lead weighs more late; timeoutDiffLate is the timeout difference in the last 10 minutes
+def state_features(offScoreDiff, gmSecRem, down, toGo, yardLine, homeTeamPoss, offTimeoutsRem=None,
+                   defTimeoutsRem=None):
+    scoreDiff = np.atleast_1d(np.asarray(offScoreDiff, dtype=np.float64)) / 7
+    X = np.empty((len(scoreDiff), len(wpFeatures)))
+    timeLeft = np.clip(np.asarray(gmSecRem, dtype=np.float64), 0, 3600) / 3600
+    down = np.asarray(down, dtype=np.float64)
+    toGo = np.asarray(toGo, dtype=np.float64)
+    yardLine = np.asarray(yardLine, dtype=np.float64)
+    timeoutDiff = 0
+    if offTimeoutsRem is not None:
+        offTimeoutsRem = np.asarray(offTimeoutsRem, dtype=np.float64)
+        timeoutDiff = np.where(np.isnan(offTimeoutsRem), 3, offTimeoutsRem)
+    if defTimeoutsRem is not None:
+        defTimeoutsRem = np.asarray(defTimeoutsRem, dtype=np.float64)
+        timeoutDiff = timeoutDiff - np.where(np.isnan(defTimeoutsRem), 3, defTimeoutsRem)
+    elif offTimeoutsRem is not None:
+        timeoutDiff = timeoutDiff - 3
+    X[:, 0] = 1
+    X[:, 1] = scoreDiff
+    X[:, 2] = scoreDiff / np.sqrt(timeLeft + 0.01)
+    X[:, 3] = timeLeft
+    X[:, 4] = np.where(np.isnan(yardLine), 25, yardLine) / 100
+    X[:, 5] = np.log(np.clip(np.where(np.isnan(toGo), 10, toGo), 1, 99))
+    X[:, 6] = down == 2
+    X[:, 7] = down == 3
+    X[:, 8] = down == 4
+    X[:, 9] = ~((down >= 1) & (down <= 4))
+    X[:, 10] = homeTeamPoss
+    X[:, 11] = timeoutDiff
+    X[:, 12] = timeoutDiff * (timeLeft < 1 / 6)
+    return X
+
+
+# Return whether each play's offense won its game (0.5 for ties; NaN where the game has no winner recorded), with the
+# winner and isTie of each play's game looked up by gameID in games (a game_store.GameStore)
+def offense_won(plays, games):
+    results = games.lookup(plays.gameID.values, ['winner', 'isTie'])
+    won = np.where(plays.offTeam.values == results.winner.values, 1.0, 0.0)
+    won[results.isTie.values == 1] = 0.5
+    won[pd.isnull(results.winner.values) | pd.isnull(plays.offTeam.values)] = np.nan
+    return won
+
+
+# Return the coefficients of a logistic regression of y on the columns of X (the first being the intercept), fitted
+# by batched Newton (IRLS) steps on the whole matrix
+# ridge: L2 penalty on the coefficients (not the intercept), which keeps rare feature combinations stable
+def fit_logistic(X, y, ridge=1.0, maxIter=25, tol=1e-8):
+    penalty = np.full(X.shape[1], ridge)
+    penalty[0] = 0
+    coef = np.zeros(X.shape[1])
+    for _ in range(maxIter):
+        p = 1 / (1 + np.exp(-X @ coef))
+        w = p * (1 - p)
+        gradient = X.T @ (y - p) - penalty * coef
+        hessian = (X * w[:, None]).T @ X + np.diag(penalty)
+        step = np.linalg.solve(hessian, gradient)
+        coef += step
+        if np.abs(step).max() < tol:
+            break
+    return coef
+
+
+# Logistic win probability model over wp_features, fitted to every play by fit_logistic, so scoring a season is one
+# matrix product
+class WPModel:
+
+    def __init__(self, coef, features=wpFeatures):
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.features = list(features)
+
+    # Fit the model to the plays of allPlays with an offense, a winner (looked up in games, a game_store.GameStore)
+    # and a clock (ridge, maxIter and tol as in fit_logistic)
+    @classmethod
+    def fit(cls, allPlays, games, ridge=1.0, maxIter=25, tol=1e-8):
+        won = offense_won(allPlays, games)
+        keep = ~np.isnan(won) & allPlays.gmSecRem.notnull().values & allPlays.offScoreDiff.notnull().values
+        return cls(fit_logistic(wp_features(allPlays[keep]), won[keep], ridge, maxIter, tol))
+
+    # Win probability of the offense of each play
+    def wp(self, plays):
+        return 1 / (1 + np.exp(-wp_features(plays) @ self.coef))
+
+    # Win probability of the offense in one state (scalars, or arrays, of the state_features arguments)
+    def wp_state(self, *state):
+        return 1 / (1 + np.exp(-state_features(*state) @ self.coef))
+
+    # Write the coefficients to an .npz file
+    def save(self, path):
+        np.savez_compressed(path, coef=self.coef, features=np.array(self.features))
+
+    # Read a model written by save
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['coef'], data['features'].tolist())
+
+
+# Add wp (the offense's win probability) and homeWP (the home team's) to allPlays; both are NaN on plays without an
+# offense (timeouts, ends of quarters), as in live_feed.LiveProcessor
+def add_wp(allPlays, model):
+    allPlays = allPlays.copy()
+    allPlays['wp'] = np.where(allPlays.offTeam.notnull(), model.wp(allPlays), np.nan)
+    allPlays['homeWP'] = np.where(allPlays.homeTeamPoss == 1, allPlays.wp, 1 - allPlays.wp)
+    return allPlays
+
+
+# Fit the model to the bundled season, compare it with nflscrapR's wp, time scoring a replicated season and round trip
+# the model through an .npz file
+# Usage: python wp_model.py [path to nflscrapR pbp csv]
+if __name__ == '__main__':
+    from game_store import GameStore
+    from pbp_cache import cacheDir, load_all_plays
+    from pbp_loader import load_pbp
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'pbp-2019_v2.csv'
+    allPlays = load_all_plays(path)
+    games = GameStore.from_csv(path)
+    start = time.perf_counter()
+    model = WPModel.fit(allPlays, games)
+    fitTime = time.perf_counter() - start
+    print(pd.Series(model.coef, index=model.features).round(3).to_string())
+
+    pbp = load_pbp(path, columns=['game_id', 'play_id', 'wp'])
+    reference = pd.Series(pbp.wp.astype('float64').values,
+                          index=pbp.game_id.astype('int64').values * 10000 + pbp.play_id.astype('int64').values)
+    scored = add_wp(allPlays, model)
+    assert scored.wp.isnull().equals(allPlays.offTeam.isnull()) and scored.homeWP.isnull().equals(scored.wp.isnull())
+    both = pd.DataFrame({'wp': scored.wp, 'nflscrapR': reference.reindex(scored.index)}).dropna()
+    won = offense_won(scored, games)
+    seen = ~np.isnan(won)
+    print('fit %.1f ms; r with nflscrapR wp %.3f; Brier score %.3f (nflscrapR %.3f)'
+          % (fitTime * 1000, both.wp.corr(both.nflscrapR), np.mean((scored.wp.values[seen] - won[seen]) ** 2),
+             np.nanmean((reference.reindex(scored.index).values[seen] - won[seen]) ** 2)))
+
+    season = pd.concat([allPlays] * 16, ignore_index=True)
+    start = time.perf_counter()
+    model.wp(season)
+    print('scored %d plays in %.1f ms' % (len(season), (time.perf_counter() - start) * 1000))
+
+    os.makedirs(cacheDir, exist_ok=True)
+    model.save(os.path.join(cacheDir, 'wp_model.npz'))
+    np.testing.assert_array_equal(add_wp(allPlays, WPModel.load(os.path.join(cacheDir, 'wp_model.npz'))).wp, scored.wp)